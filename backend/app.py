@@ -1,29 +1,157 @@
 import os
 import json
-from flask import Flask, request, jsonify, send_file
+import time
+import mimetypes
+import unicodedata
+from urllib.parse import quote
+from flask import Flask, request, jsonify, send_file, g, Response
 from werkzeug.utils import secure_filename
 from knowledge_base import KnowledgeBaseManager
+import bulk_upload
+import document_processor
 from chat_engine import ChatEngine
+from conversation_memory import HistoryCursorMismatch
 from llm_interface.llm_selector import llm
+from llm_interface.scheduler import SchedulerOverloaded
+import tracing
+import profiling
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'data/uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16 MB max upload
+app.config['BULK_MAX_CONTENT_LENGTH'] = int(os.getenv('BULK_MAX_UPLOAD_MB', '1024')) * 1024 * 1024
+app.config['CHAT_BATCH_MAX_QUESTIONS'] = int(os.getenv('CHAT_BATCH_MAX_QUESTIONS', '1000'))
+
+# Let the front proxy serve previews: FILE_SENDFILE=x-sendfile (Apache/lighttpd) or
+# X_ACCEL_REDIRECT_PREFIX=/protected-uploads/ (nginx internal location mapped to UPLOAD_FOLDER)
+app.config['USE_X_SENDFILE'] = os.getenv('FILE_SENDFILE') == 'x-sendfile'
+app.config['X_ACCEL_REDIRECT_PREFIX'] = os.getenv('X_ACCEL_REDIRECT_PREFIX')
 
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
 # Initialize knowledge base manager
 kb_manager = KnowledgeBaseManager()
 chat_engine = ChatEngine(kb_manager)
+profiler = profiling.Profiler.from_env()
 
 # Valid file extensions
 ALLOWED_EXTENSIONS = {
     'pdf', 'doc', 'docx', 'txt', 'csv', 'xls', 'xlsx'
 }
 
+# File types the browser can display inline when previewed
+INLINE_PREVIEW_EXTENSIONS = {'pdf', 'txt'}
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def content_disposition(disposition, download_name):
+    """Content-Disposition options, with an RFC 5987 filename* for non-ASCII names"""
+    try:
+        download_name.encode('ascii')
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', download_name).encode('ascii', 'ignore').decode('ascii')
+        return disposition, {'filename': simple, 'filename*': f"UTF-8''{quote(download_name, safe='')}"}
+    return disposition, {'filename': download_name}
+
+def warm_up():
+    """
+    Import document parsers and LLM clients ahead of the first request
+    Heavy modules are otherwise loaded lazily; call this from a preloading server
+    (e.g. gunicorn --preload) or set WARM_UP=1 so forked workers start warm
+    """
+    document_processor.warm_up()
+    llm.warm_up()
+
+if os.getenv('WARM_UP') == '1':
+    warm_up()
+
+# Report LLM calls (latency, token estimates) to the tracing module
+llm.add_observer(tracing.observe_llm_call)
+llm.scheduler.add_observer(tracing.observe_llm_queue)
+
+# LLM admission control rejected the call: fail fast instead of queueing
+@app.errorhandler(SchedulerOverloaded)
+def handle_llm_overload(e):
+    response = jsonify({"error": "服务繁忙，请稍后重试", "priority": e.priority})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(max(1, int(e.budget or 1)))
+    return response
+
+# The client's history cursor is stale (or from another server): it must resend the full history
+@app.errorhandler(HistoryCursorMismatch)
+def handle_history_mismatch(e):
+    response = jsonify({"error": "对话历史已过期，请发送完整的对话历史",
+                        "conversationId": e.conversation_id, "historyCursor": e.cursor})
+    response.status_code = 412
+    return response
+
+@app.before_request
+def start_request_timer():
+    if tracing.is_enabled():
+        g.request_start = time.monotonic()
+
+# Opt-in sampling profile of this request (admin header or PROFILE_SAMPLE_RATE)
+@app.before_request
+def start_request_profile():
+    if profiler.should_profile(request.headers.get(profiling.PROFILE_HEADER)):
+        g.profile = profiler.start(f"{request.method} {request.path}", request.headers.get('X-Request-Id'))
+
+@app.after_request
+def finish_request_profile(response):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profiler.finish(profile)
+        response.headers['X-Profile-Id'] = profile.profile_id
+    return response
+
+@app.teardown_request
+def stop_request_profile(exc):
+    # after_request is skipped when the view raised
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profiler.finish(profile)
+
+@app.after_request
+def record_request_duration(response):
+    if tracing.is_enabled() and 'request_start' in g:
+        tracing.HTTP_DURATION.observe(
+            time.monotonic() - g.request_start,
+            endpoint=request.endpoint or 'unknown',
+            method=request.method,
+            status=response.status_code
+        )
+    return response
+
+# Metrics endpoint (Prometheus text format)
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(tracing.render_prometheus(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+# Stored request profiles (collapsed stacks and SVG flamegraphs)
+@app.route('/api/profiles', methods=['GET'])
+def list_profiles():
+    if profiler.admin_token is None:
+        return jsonify({"error": "性能分析接口未启用"}), 404
+    if not profiler.is_admin(request.headers.get(profiling.PROFILE_HEADER)):
+        return jsonify({"error": "无权访问性能分析数据"}), 403
+    return jsonify(profiler.list())
+
+@app.route('/api/profiles/<profile_id>/<fmt>', methods=['GET'])
+def download_profile(profile_id, fmt):
+    if profiler.admin_token is None:
+        return jsonify({"error": "性能分析接口未启用"}), 404
+    if not profiler.is_admin(request.headers.get(profiling.PROFILE_HEADER)):
+        return jsonify({"error": "无权访问性能分析数据"}), 403
+    
+    path = profiler.path(profile_id, fmt)
+    if path is None:
+        return jsonify({"error": "性能分析数据不存在"}), 404
+    
+    return send_file(os.path.abspath(path), mimetype=profiling.PROFILE_FORMATS[fmt],
+                     as_attachment=request.args.get('download') == '1',
+                     download_name=f"{profile_id}.{fmt}")
+
 # Knowledge base endpoints
 @app.route('/api/knowledge-bases', methods=['GET'])
 def get_knowledge_bases():
@@ -34,11 +162,15 @@ def get_knowledge_bases():
 def create_knowledge_base():
     data = request.json
     name = data.get('name')
+    storage = data.get('storage', 'sqlite')
     
     if not name:
         return jsonify({"error": "知识库名称不能为空"}), 400
     
-    knowledge_base = kb_manager.create_knowledge_base(name)
+    try:
+        knowledge_base = kb_manager.create_knowledge_base(name, storage)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     return jsonify(knowledge_base)
 
 @app.route('/api/knowledge-bases/<kb_id>', methods=['GET'])
@@ -124,6 +256,51 @@ def upload_file(kb_id):
     
     return jsonify(file_info)
 
+# Bulk upload: many files and/or zip/tar archives in one request, processed in parallel
+@app.route('/api/knowledge-bases/<kb_id>/files/bulk', methods=['POST'])
+def upload_files_bulk(kb_id):
+    # Larger limit than single uploads; must be set before the form is parsed
+    request.max_content_length = app.config['BULK_MAX_CONTENT_LENGTH']
+    
+    kb = kb_manager.get_knowledge_base(kb_id)
+    if not kb:
+        return jsonify({"error": "知识库不存在"}), 404
+    
+    files = [file for file in request.files.getlist('files') if file.filename]
+    if not files:
+        return jsonify({"error": "未找到文件"}), 400
+    
+    kb_dir = os.path.join(app.config['UPLOAD_FOLDER'], kb_id)
+    os.makedirs(kb_dir, exist_ok=True)
+    
+    uploads = []
+    skipped = []
+    for file in files:
+        if bulk_upload.is_archive(file.filename):
+            try:
+                saved, archive_skipped = bulk_upload.extract_archive(file.stream, file.filename, kb_dir, allowed_file)
+            except Exception as e:
+                skipped.append({"name": file.filename, "status": "failed", "error": f"压缩包解压失败：{str(e)}"})
+                continue
+            uploads.extend(saved)
+            skipped.extend(archive_skipped)
+        elif allowed_file(file.filename):
+            file_path = bulk_upload.save_stream(file.stream, kb_dir, bulk_upload.member_filename(file.filename))
+            uploads.append((os.path.basename(file_path), file_path))
+        else:
+            skipped.append({"name": file.filename, "status": "skipped", "error": "不支持的文件类型"})
+    
+    results = kb_manager.add_files(kb_id, uploads) if uploads else []
+    results.extend(skipped)
+    
+    return jsonify({
+        "total": len(results),
+        "succeeded": sum(1 for result in results if result["status"] == "ok"),
+        "failed": sum(1 for result in results if result["status"] == "failed"),
+        "skipped": sum(1 for result in results if result["status"] == "skipped"),
+        "files": results
+    })
+
 @app.route('/api/knowledge-bases/<kb_id>/files/<file_id>', methods=['DELETE'])
 def delete_file(kb_id, file_id):
     success = kb_manager.delete_file(kb_id, file_id)
@@ -144,8 +321,46 @@ def preview_file(kb_id, file_id):
     if not os.path.exists(file_path):
         return jsonify({"error": "文件不存在"}), 404
     
-    # Return file for download/preview
-    return send_file(file_path, as_attachment=True, download_name=file_info["name"])
+    # Strong ETag from the stored content hash; send_file answers Range and
+    # If-None-Match / If-Range requests (206 / 304) against it
+    etag = kb_manager.get_content_hash(file_info)
+    as_attachment = (request.args.get('download') == '1' or
+                     file_info.get('type') not in INLINE_PREVIEW_EXTENSIONS)
+    
+    if app.config['X_ACCEL_REDIRECT_PREFIX']:
+        return offload_to_proxy(file_path, file_info["name"], etag, as_attachment)
+    
+    return send_file(file_path, as_attachment=as_attachment, download_name=file_info["name"],
+                     conditional=True, etag=etag)
+
+def offload_to_proxy(file_path, download_name, etag, as_attachment):
+    """Hand the file body to nginx via X-Accel-Redirect; nginx serves ranges itself"""
+    relative_path = os.path.relpath(file_path, app.config['UPLOAD_FOLDER']).replace(os.sep, '/')
+    response = Response(mimetype=mimetypes.guess_type(download_name)[0] or 'application/octet-stream')
+    response.headers['X-Accel-Redirect'] = app.config['X_ACCEL_REDIRECT_PREFIX'].rstrip('/') + '/' + quote(relative_path)
+    disposition, options = content_disposition('attachment' if as_attachment else 'inline', download_name)
+    response.headers.set('Content-Disposition', disposition, **options)
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+@app.route('/api/knowledge-bases/<kb_id>/files/<file_id>/thumbnail', methods=['GET'])
+def file_thumbnail(kb_id, file_id):
+    file_info = kb_manager.get_file(kb_id, file_id)
+    if not file_info:
+        return jsonify({"error": "文件不存在"}), 404
+    
+    # First page of a PDF, rendered once and cached by content hash
+    thumbnail_path = kb_manager.get_thumbnail(kb_id, file_id)
+    if not thumbnail_path:
+        return jsonify({"error": "该文件没有缩略图"}), 404
+    
+    etag = kb_manager.get_content_hash(file_info) + '-thumbnail'
+    return send_file(thumbnail_path, mimetype='image/png', conditional=True, etag=etag, max_age=86400)
+
+# LLM provider routing state (latency, error rate, circuit breakers)
+@app.route('/api/llm/routing', methods=['GET'])
+def get_llm_routing():
+    return jsonify(llm.get_routing_state())
 
 # Chat endpoint
 @app.route('/api/chat', methods=['POST'])
@@ -155,19 +370,84 @@ def chat():
     # Extract parameters
     question = data.get('question')
     kb_id = data.get('knowledgeBaseId')
+    kb_ids = data.get('knowledgeBaseIds')
     conversation_id = data.get('conversationId')
     history = data.get('history', [])
+    # Instead of the full history, clients may send the cursor (ETag) of the last answer
+    history_cursor = data.get('historyCursor') or request.headers.get('If-Match', '').strip('"') or None
     
     if not question:
         return jsonify({"error": "问题不能为空"}), 400
     
+    # Several knowledge bases can be queried together with knowledgeBaseIds
+    if kb_ids:
+        if not isinstance(kb_ids, list) or not all(isinstance(i, str) for i in kb_ids):
+            return jsonify({"error": "knowledgeBaseIds 必须是知识库ID列表"}), 400
+        kb_id = kb_ids
+    
     if not kb_id:
         return jsonify({"error": "知识库ID不能为空"}), 400
     
+    # Optionally return per-stage timings with the answer
+    include_timings = bool(data.get('timings')) or request.args.get('timings') == '1'
+    
     # Process query
-    result = chat_engine.query(kb_id, question, conversation_id, history)
+    if include_timings:
+        trace_token = tracing.start_trace()
+        try:
+            result = chat_engine.query(kb_id, question, conversation_id, history, history_cursor)
+        finally:
+            timings = tracing.end_trace(trace_token)
+        result["timings"] = timings
+    else:
+        result = chat_engine.query(kb_id, question, conversation_id, history, history_cursor)
+    
+    response = jsonify(result)
+    if result.get("historyCursor"):
+        response.headers['ETag'] = f'"{result["historyCursor"]}"'
+    return response
+
+# Batch questions: answers are streamed as NDJSON lines as they complete
+@app.route('/api/chat/batch', methods=['POST'])
+def chat_batch():
+    data = request.json or {}
+    
+    questions = data.get('questions')
+    kb_id = data.get('knowledgeBaseIds') or data.get('knowledgeBaseId')
+    
+    if not isinstance(questions, list) or not questions or not all(isinstance(q, str) and q.strip() for q in questions):
+        return jsonify({"error": "questions 必须是非空的问题列表"}), 400
+    if len(questions) > app.config['CHAT_BATCH_MAX_QUESTIONS']:
+        return jsonify({"error": f"每批最多 {app.config['CHAT_BATCH_MAX_QUESTIONS']} 个问题"}), 400
+    if not kb_id:
+        return jsonify({"error": "知识库ID不能为空"}), 400
+    
+    kb_ids = [kb_id] if isinstance(kb_id, str) else kb_id
+    if not isinstance(kb_ids, list) or not all(isinstance(i, str) for i in kb_ids):
+        return jsonify({"error": "knowledgeBaseIds 必须是知识库ID列表"}), 400
+    if not all(kb_manager.get_knowledge_base(i) for i in kb_ids):
+        return jsonify({"error": "知识库不存在"}), 404
+    
+    concurrency = data.get('concurrency')
+    if concurrency is not None and (not isinstance(concurrency, int) or concurrency < 1):
+        return jsonify({"error": "concurrency 必须是正整数"}), 400
+    
+    def generate():
+        for result in chat_engine.query_batch(kb_ids, questions, concurrency):
+            yield json.dumps(result, ensure_ascii=False, default=str) + "\n"
+    
+    return Response(generate(), mimetype='application/x-ndjson')
+
+# Conversation memory: rolling summary, recent turns and the current history cursor
+@app.route('/api/conversations/<conversation_id>', methods=['GET'])
+def get_conversation(conversation_id):
+    if conversation_id not in chat_engine.memory:
+        return jsonify({"error": "对话不存在"}), 404
     
-    return jsonify(result)
+    conversation = chat_engine.memory.get(conversation_id)
+    conversation["conversationId"] = conversation_id
+    conversation["historyCursor"] = chat_engine.memory.cursor(conversation_id)
+    return jsonify(conversation)
 
 if __name__ == '__main__':
     app.run(debug=True) 
\ No newline at end of file
@@ -0,0 +1,255 @@
+import os
+import mmap
+import uuid
+import struct
+import shutil
+import hashlib
+import threading
+from typing import Dict, List, Optional, Iterator, Tuple
+
+# File layout: header, index entries sorted by key hash, then the entry payloads
+#   header: magic, entry count
+#   index:  (key hash, payload offset, payload length) per entry
+#   entry:  key length, key bytes, value bytes
+MAGIC = b'IAX1'
+HEADER = struct.Struct('<4sI')
+INDEX_ENTRY = struct.Struct('<QQI')
+KEY_LENGTH = struct.Struct('<I')
+
+POINTER_FILE = 'CURRENT'
+
+
+def _hash_key(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class _Mapping:
+    """One memory-mapped artifact version, shared by all readers in the process"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.refs = 0
+        self.retired = False
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.count = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            self.mm.close()
+            raise ValueError(f"Not an artifact file: {path}")
+
+    def hash_at(self, i: int) -> int:
+        """Key hash of the i-th index entry, read from the mapping (no per-process copy of the index)"""
+        return INDEX_ENTRY.unpack_from(self.mm, HEADER.size + i * INDEX_ENTRY.size)[0]
+
+    def find(self, key_hash: int) -> int:
+        """Position of the first index entry with a hash >= key_hash (binary search over the mapping)"""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.hash_at(middle) < key_hash:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def close(self) -> None:
+        self.mm.close()
+
+
+# Per-process registry: artifact directory -> (pointer stamp, current mapping)
+_current: Dict[str, Tuple[tuple, _Mapping]] = {}
+_lock = threading.Lock()
+
+
+class ArtifactReader:
+    """
+    Read access to one version of an artifact
+    Holds a reference on the mapping until closed; use as a context manager
+    """
+
+    def __init__(self, mapping: _Mapping):
+        self._mapping = mapping
+        self.version = os.path.basename(mapping.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def __len__(self) -> int:
+        return self._mapping.count
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Value stored under a key, or None"""
+        mapping = self._mapping
+        key_hash = _hash_key(key)
+        key_bytes = key.encode('utf-8')
+
+        i = mapping.find(key_hash)
+        while i < mapping.count and mapping.hash_at(i) == key_hash:
+            stored_key, value = self._entry(i)
+            if stored_key == key_bytes:
+                return value
+            i += 1
+        return None
+
+    def items(self) -> Iterator[Tuple[str, bytes]]:
+        """All entries, in index order"""
+        for i in range(self._mapping.count):
+            key, value = self._entry(i)
+            yield key.decode('utf-8'), value
+
+    def close(self) -> None:
+        if self._mapping is not None:
+            _release(self._mapping)
+            self._mapping = None
+
+    def _entry(self, i: int) -> Tuple[bytes, bytes]:
+        mm = self._mapping.mm
+        _, offset, length = INDEX_ENTRY.unpack_from(mm, HEADER.size + i * INDEX_ENTRY.size)
+        (key_length,) = KEY_LENGTH.unpack_from(mm, offset)
+        key_start = offset + KEY_LENGTH.size
+        return mm[key_start:key_start + key_length], mm[key_start + key_length:offset + length]
+
+
+def _release(mapping: _Mapping) -> None:
+    with _lock:
+        mapping.refs -= 1
+        if mapping.retired and mapping.refs == 0:
+            mapping.close()
+
+
+class ArtifactStore:
+    """
+    Immutable, versioned key/value files that every worker process memory-maps
+    Each publish writes a new version and atomically swaps the CURRENT pointer;
+    readers pick up the new version on their next open, and a process unmaps the
+    old version once its last reader is closed
+    """
+
+    def __init__(self, root_dir: str):
+        """Initialize the store with the directory holding the artifacts"""
+        self.root_dir = root_dir
+
+    def get_artifact_dir(self, name: str) -> str:
+        """Directory holding the versions of an artifact; names may contain '/'"""
+        return os.path.join(self.root_dir, *name.split('/'))
+
+    def publish(self, name: str, entries: Dict[str, bytes], keep: int = 2) -> str:
+        """
+        Write a new version of an artifact and make it current
+        Older versions beyond `keep` are deleted; processes that still map them
+        keep a valid mapping until they unmap it
+        """
+        artifact_dir = self.get_artifact_dir(name)
+        os.makedirs(artifact_dir, exist_ok=True)
+
+        records = sorted(((_hash_key(key), key.encode('utf-8'), value) for key, value in entries.items()),
+                         key=lambda record: record[0])
+
+        version = f"v{uuid.uuid1().hex}.bin"
+        path = os.path.join(artifact_dir, version)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, len(records)))
+            offset = HEADER.size + len(records) * INDEX_ENTRY.size
+            for key_hash, key_bytes, value in records:
+                length = KEY_LENGTH.size + len(key_bytes) + len(value)
+                f.write(INDEX_ENTRY.pack(key_hash, offset, length))
+                offset += length
+            for _, key_bytes, value in records:
+                f.write(KEY_LENGTH.pack(len(key_bytes)))
+                f.write(key_bytes)
+                f.write(value)
+        os.replace(tmp_path, path)
+
+        # Swap the pointer atomically
+        pointer_tmp = os.path.join(artifact_dir, f"{POINTER_FILE}.{uuid.uuid4().hex}.tmp")
+        with open(pointer_tmp, 'w', encoding='utf-8') as f:
+            f.write(version)
+        os.replace(pointer_tmp, os.path.join(artifact_dir, POINTER_FILE))
+
+        self._prune(artifact_dir, keep)
+        return version
+
+    def open(self, name: str) -> Optional[ArtifactReader]:
+        """Open the current version of an artifact, or None if it was never published"""
+        artifact_dir = self.get_artifact_dir(name)
+        pointer_path = os.path.join(artifact_dir, POINTER_FILE)
+
+        for _ in range(3):
+            try:
+                stat = os.stat(pointer_path)
+            except FileNotFoundError:
+                return None
+            stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+            with _lock:
+                current = _current.get(artifact_dir)
+                if current is not None and current[0] == stamp:
+                    mapping = current[1]
+                    mapping.refs += 1
+                    return ArtifactReader(mapping)
+
+                try:
+                    with open(pointer_path, 'r', encoding='utf-8') as f:
+                        version = f.read().strip()
+                    mapping = _Mapping(os.path.join(artifact_dir, version))
+                except FileNotFoundError:
+                    # Pointer swapped or version pruned while we looked; try again
+                    continue
+
+                if current is not None:
+                    self._retire(current[1])
+                _current[artifact_dir] = (stamp, mapping)
+                mapping.refs += 1
+                return ArtifactReader(mapping)
+
+        return None
+
+    def read(self, name: str, key: str) -> Optional[bytes]:
+        """Read a single value from the current version of an artifact"""
+        reader = self.open(name)
+        if reader is None:
+            return None
+        with reader:
+            return reader.get(key)
+
+    def delete(self, name: str) -> None:
+        """Delete an artifact (or every artifact under a name prefix)"""
+        artifact_dir = self.get_artifact_dir(name)
+        with _lock:
+            for path in [path for path in _current if path == artifact_dir or
+                         path.startswith(artifact_dir + os.sep)]:
+                self._retire(_current.pop(path)[1])
+        if os.path.isdir(artifact_dir):
+            shutil.rmtree(artifact_dir, ignore_errors=True)
+
+    @staticmethod
+    def mapped_versions() -> List[str]:
+        """Paths of the artifact versions currently mapped by this process"""
+        with _lock:
+            return [mapping.path for _, mapping in _current.values()]
+
+    @staticmethod
+    def _retire(mapping: _Mapping) -> None:
+        """Unmap a replaced version now, or when its last reader closes (caller holds _lock)"""
+        mapping.retired = True
+        if mapping.refs == 0:
+            mapping.close()
+
+    @staticmethod
+    def _prune(artifact_dir: str, keep: int) -> None:
+        versions = []
+        for file_name in os.listdir(artifact_dir):
+            if file_name.endswith('.bin'):
+                path = os.path.join(artifact_dir, file_name)
+                versions.append((os.path.getmtime(path), path))
+        for _, path in sorted(versions, reverse=True)[keep:]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,107 @@
+import os
+import shutil
+import tarfile
+import zipfile
+from typing import Callable, Dict, Iterator, List, IO, Tuple
+from werkzeug.utils import secure_filename
+
+# Limits for a single archive, so a small upload cannot expand without bound
+MAX_ARCHIVE_MEMBERS = int(os.getenv('BULK_MAX_ARCHIVE_MEMBERS', '10000'))
+MAX_EXTRACTED_MB = int(os.getenv('BULK_MAX_EXTRACTED_MB', '2048'))
+
+ARCHIVE_SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+
+def is_archive(filename: str) -> bool:
+    return filename.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def unique_path(directory: str, filename: str) -> str:
+    """A path in directory for filename that does not overwrite an existing file"""
+    stem, dot, extension = filename.rpartition('.')
+    if not dot:
+        stem, extension = filename, ''
+    path = os.path.join(directory, filename)
+    n = 1
+    while os.path.exists(path):
+        path = os.path.join(directory, f"{stem}_{n}{dot}{extension}")
+        n += 1
+    return path
+
+
+def member_filename(member_name: str) -> str:
+    """
+    Safe file name for an archive member or uploaded file
+    Directories are dropped; names secure_filename reduces to just an
+    extension (e.g. all-Chinese names) become file.<ext>
+    """
+    base = member_name.replace('\\', '/').rsplit('/', 1)[-1]
+    filename = secure_filename(base)
+    if '.' not in filename and '.' in base:
+        filename = secure_filename(f"file.{base.rsplit('.', 1)[1]}")
+    return filename
+
+
+def save_stream(stream: IO[bytes], directory: str, filename: str) -> str:
+    """Copy a stream into directory under a non-conflicting name; returns the path"""
+    path = unique_path(directory, filename)
+    with open(path, 'wb') as f:
+        shutil.copyfileobj(stream, f, length=1024 * 1024)
+    return path
+
+
+def extract_archive(archive: IO[bytes], archive_name: str, directory: str,
+                    allowed: Callable[[str], bool]) -> Tuple[List[Tuple[str, str]], List[Dict[str, str]]]:
+    """
+    Extract the supported files of a zip or tar archive into directory
+    Members are streamed to disk one at a time; nested paths are flattened
+    Returns ((filename, path) pairs, skipped members as {"name", "status", "error"})
+    """
+    saved = []
+    skipped = []
+    extracted = 0
+    count = 0
+
+    for name, open_member, size in _iter_members(archive, archive_name):
+        if _is_hidden(name):
+            continue
+
+        count += 1
+        if count > MAX_ARCHIVE_MEMBERS:
+            raise ValueError(f"压缩包文件数超过上限 {MAX_ARCHIVE_MEMBERS}")
+
+        filename = member_filename(name)
+        if not allowed(filename):
+            skipped.append({"name": name, "status": "skipped", "error": "不支持的文件类型"})
+            continue
+
+        extracted += size
+        if extracted > MAX_EXTRACTED_MB * 1024 * 1024:
+            raise ValueError(f"压缩包解压后超过 {MAX_EXTRACTED_MB} MB")
+
+        with open_member() as stream:
+            path = save_stream(stream, directory, filename)
+        saved.append((os.path.basename(path), path))
+
+    return saved, skipped
+
+
+def _iter_members(archive: IO[bytes], archive_name: str) -> Iterator[Tuple[str, Callable[[], IO[bytes]], int]]:
+    """(name, opener, size) of each regular file in an archive"""
+    if archive_name.lower().endswith('.zip'):
+        # Zip keeps its directory at the end, so it needs a seekable file
+        with zipfile.ZipFile(archive) as zf:
+            for info in zf.infolist():
+                if not info.is_dir():
+                    yield info.filename, lambda info=info: zf.open(info), info.file_size
+    else:
+        # Tar is read strictly sequentially from the upload stream
+        with tarfile.open(fileobj=archive, mode='r|*') as tf:
+            for member in tf:
+                if member.isfile():
+                    yield member.name, lambda member=member: tf.extractfile(member), member.size
+
+
+def _is_hidden(name: str) -> bool:
+    parts = name.replace('\\', '/').split('/')
+    return any(part.startswith('.') or part == '__MACOSX' for part in parts if part)
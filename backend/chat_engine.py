@@ -1,37 +1,116 @@
 import os
+import re
 import json
 import uuid
-from typing import Dict, List, Any, Optional
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed
+from typing import Dict, Iterator, List, Any, Optional, Union
 from knowledge_base import KnowledgeBaseManager
 from document_processor import DocumentProcessor
 from llm_interface.llm_selector import llm
+from llm_interface.scheduler import call_context, current_call_context, SchedulerOverloaded, PRIORITY_BATCH
+from conversation_memory import ConversationMemory
+import profiling
 from sql_query_engine import SQLQueryEngine
+from query_guard import QueryCostError, POLICY_REVISE
+from tracing import span
+
+# Files of a knowledge base considered when ranking retrieval candidates
+MAX_RANKED_FILES = 20
+
+# Definitions shared by the single and the batched classification prompts
+_QUERY_TYPES = ('简单查询: 直接从文档中检索单一事实或信息的查询。例如"产品X的尺寸是多少？"、"Y过程的步骤是什么？"\n'
+                '复杂查询: 需要跨表分析、统计、聚合、计数或比较的查询。例如"统计材质为玻璃的产品数量"、"价格在X范围内的型号有哪些？"')
+
+# One line of a batched classification answer: "3. 复杂"
+_BATCH_LABEL = re.compile(r'^\s*(\d+)\s*[.、:：)）]?\s*(简单|复杂|simple|complex)', re.I | re.M)
+
+
+def _terms(text: str) -> set:
+    """Search terms of a text: ASCII words (model numbers etc.) and CJK bigrams"""
+    text = text.lower()
+    words = re.findall(r'[a-z0-9][a-z0-9\-_.]*', text)
+    bigrams = [run[i:i + 2] for run in re.findall(r'[\u4e00-\u9fff]+', text)
+               for i in range(max(1, len(run) - 1))]
+    return set(words + bigrams)
+
+
+def _relevance(question: str, text: str) -> float:
+    """Share of the question's terms that occur in the text"""
+    terms = _terms(question)
+    if not terms:
+        return 0.0
+    text = text.lower()
+    return sum(1 for term in terms if term in text) / len(terms)
+
+
+def _rank(question: str, corpus: List[tuple], top_k: int) -> List[tuple]:
+    """Top-k (score, file, chunk) of a corpus of (file, chunk); stable for equal scores"""
+    ranked = [(_relevance(question, chunk), file, chunk) for file, chunk in corpus]
+    return sorted(ranked, key=lambda candidate: -candidate[0])[:top_k]
 
 class ChatEngine:
     """Handle chat interactions with the knowledge base"""
     
-    def __init__(self, kb_manager: KnowledgeBaseManager):
+    def __init__(self, kb_manager: KnowledgeBaseManager, speculative: Optional[bool] = None):
         self.kb_manager = kb_manager
-        self.conversations = {}  # Store conversation history
+        
+        # Recent turns verbatim plus a rolling summary of older ones, per conversation
+        self.memory = ConversationMemory(self._summarize_history)
         self.sql_engine = SQLQueryEngine()
+        
+        # Speculative mode runs classification, retrieval and SQL generation
+        # concurrently and discards the branch that loses
+        if speculative is None:
+            speculative = os.getenv('CHAT_SPECULATIVE', '0') == '1'
+        self.speculative = speculative
+        
+        # Cost cap: at most this many speculative SQL generations in flight
+        max_inflight = int(os.getenv('CHAT_SPECULATION_MAX_INFLIGHT', '4'))
+        self._speculation_slots = threading.BoundedSemaphore(max_inflight)
+        self._executor = ThreadPoolExecutor(max_workers=max_inflight * 3, 
+                                            thread_name_prefix='chat-speculation') if speculative else None
+        
+        # Answer point lookups ("YFR-150EX的底阀离地高度是多少？") from the entity index without the LLM
+        self.fast_path = os.getenv('CHAT_FAST_PATH', '1') == '1'
+        
+        # Fan-out pool for retrieval across several knowledge bases
+        self._retrieval_executor = ThreadPoolExecutor(max_workers=int(os.getenv('CHAT_RETRIEVAL_WORKERS', '8')),
+                                                      thread_name_prefix='chat-retrieval')
+        
+        # Batch questions: answers in flight per batch, and questions per classification call
+        self.batch_concurrency = int(os.getenv('CHAT_BATCH_CONCURRENCY', '4'))
+        self.batch_classify_size = int(os.getenv('CHAT_BATCH_CLASSIFY_SIZE', '50'))
     
-    def query(self, kb_id: str, question: str, conversation_id: Optional[str] = None, 
-              history: Optional[List[Dict[str, str]]] = None) -> Dict[str, Any]:
+    def query(self, kb_id: Union[str, List[str]], question: str, conversation_id: Optional[str] = None, 
+              history: Optional[List[Dict[str, str]]] = None, 
+              history_cursor: Optional[str] = None) -> Dict[str, Any]:
         """
-        Process a query against the knowledge base
+        Process a query against one or more knowledge bases
         
         Args:
-            kb_id: Knowledge base ID
+            kb_id: Knowledge base ID, or a list of IDs to query together
             question: User's question
             conversation_id: Optional conversation ID for context
-            history: Optional conversation history
+            history: Optional full conversation history, replacing the one held here
+            history_cursor: historyCursor of the previous answer, sent instead of the
+                full history; raises HistoryCursorMismatch if it is stale
             
         Returns:
             Dict with answer and related metadata
         """
-        # Validate knowledge base
-        kb = self.kb_manager.get_knowledge_base(kb_id)
-        if not kb:
+        # LLM calls keep the caller's priority (interactive by default) and are
+        # attributed to this knowledge base for fair scheduling
+        kb_ids = [kb_id] if isinstance(kb_id, str) else list(dict.fromkeys(kb_id))
+        priority, _ = current_call_context()
+        with call_context(priority, ",".join(kb_ids)):
+            return self._query(kb_ids, question, conversation_id, history, history_cursor)
+    
+    def _query(self, kb_ids: List[str], question: str, conversation_id: Optional[str], 
+               history: Optional[List[Dict[str, str]]], history_cursor: Optional[str]) -> Dict[str, Any]:
+        # Validate knowledge bases
+        if not kb_ids or not all(self.kb_manager.get_knowledge_base(kb_id) for kb_id in kb_ids):
             return {
                 "answer": "知识库不存在，请选择有效的知识库",
                 "error": True
@@ -40,126 +119,319 @@ class ChatEngine:
         # Create or retrieve conversation context
         if not conversation_id:
             conversation_id = str(uuid.uuid4())
-            self.conversations[conversation_id] = []
-        elif conversation_id not in self.conversations:
-            self.conversations[conversation_id] = []
         
-        # Update history if provided
+        # A full history replaces ours; a cursor must match the state we hold
         if history:
-            self.conversations[conversation_id] = history
+            self.memory.replace(conversation_id, history)
+        elif history_cursor is not None:
+            self.memory.check_cursor(conversation_id, history_cursor)
+        
+        conversation = self.memory.format_context(conversation_id)
         
         # Add current question to history
-        self.conversations[conversation_id].append({
-            "role": "user",
-            "content": question
-        })
+        self.memory.append(conversation_id, "user", question)
+        
+        # Exact lookups of a single cell skip classification and the LLM entirely
+        if self.fast_path and len(kb_ids) == 1:
+            with span("chat.fast_path") as fast_path_span:
+                lookup = self.sql_engine.entity_index.lookup(kb_ids[0], question)
+                fast_path_span.set(hit=lookup is not None)
+            
+            if lookup is not None:
+                answer = f"{lookup['entity']}的{lookup['column']}是{lookup['value']}。"
+                self.memory.append(conversation_id, "assistant", answer)
+                return {
+                    "answer": answer,
+                    "conversationId": conversation_id,
+                    "historyCursor": self.memory.cursor(conversation_id),
+                    "sources": [lookup["table"]],
+                    "isComplexQuery": False,
+                    "lookup": lookup
+                }
+        
+        # Start both branches alongside classification when speculation pays off
+        speculation = self._start_speculation(kb_ids, question, conversation) if self.speculative else None
         
         # Determine query type - simple or complex (SQL)
-        is_complex_query = self._is_complex_query(question)
+        with span("chat.classify", speculative=speculation is not None) as classify_span:
+            if speculation:
+                is_complex_query = speculation["classify"].result()
+            else:
+                is_complex_query = self._is_complex_query(question)
+            classify_span.set(is_complex=is_complex_query)
+        
+        if speculation:
+            # Discard the losing branch; a running LLM call finishes in the background
+            losing_branch = "context" if is_complex_query else "sql"
+            speculation[losing_branch].cancel()
         
         try:
             if is_complex_query:
-                answer, sources = self._handle_complex_query(kb_id, question)
+                answer, sources = self._handle_complex_query(kb_ids, question, speculation, conversation)
             else:
-                answer, sources = self._handle_simple_query(kb_id, question)
+                answer, sources = self._handle_simple_query(kb_ids, question, speculation, conversation)
             
             # Add answer to conversation history
-            self.conversations[conversation_id].append({
-                "role": "assistant", 
-                "content": answer
-            })
+            self.memory.append(conversation_id, "assistant", answer)
             
             return {
                 "answer": answer,
                 "conversationId": conversation_id,
+                "historyCursor": self.memory.cursor(conversation_id),
                 "sources": sources,
                 "isComplexQuery": is_complex_query
             }
             
+        except SchedulerOverloaded:
+            raise
         except Exception as e:
             error_message = f"处理查询时出错: {str(e)}"
             
-            # Add error to conversation history
-            self.conversations[conversation_id].append({
-                "role": "assistant", 
-                "content": error_message
-            })
-            
+            # Errors stay out of the history: it feeds later prompts and the rolling summary
             return {
                 "answer": error_message,
                 "conversationId": conversation_id,
+                "historyCursor": self.memory.cursor(conversation_id),
                 "error": True
             }
     
-    def _handle_simple_query(self, kb_id: str, question: str) -> tuple:
+    def query_batch(self, kb_id: Union[str, List[str]], questions: List[str], 
+                    max_concurrency: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Answer many independent questions against the same knowledge bases
+        Table metadata and retrieval files are loaded once, identical questions are
+        answered once, the questions are classified together in one LLM call and the
+        answers run concurrently (at most max_concurrency, default CHAT_BATCH_CONCURRENCY).
+        LLM calls use batch priority, so interactive chat is served first
+        
+        Yields one result per question as it completes, with its "index" in `questions`,
+        then a final {"done": True, ...} summary. If the batch fails part-way, every question
+        not yet answered gets an error result and the summary carries the "error"
+        """
+        kb_ids = [kb_id] if isinstance(kb_id, str) else list(dict.fromkeys(kb_id))
+        if not kb_ids or not all(self.kb_manager.get_knowledge_base(kb_id) for kb_id in kb_ids):
+            for index, question in enumerate(questions):
+                yield {"index": index, "question": question, "answer": "知识库不存在，请选择有效的知识库", "error": True}
+            yield {"done": True, "questions": len(questions), "unique": 0}
+            return
+        
+        # Identical questions (ignoring surrounding whitespace) share one answer
+        indices: Dict[str, List[int]] = {}
+        for index, question in enumerate(questions):
+            indices.setdefault(question.strip(), []).append(index)
+        
+        emitted = set()
+        
+        def results(question: str, result: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+            for position, index in enumerate(indices[question]):
+                emitted.add(index)
+                yield {"index": index, "question": questions[index], **result, "deduplicated": position > 0}
+        
+        max_workers = max(1, min(max_concurrency or self.batch_concurrency, self.batch_concurrency))
+        pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='chat-batch')
+        try:
+            with call_context(PRIORITY_BATCH, ",".join(kb_ids)), \
+                    span("chat.batch", questions=len(questions), unique=len(indices)):
+                # Exact lookups of a single cell need no LLM at all
+                lookups = {}
+                if self.fast_path and len(kb_ids) == 1:
+                    for question in indices:
+                        lookup = self.sql_engine.entity_index.lookup(kb_ids[0], question)
+                        if lookup is not None:
+                            lookups[question] = lookup
+                
+                pending = [question for question in indices if question not in lookups]
+                tables = self._get_tables(kb_ids)
+                corpus = self._load_corpus(kb_ids)
+                labels = self._classify_batch(pending) if pending else []
+                futures = {self._submit(self._answer_batch_question, kb_ids, question, is_complex, 
+                                        tables, corpus, executor=pool): question
+                           for question, is_complex in zip(pending, labels)}
+            
+            for question, lookup in lookups.items():
+                yield from results(question, {
+                    "answer": f"{lookup['entity']}的{lookup['column']}是{lookup['value']}。",
+                    "sources": [lookup["table"]],
+                    "isComplexQuery": False,
+                    "lookup": lookup
+                })
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {"answer": f"处理查询时出错: {str(e)}", "error": True}
+                yield from results(futures[future], result)
+            
+            yield {"done": True, "questions": len(questions), "unique": len(indices)}
+        except Exception as e:
+            # The response headers are already sent: report the failure in the stream itself
+            print(f"Warning: batch query failed: {str(e)}")
+            for index, question in enumerate(questions):
+                if index not in emitted:
+                    yield {"index": index, "question": question, "answer": f"处理查询时出错: {str(e)}", "error": True}
+            yield {"done": True, "questions": len(questions), "unique": len(indices), "error": str(e)}
+        finally:
+            # Also when the client stopped reading: drop answers that have not started
+            pool.shutdown(wait=False, cancel_futures=True)
+    
+    def _answer_batch_question(self, kb_ids: List[str], question: str, is_complex_query: bool, 
+                               tables: List[Dict], corpus: List[tuple]) -> Dict[str, Any]:
+        """Answer one classified batch question with the batch's shared metadata"""
+        try:
+            if is_complex_query:
+                answer, sources = self._handle_complex_query(kb_ids, question, tables=tables)
+            else:
+                answer, sources = self._handle_simple_query(kb_ids, question, corpus=corpus)
+            return {"answer": answer, "sources": sources, "isComplexQuery": is_complex_query}
+        except Exception as e:
+            return {"answer": f"处理查询时出错: {str(e)}", "isComplexQuery": is_complex_query, "error": True}
+    
+    def _start_speculation(self, kb_ids: List[str], question: str, 
+                           conversation: str = "") -> Optional[Dict[str, Any]]:
+        """
+        Launch classification, document retrieval and SQL generation concurrently
+        Returns None (sequential processing) when the KB has no tables or the
+        speculation budget is exhausted
+        """
+        tables = self._get_tables(kb_ids)
+        if not tables:
+            return None
+        
+        if not self._speculation_slots.acquire(blocking=False):
+            return None
+        
+        sql_future = self._submit(self._generate_sql, question, tables, conversation)
+        sql_future.add_done_callback(lambda _: self._speculation_slots.release())
+        
+        return {
+            "tables": tables,
+            "classify": self._submit(self._is_complex_query, question),
+            "context": self._submit(self._retrieve_context, kb_ids, question),
+            "sql": sql_future
+        }
+    
+    def _submit(self, func, *args, executor: Optional[ThreadPoolExecutor] = None) -> Future:
+        """Run a function on the speculation pool (or the given pool), keeping the tracing and profiling context"""
+        context = contextvars.copy_context()
+        return (executor or self._executor).submit(context.run, profiling.run_attached, func, *args)
+    
+    def _retrieve_context(self, kb_ids: List[str], question: str, top_k: int = 3, 
+                          corpus: Optional[List[tuple]] = None) -> tuple:
+        """
+        Get the files most relevant to the question and the prompt context built from them
+        Each knowledge base is ranked in parallel and the per-KB results are merged into one top-k;
+        a corpus preloaded with _load_corpus is ranked without reading any file
+        """
+        with span("chat.build_context", knowledge_bases=len(kb_ids)) as context_span:
+            if corpus is not None:
+                candidates = _rank(question, corpus, top_k)
+            elif len(kb_ids) == 1:
+                candidates = self._rank_files(kb_ids[0], question, top_k)
+            else:
+                futures = [self._submit(self._rank_files, kb_id, question, top_k, 
+                                        executor=self._retrieval_executor) for kb_id in kb_ids]
+                candidates = [candidate for future in futures for candidate in future.result()]
+            
+            # Stable sort: equal scores keep knowledge base and file order
+            top = sorted(candidates, key=lambda candidate: -candidate[0])[:top_k]
+            files = [file for _, file, _ in top]
+            context = "\n\n".join(chunk for _, _, chunk in top)
+            context_span.set(context_chars=len(context))
+        
+        return files, context
+    
+    def _rank_files(self, kb_id: str, question: str, top_k: int) -> List[tuple]:
+        """Score the files of one knowledge base against the question; returns (score, file, chunk)"""
+        return _rank(question, self._load_corpus([kb_id]), top_k)
+    
+    def _load_corpus(self, kb_ids: List[str]) -> List[tuple]:
+        """(file, chunk) of the files considered for retrieval, in knowledge base and file order"""
+        corpus = []
+        for kb_id in kb_ids:
+            for file in self.kb_manager.get_files(kb_id)[:MAX_RANKED_FILES]:
+                chunk = self._read_file_chunk(file)
+                if chunk is not None:
+                    corpus.append((file, chunk))
+        return corpus
+    
+    def _get_tables(self, kb_ids: List[str]) -> List[Dict]:
+        """Table metadata; table names are schema-qualified when querying several knowledge bases"""
+        if len(kb_ids) == 1:
+            return self.sql_engine.get_table_metadata(kb_ids[0])
+        return self.sql_engine.get_federated_table_metadata(kb_ids)
+    
+    def _execute_sql(self, kb_ids: List[str], sql_query: str) -> tuple:
+        """Execute a query on one knowledge base, or across several with attached databases"""
+        if len(kb_ids) == 1:
+            return self.sql_engine.execute_query(kb_ids[0], sql_query)
+        return self.sql_engine.execute_federated_query(kb_ids, sql_query)
+    
+    def _handle_simple_query(self, kb_ids: List[str], question: str, 
+                             speculation: Optional[Dict[str, Any]] = None, conversation: str = "", 
+                             corpus: Optional[List[tuple]] = None) -> tuple:
         """
         Handle a simple knowledge base query using Dify/LLM
         Returns answer text and sources
         """
-        # Get knowledge base files
-        files = self.kb_manager.get_files(kb_id)
-        
-        # Prepare context from files
-        context = self._prepare_context_from_files(kb_id, files, max_files=3)
+        if speculation:
+            files, context = speculation["context"].result()
+        else:
+            files, context = self._retrieve_context(kb_ids, question, corpus=corpus)
         
         # Use LLM to answer the question
         prompt = f"""基于提供的上下文信息，回答用户的问题。如果上下文中没有相关信息，请说明无法回答。
 
 上下文:
 {context}
-
+{self._format_conversation(conversation)}
 问题: {question}
 
 回答:"""
         
-        response = llm.generate_completion(prompt)
+        with span("chat.answer"):
+            response = llm.generate_completion(prompt)
         
         # For simple queries, use file names as sources
         sources = [file["name"] for file in files[:3]]
         
         return response, sources
     
-    def _handle_complex_query(self, kb_id: str, question: str) -> tuple:
+    def _handle_complex_query(self, kb_ids: List[str], question: str, 
+                              speculation: Optional[Dict[str, Any]] = None, conversation: str = "", 
+                              tables: Optional[List[Dict]] = None) -> tuple:
         """
         Handle a complex query that requires SQL execution
         Returns answer text and sources
         """
-        # Get table metadata
-        tables = self.sql_engine.get_table_metadata(kb_id)
-        
-        if not tables:
-            return "无法执行查询，知识库中没有表格数据。请先上传CSV或Excel文件。", []
-        
-        # Generate SQL query using LLM
-        sql_prompt = f"""作为一个SQL专家，你需要将自然语言问题转换为SQL查询。
-以下是数据库表的结构信息:
-
-{self._format_tables_info(tables)}
-
-请将这个问题转换为一个有效的SQL查询: "{question}"
-只返回SQL语句，不要有任何其他解释。"""
-        
-        # Get SQL query from LLM
-        sql_query = llm.generate_completion(sql_prompt).strip()
+        if speculation:
+            tables = speculation["tables"]
+            sql_query = speculation["sql"].result()
+        else:
+            # Get table metadata, unless the caller already loaded it
+            if tables is None:
+                tables = self._get_tables(kb_ids)
+            
+            if not tables:
+                return "无法执行查询，知识库中没有表格数据。请先上传CSV或Excel文件。", []
+            
+            sql_query = self._generate_sql(question, tables, conversation)
         
         try:
-            # Execute the SQL query
-            results, columns = self.sql_engine.execute_query(kb_id, sql_query)
+            sql_query = self._prepare_sql(kb_ids, question, tables, sql_query)
+            
+            # Execute the SQL query; an over-budget query may be revised once by the LLM
+            try:
+                results, columns = self._execute_sql(kb_ids, sql_query)
+            except QueryCostError as e:
+                if self.sql_engine.guard.policy != POLICY_REVISE:
+                    raise
+                sql_query = self._revise_sql(question, tables, sql_query, str(e))
+                sql_query = self.sql_engine.repair_query(kb_ids, sql_query, tables)[0]
+                results, columns = self._execute_sql(kb_ids, sql_query)
             
             # Format the results for display
-            if len(results) > 0:
-                # For single count/value results, simplify the output
-                if len(columns) == 1 and len(results) == 1:
-                    value = list(results[0].values())[0]
-                    if columns[0].lower().startswith('count'):
-                        result_text = f"查询结果: {value}"
-                    else:
-                        result_text = f"{columns[0]}: {value}"
-                else:
-                    # Format as table for multiple rows/columns
-                    result_text = self._format_results_as_table(results, columns)
-            else:
-                result_text = "查询结果为空。"
+            with span("chat.format_results", rows=len(results), columns=len(columns)):
+                result_text = self._format_query_results(results, columns)
             
             # Generate natural language explanation of results
             explain_prompt = f"""以下是用户的问题:
@@ -173,16 +445,121 @@ class ChatEngine:
 
 请提供这些结果的自然语言解释，用简洁易懂的中文回答用户的问题。"""
             
-            explanation = llm.generate_completion(explain_prompt)
+            with span("chat.explain"):
+                explanation = llm.generate_completion(explain_prompt)
             
             # Sources are table names used in the query
             sources = self._extract_tables_from_query(sql_query, tables)
             
             return explanation, sources
             
+        except SchedulerOverloaded:
+            raise
         except Exception as e:
             return f"执行SQL查询时出错: {str(e)}。生成的SQL: {sql_query}", []
     
+    def _generate_sql(self, question: str, tables: List[Dict], conversation: str = "") -> str:
+        """Generate a SQL query for the question using the LLM"""
+        # Tables of several knowledge bases are qualified with their schema alias
+        federated_note = ""
+        if any("knowledge_base_id" in table for table in tables):
+            federated_note = "\n表来自多个知识库，表名带有库前缀（如 kb1.table_x），查询时必须使用完整表名。\n"
+        
+        sql_prompt = f"""作为一个SQL专家，你需要将自然语言问题转换为SQL查询。
+以下是数据库表的结构信息:
+{federated_note}
+{self._format_tables_info(tables)}
+{self._format_conversation(conversation)}
+请将这个问题转换为一个有效的SQL查询: "{question}"
+只返回SQL语句，不要有任何其他解释。"""
+        
+        # Get SQL query from LLM
+        with span("chat.generate_sql"):
+            return llm.generate_completion(sql_prompt).strip()
+    
+    def _prepare_sql(self, kb_ids: List[str], question: str, tables: List[Dict], sql_query: str) -> str:
+        """
+        Compile generated SQL locally before running it
+        Unknown names are mapped to the closest real ones; only if the query still
+        does not compile is the LLM asked, once, to repair it with the exact error
+        """
+        sql_query, error = self.sql_engine.repair_query(kb_ids, sql_query, tables)
+        if error is None:
+            return sql_query
+        
+        repair_prompt = f"""作为一个SQL专家，请修正下面这条无法执行的SQL查询，用于回答问题 "{question}"。
+
+以下是数据库表的结构信息:
+{self._format_tables_info(tables)}
+
+SQL:
+{sql_query}
+
+错误信息: {error}
+
+只使用上面列出的表名和列名。只返回修正后的SQL语句，不要有任何其他解释。"""
+        
+        with span("chat.repair_sql"):
+            sql_query = llm.generate_completion(repair_prompt).strip()
+        return self.sql_engine.repair_query(kb_ids, sql_query, tables)[0]
+    
+    def _revise_sql(self, question: str, tables: List[Dict], sql_query: str, reason: str) -> str:
+        """Ask the LLM for a cheaper query after the cost check refused one"""
+        revise_prompt = f"""作为一个SQL专家，你之前为问题 "{question}" 生成的SQL查询因开销过大被拒绝执行。
+
+以下是数据库表的结构信息:
+{self._format_tables_info(tables)}
+
+被拒绝的SQL:
+{sql_query}
+
+拒绝原因: {reason}
+
+请改写SQL，使用表之间的连接条件和过滤条件减少扫描的行数，结果仍需回答原问题。
+只返回SQL语句，不要有任何其他解释。"""
+        
+        with span("chat.revise_sql"):
+            return llm.generate_completion(revise_prompt).strip()
+    
+    @staticmethod
+    def _format_conversation(conversation: str) -> str:
+        """Conversation section of a prompt, so follow-up questions can refer to earlier turns"""
+        if not conversation:
+            return ""
+        return f"\n对话背景（用于理解问题中的指代，如“它”“上面那个”）:\n{conversation}\n"
+    
+    def _summarize_history(self, summary: str, messages: List[Dict[str, str]]) -> str:
+        """Fold turns that left the recent window into the rolling summary (runs in the background)"""
+        turns = "\n".join(f"{'用户' if m['role'] == 'user' else '助手'}: {m['content']}" for m in messages)
+        prompt = f"""请更新一段对话摘要。
+
+已有摘要:
+{summary or "（无）"}
+
+新的对话内容:
+{turns}
+
+请输出合并后的摘要，保留型号、数值、表名等关键事实和用户关心的对象，不超过200字。只返回摘要内容。"""
+        
+        # Off the request path: never compete with interactive calls
+        with call_context(PRIORITY_BATCH), span("chat.summarize", messages=len(messages)):
+            return llm.generate_completion(prompt).strip()
+    
+    def _format_query_results(self, results: List[Dict], columns: List[str]) -> str:
+        """Format SQL results as text for the explanation prompt"""
+        if len(results) > 0:
+            # For single count/value results, simplify the output
+            if len(columns) == 1 and len(results) == 1:
+                value = list(results[0].values())[0]
+                if columns[0].lower().startswith('count'):
+                    return f"查询结果: {value}"
+                return f"{columns[0]}: {value}"
+            
+            # Format as table for multiple rows/columns
+            return self._format_results_as_table(results, columns)
+        
+        return "查询结果为空。"
+    
     def _is_complex_query(self, question: str) -> bool:
         """
         Determine if a question requires complex SQL processing
@@ -190,8 +567,7 @@ class ChatEngine:
         # Use LLM to detect if this is a complex query
         prompt = f"""确定以下问题是简单查询还是复杂查询。
 
-简单查询: 直接从文档中检索单一事实或信息的查询。例如"产品X的尺寸是多少？"、"Y过程的步骤是什么？"
-复杂查询: 需要跨表分析、统计、聚合、计数或比较的查询。例如"统计材质为玻璃的产品数量"、"价格在X范围内的型号有哪些？"
+{_QUERY_TYPES}
 
 问题: {question}
 
@@ -201,35 +577,63 @@ class ChatEngine:
         
         return "复杂" in response or "complex" in response
     
+    def _classify_batch(self, questions: List[str]) -> List[bool]:
+        """
+        Classify many questions with one LLM call per batch_classify_size questions
+        Questions missing from the answer are classified one by one
+        """
+        labels: List[Optional[bool]] = [None] * len(questions)
+        for offset in range(0, len(questions), self.batch_classify_size):
+            chunk = questions[offset:offset + self.batch_classify_size]
+            numbered = "\n".join(f"{i}. {question}" for i, question in enumerate(chunk, 1))
+            prompt = f"""确定以下每个问题是简单查询还是复杂查询。
+
+{_QUERY_TYPES}
+
+问题列表:
+{numbered}
+
+按编号逐行回答，每行格式为"编号. 简单"或"编号. 复杂"，不要有任何其他内容。"""
+            
+            with span("chat.classify_batch", questions=len(chunk)):
+                response = llm.generate_completion(prompt)
+            for number, label in _BATCH_LABEL.findall(response):
+                index = int(number) - 1
+                if 0 <= index < len(chunk) and labels[offset + index] is None:
+                    labels[offset + index] = label.lower() in ("复杂", "complex")
+        
+        return [label if label is not None else self._is_complex_query(question)
+                for question, label in zip(questions, labels)]
+    
     def _prepare_context_from_files(self, kb_id: str, files: List[Dict], max_files: int = 3) -> str:
         """
         Extract and prepare context from knowledge base files
         """
-        context_chunks = []
+        context_chunks = [self._read_file_chunk(file) for file in files[:max_files]]
+        return "\n\n".join(chunk for chunk in context_chunks if chunk is not None)
+    
+    def _read_file_chunk(self, file: Dict) -> Optional[str]:
+        """Read a file into a prompt chunk; None if the file is missing"""
+        file_path = file.get("path")
+        if not file_path or not os.path.exists(file_path):
+            return None
         
-        for file in files[:max_files]:
-            file_path = file.get("path")
-            if file_path and os.path.exists(file_path):
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                        # Truncate if too long
-                        if len(content) > 5000:
-                            content = content[:5000] + "..."
-                        
-                        context_chunks.append(f"文件 '{file['name']}':\n{content}\n")
-                except Exception:
-                    # Try alternate encoding if UTF-8 fails
-                    try:
-                        with open(file_path, 'r', encoding='gbk') as f:
-                            content = f.read()
-                            if len(content) > 5000:
-                                content = content[:5000] + "..."
-                            context_chunks.append(f"文件 '{file['name']}':\n{content}\n")
-                    except Exception as e:
-                        context_chunks.append(f"文件 '{file['name']}' 读取失败: {str(e)}")
-        
-        return "\n\n".join(context_chunks)
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                content = f.read(5001)
+        except Exception:
+            # Try alternate encoding if UTF-8 fails
+            try:
+                with open(file_path, 'r', encoding='gbk') as f:
+                    content = f.read(5001)
+            except Exception as e:
+                return f"文件 '{file['name']}' 读取失败: {str(e)}"
+        
+        # Truncate if too long
+        if len(content) > 5000:
+            content = content[:5000] + "..."
+        
+        return f"文件 '{file['name']}':\n{content}\n"
     
     def _format_tables_info(self, tables: List[Dict]) -> str:
         """Format table metadata as a string for prompt"""
@@ -238,7 +642,11 @@ class ChatEngine:
         for table in tables:
             table_name = table["table_name"]
             columns = ", ".join([f"{col['name']} ({col['type']})" for col in table["columns"]])
-            formatted.append(f"表名: {table_name}\n列: {columns}\n行数: {table['row_count']}")
+            info = f"表名: {table_name}\n列: {columns}\n行数: {table['row_count']}"
+            if table.get("fts_columns"):
+                # Substring filters on these columns are answered from the full-text index
+                info += f"\n全文索引列: {', '.join(table['fts_columns'])}（子串查询请用 LIKE '%关键词%'）"
+            formatted.append(info)
         
         return "\n\n".join(formatted)
     
@@ -0,0 +1,142 @@
+import os
+from typing import Dict, List, Tuple, Any
+
+
+def _import_duckdb():
+    """Import DuckDB on first use; it is optional and only needed for Parquet storage"""
+    try:
+        import duckdb
+    except ImportError:
+        return None
+    return duckdb
+
+
+def normalize_mixed_columns(df):
+    """
+    Store object columns that mix types (e.g. 1000 and '面议') as text
+    Parquet needs a single type per column; missing values stay missing
+    """
+    import pandas as pd
+
+    mixed = [column for column in df.columns
+             if df[column].dtype == object
+             and pd.api.types.infer_dtype(df[column], skipna=True) in ("mixed", "mixed-integer")]
+    if not mixed:
+        return df
+
+    df = df.copy()
+    for column in mixed:
+        df[column] = df[column].map(lambda value: value if pd.isna(value) else str(value))
+    return df
+
+
+class ColumnarStore:
+    """
+    Store tabular data as Parquet files and query it with an embedded DuckDB
+    Each table is a single Parquet file named after the table
+    """
+
+    def __init__(self, root_dir: str):
+        """Initialize the store with the directory holding the Parquet files"""
+        self.root_dir = root_dir
+
+    @staticmethod
+    def is_available() -> bool:
+        """Check whether the optional DuckDB/PyArrow dependencies are installed"""
+        if _import_duckdb() is None:
+            return False
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def get_table_path(self, table_name: str) -> str:
+        """Get the Parquet file path for a table"""
+        return os.path.join(self.root_dir, f"{table_name}.parquet")
+
+    def list_tables(self) -> List[str]:
+        """List the tables stored in this directory"""
+        if not os.path.isdir(self.root_dir):
+            return []
+
+        return sorted(
+            filename[:-len(".parquet")]
+            for filename in os.listdir(self.root_dir)
+            if filename.endswith(".parquet")
+        )
+
+    def write_table(self, df, table_name: str) -> None:
+        """Write a pandas DataFrame as a Parquet table, replacing any existing one"""
+        df = normalize_mixed_columns(df)
+        os.makedirs(self.root_dir, exist_ok=True)
+        table_path = self.get_table_path(table_name)
+
+        # Write to a temporary file first so readers never see a partial table
+        tmp_path = f"{table_path}.tmp"
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, table_path)
+
+    def drop_table(self, table_name: str) -> None:
+        """Remove a table if it exists"""
+        table_path = self.get_table_path(table_name)
+        if os.path.exists(table_path):
+            os.remove(table_path)
+
+    def execute(self, query: str) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """
+        Execute a SQL query over the Parquet tables
+        Returns results and column names
+        """
+        conn = self._connect()
+
+        try:
+            cursor = conn.execute(query)
+            column_names = [description[0] for description in cursor.description]
+            rows = cursor.fetchall()
+
+            results = [dict(zip(column_names, row)) for row in rows]
+            return results, column_names
+
+        finally:
+            conn.close()
+
+    def get_table_metadata(self) -> List[Dict[str, Any]]:
+        """Get table names, column types and row counts from the Parquet footers"""
+        conn = self._connect()
+        tables = []
+
+        try:
+            for table_name in self.list_tables():
+                columns = conn.execute(f'DESCRIBE "{table_name}"').fetchall()
+
+                # Row count comes from the Parquet metadata, no data scan needed
+                row_count = conn.execute(
+                    "SELECT SUM(row_group_num_rows) FROM "
+                    "(SELECT DISTINCT row_group_id, row_group_num_rows FROM parquet_metadata(?))",
+                    [self.get_table_path(table_name)]
+                ).fetchone()[0] or 0
+
+                tables.append({
+                    "table_name": table_name,
+                    "columns": [{"name": col[0], "type": col[1]} for col in columns],
+                    "row_count": int(row_count)
+                })
+
+            return tables
+
+        finally:
+            conn.close()
+
+    def _connect(self):
+        """Open an in-memory DuckDB connection with a view per Parquet table"""
+        duckdb = _import_duckdb()
+        if duckdb is None:
+            raise ValueError("Parquet storage requires the duckdb package")
+
+        conn = duckdb.connect(database=":memory:")
+        for table_name in self.list_tables():
+            table_path = self.get_table_path(table_name).replace("'", "''")
+            conn.execute(f"CREATE VIEW \"{table_name}\" AS SELECT * FROM read_parquet('{table_path}')")
+
+        return conn
@@ -0,0 +1,157 @@
+import os
+import uuid
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+
+class HistoryCursorMismatch(ValueError):
+    """The client's history cursor does not match the conversation held by this server"""
+
+    def __init__(self, conversation_id: str, cursor: Optional[str]):
+        super().__init__(f"Stale history cursor for conversation {conversation_id}")
+        self.conversation_id = conversation_id
+        self.cursor = cursor
+
+
+class _Conversation:
+    def __init__(self):
+        self.messages: List[Dict[str, str]] = []  # Messages not yet folded into the summary
+        self.summary = ""
+        self.version = 0  # Bumped by every change the client must know about
+        self.generation = 0  # Bumped when the client replaces the history
+        self.summarizing = False
+        self.lock = threading.Lock()
+
+
+class ConversationMemory:
+    """
+    Per-conversation memory: the last `window_turns` turns verbatim plus a rolling
+    summary of everything older
+    Turns that fall out of the window are folded into the summary by `summarizer`
+    (summary, messages) -> summary on a background thread, so requests never wait
+    for it; until then they stay in the context verbatim
+    Clients send back the history cursor of the last response instead of the full
+    history; a cursor from another server or an older state is rejected
+    CHAT_MEMORY_TURNS sets the window (default 4), CHAT_MEMORY_CONVERSATIONS how
+    many conversations are kept (default 10000, least recently used are dropped)
+    """
+
+    def __init__(self, summarizer: Callable[[str, List[Dict[str, str]]], str],
+                 window_turns: Optional[int] = None, max_conversations: Optional[int] = None,
+                 max_workers: int = 2):
+        if window_turns is None:
+            window_turns = int(os.getenv('CHAT_MEMORY_TURNS', '4'))
+        if max_conversations is None:
+            max_conversations = int(os.getenv('CHAT_MEMORY_CONVERSATIONS', '10000'))
+        self.window_messages = window_turns * 2  # a turn is a question and its answer
+        self.max_conversations = max_conversations
+        self.summarizer = summarizer
+        self._conversations: "OrderedDict[str, _Conversation]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Cursors are only valid on the server process that issued them
+        self._salt = uuid.uuid4().hex
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='chat-summary')
+
+    def _get(self, conversation_id: str) -> _Conversation:
+        with self._lock:
+            conversation = self._conversations.get(conversation_id)
+            if conversation is None:
+                conversation = self._conversations[conversation_id] = _Conversation()
+                while len(self._conversations) > self.max_conversations:
+                    self._conversations.popitem(last=False)
+            else:
+                self._conversations.move_to_end(conversation_id)
+            return conversation
+
+    def __contains__(self, conversation_id: str) -> bool:
+        with self._lock:
+            return conversation_id in self._conversations
+
+    def append(self, conversation_id: str, role: str, content: str) -> None:
+        """Add a message; schedules summarization once turns fall out of the window"""
+        conversation = self._get(conversation_id)
+        with conversation.lock:
+            conversation.messages.append({"role": role, "content": content})
+            conversation.version += 1
+        self._schedule_summary(conversation)
+
+    def replace(self, conversation_id: str, history: List[Dict[str, str]]) -> None:
+        """Start over from a full history sent by the client"""
+        conversation = self._get(conversation_id)
+        with conversation.lock:
+            conversation.messages = [{"role": m.get("role", "user"), "content": m.get("content", "")}
+                                     for m in history]
+            conversation.summary = ""
+            conversation.version += 1
+            conversation.generation += 1
+        self._schedule_summary(conversation)
+
+    def cursor(self, conversation_id: str) -> Optional[str]:
+        """Opaque cursor (also used as ETag) identifying the conversation's current state"""
+        if conversation_id not in self:
+            return None
+        conversation = self._get(conversation_id)
+        with conversation.lock:
+            digest = hashlib.sha1(f"{self._salt}:{conversation_id}:{conversation.version}".encode())
+            return f"{conversation.version}-{digest.hexdigest()[:12]}"
+
+    def check_cursor(self, conversation_id: str, cursor: str) -> None:
+        """Raise HistoryCursorMismatch unless the cursor matches the conversation's state"""
+        current = self.cursor(conversation_id)
+        if current is None or current != cursor:
+            raise HistoryCursorMismatch(conversation_id, current)
+
+    def get(self, conversation_id: str) -> Dict[str, object]:
+        """Summary and verbatim messages of a conversation"""
+        conversation = self._get(conversation_id)
+        with conversation.lock:
+            return {"summary": conversation.summary, "messages": list(conversation.messages)}
+
+    def format_context(self, conversation_id: str, exclude_last: int = 0) -> str:
+        """
+        Conversation context for prompts: the summary and the recent messages
+        exclude_last leaves out the newest messages (e.g. the question being answered)
+        """
+        memory = self.get(conversation_id)
+        messages = memory["messages"][:len(memory["messages"]) - exclude_last]
+        parts = []
+        if memory["summary"]:
+            parts.append(f"之前对话的摘要: {memory['summary']}")
+        for message in messages:
+            speaker = "用户" if message["role"] == "user" else "助手"
+            parts.append(f"{speaker}: {message['content']}")
+        return "\n".join(parts)
+
+    def _schedule_summary(self, conversation: _Conversation) -> None:
+        with conversation.lock:
+            if conversation.summarizing or len(conversation.messages) <= self.window_messages:
+                return
+            conversation.summarizing = True
+        self._executor.submit(self._summarize, conversation)
+
+    def _summarize(self, conversation: _Conversation) -> None:
+        """Fold the messages that fell out of the window into the summary"""
+        with conversation.lock:
+            generation = conversation.generation
+            overflow = conversation.messages[:len(conversation.messages) - self.window_messages]
+            summary = conversation.summary
+
+        try:
+            new_summary = self.summarizer(summary, overflow)
+        except Exception as e:
+            # Keep the messages verbatim; the next append tries again
+            print(f"Warning: Failed to summarize conversation: {e}")
+            with conversation.lock:
+                conversation.summarizing = False
+            return
+
+        with conversation.lock:
+            # Unless the client replaced the history meanwhile
+            if conversation.generation == generation:
+                del conversation.messages[:len(overflow)]
+                conversation.summary = new_summary
+            conversation.summarizing = False
+        self._schedule_summary(conversation)
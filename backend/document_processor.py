@@ -1,9 +1,61 @@
 import os
-import pandas as pd
-import PyPDF2
-import docx
+import importlib
 from typing import Dict, List, Optional, Any
 from sql_query_engine import SQLQueryEngine
+from workbook_reader import stream_workbook, format_rows
+from tracing import span
+
+# Parser libraries are imported on first use of a file type, so starting the
+# backend does not pay for pandas, PyPDF2 and python-docx
+PARSER_MODULES = {
+    '.csv': ['pandas'],
+    '.xlsx': ['openpyxl'],
+    '.xls': ['pandas'],
+    '.pdf': ['PyPDF2'],
+    '.docx': ['docx'],
+    '.doc': ['docx'],
+    '.txt': []
+}
+
+
+def warm_up(extensions: Optional[List[str]] = None) -> None:
+    """
+    Import the parsers for the given file extensions (all by default), e.g. in a
+    preloading server before forking workers. Missing optional parsers are skipped.
+    """
+    for extension in extensions or PARSER_MODULES:
+        for module_name in PARSER_MODULES.get(extension, []):
+            try:
+                importlib.import_module(module_name)
+            except ImportError:
+                pass
+
+
+def render_pdf_thumbnail(pdf_path: str, output_path: str, width: int = 320) -> bool:
+    """
+    Render the first page of a PDF to a PNG of the given width
+    Returns False if PyMuPDF is not installed or the PDF cannot be rendered
+    """
+    # PyMuPDF is optional; without it PDF thumbnails are not available
+    try:
+        import fitz
+    except ImportError:
+        return False
+    
+    try:
+        with fitz.open(pdf_path) as pdf:
+            if pdf.page_count == 0:
+                return False
+            page = pdf.load_page(0)
+            zoom = width / page.rect.width
+            pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+            tmp_path = f"{output_path}.tmp"
+            pixmap.save(tmp_path, output="png")
+            os.replace(tmp_path, output_path)
+        return True
+    except Exception as e:
+        print(f"Warning: Failed to render thumbnail for {pdf_path}: {e}")
+        return False
 
 class DocumentProcessor:
     """Process uploaded documents and extract contents for querying"""
@@ -28,41 +80,70 @@ class DocumentProcessor:
         else:
             raise ValueError(f"Unsupported file type: {self.file_extension}")
     
-    def process_for_knowledge_base(self) -> Dict[str, Any]:
-        """Process document and prepare it for the knowledge base"""
+    def process_for_knowledge_base(self, build_index: bool = True) -> Dict[str, Any]:
+        """
+        Process document and prepare it for the knowledge base
+        build_index=False skips the entity index rebuild (bulk imports rebuild it once)
+        """
         result = {
-            "text": self.extract_text(),
+            "text": "",
             "metadata": {}
         }
         
-        # Additional processing for tabular files
+        # Tabular files are imported for SQL queries; the import also renders the
+        # text from the same parse so the file is only read once
+        text_parts = None
         if self.file_extension in ['.csv', '.xlsx', '.xls'] and self.kb_id and self.file_id:
+            text_parts = []
             try:
                 # Process for SQL queries
-                table_metadata = self.sql_engine.process_tabular_file(
-                    kb_id=self.kb_id,
-                    file_path=self.file_path,
-                    file_id=self.file_id
-                )
+                with span("document.import_tables", file_type=self.file_extension):
+                    table_metadata = self.sql_engine.process_tabular_file(
+                        kb_id=self.kb_id,
+                        file_path=self.file_path,
+                        file_id=self.file_id,
+                        text_sink=text_parts,
+                        build_index=build_index
+                    )
                 result["metadata"]["tables"] = table_metadata
                 result["metadata"]["is_tabular"] = True
             except Exception as e:
                 print(f"Warning: Failed to process tabular file for SQL: {e}")
+                text_parts = None
+        
+        with span("document.extract", file_type=self.file_extension) as extract_span:
+            if text_parts is not None:
+                result["text"] = "\n\n".join(text_parts)
+            else:
+                result["text"] = self.extract_text()
+            extract_span.set(text_chars=len(result["text"]))
         
         return result
     
     def extract_from_tabular(self) -> str:
         """Extract data from CSV/Excel files"""
+        import pandas as pd
+        
         try:
             if self.file_extension == '.csv':
                 df = pd.read_csv(self.file_path)
+            elif self.file_extension == '.xlsx':
+                # Stream all sheets from a single read-only parse
+                sheets_text = []
+                for sheet_name, header, rows in stream_workbook(self.file_path):
+                    if not sheets_text or sheets_text[-1][0] != sheet_name:
+                        sheets_text.append((sheet_name, [f"Sheet: {sheet_name}", format_rows([header])]))
+                    if rows:
+                        sheets_text[-1][1].append(format_rows(rows))
+                
+                return "\n\n".join("\n".join(lines) for _, lines in sheets_text)
             else:
                 # For Excel, combine all sheets
                 xls = pd.ExcelFile(self.file_path)
                 sheets_text = []
                 
                 for sheet_name in xls.sheet_names:
-                    sheet_df = pd.read_excel(self.file_path, sheet_name=sheet_name)
+                    sheet_df = pd.read_excel(xls, sheet_name=sheet_name)
                     sheets_text.append(f"Sheet: {sheet_name}\n{sheet_df.to_string()}")
                 
                 return "\n\n".join(sheets_text)
@@ -74,6 +155,8 @@ class DocumentProcessor:
     
     def extract_from_pdf(self) -> str:
         """Extract text from PDF files"""
+        import PyPDF2
+        
         try:
             text = ""
             with open(self.file_path, 'rb') as file:
@@ -86,6 +169,8 @@ class DocumentProcessor:
     
     def extract_from_word(self) -> str:
         """Extract text from Word documents"""
+        import docx
+        
         try:
             doc = docx.Document(self.file_path)
             return "\n".join([para.text for para in doc.paragraphs])
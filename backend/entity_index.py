@@ -0,0 +1,166 @@
+import re
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Any
+from csv_query_app.entities import CODE_REGEX, normalize_code, extract_codes
+
+# Artifact keys: entity -> [[table, row, column], ...], table -> columns
+ENTITY_KEY = "e:"
+TABLE_KEY = "t:"
+STAMP_KEY = "stamp"
+
+# A point lookup asks what a value is: "...是多少？", "...是什么？"
+_LOOKUP_ENDING = re.compile(r'(是什么|多少)[?？。.!！\s]*$')
+
+# Yes/no, comparison and arithmetic questions need the LLM even if they name one cell
+_NOT_LOOKUP_WORDS = ('是否', '吗', '超过', '大于', '小于', '高于', '低于', '多于', '少于', '不足', '以上', '以下',
+                     '至少', '最多', '比', '对比', '相差', '差值', '还是', '倍', '加上', '减去', '乘以', '除以',
+                     '之和', '总和', '合计', '平均', '百分之', '%', '+', '-', '*', '/', '×', '÷')
+
+
+def _normalize_header(name: str) -> str:
+    return re.sub(r'[\s_]', '', str(name)).lower()
+
+
+class EntityIndex:
+    """
+    Exact-lookup index for spreadsheet facts
+    Maps identifier cell values to their table row and column headers to columns,
+    so "YFR-150EX的底阀离地高度是多少？" can be answered with a single cell read
+    The index is a memory-mapped artifact rebuilt whenever the KB's tables change:
+    imports rebuild it directly, other changes in the background; lookups never
+    rebuild it and answer None while it is stale
+    """
+
+    def __init__(self, sql_engine):
+        self.sql_engine = sql_engine
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='entity-index')
+
+    @staticmethod
+    def artifact_name(kb_id: str) -> str:
+        return f"{kb_id}/entity_index"
+
+    def build(self, kb_id: str) -> int:
+        """Rebuild the index from every table of a knowledge base; returns the number of entities"""
+        stamp = self.sql_engine.get_data_version(kb_id)
+        if stamp is None:
+            self.sql_engine.artifacts.delete(self.artifact_name(kb_id))
+            return 0
+
+        entities: Dict[str, List[list]] = {}
+        entries = {STAMP_KEY: stamp.encode()}
+
+        for table in self.sql_engine.get_table_metadata(kb_id):
+            table_name = table["table_name"]
+            columns = [column["name"] for column in table["columns"]]
+            entries[TABLE_KEY + table_name] = json.dumps(columns, ensure_ascii=False).encode('utf-8')
+
+            for row_key, values in self.sql_engine.iter_rows(kb_id, table_name):
+                for column, value in zip(columns, values):
+                    if not isinstance(value, str):
+                        continue
+                    code = normalize_code(value)
+                    if CODE_REGEX.fullmatch(code):
+                        entities.setdefault(code, []).append([table_name, row_key, column])
+
+        for code, locations in entities.items():
+            entries[ENTITY_KEY + code] = json.dumps(locations, ensure_ascii=False).encode('utf-8')
+
+        self.sql_engine.artifacts.publish(self.artifact_name(kb_id), entries)
+        return len(entities)
+
+    def schedule_build(self, kb_id: str) -> None:
+        """Rebuild the index in the background; at most one pending rebuild per knowledge base"""
+        with self._lock:
+            if kb_id in self._pending:
+                return
+            self._pending.add(kb_id)
+        self._executor.submit(self._build_pending, kb_id)
+
+    def _build_pending(self, kb_id: str) -> None:
+        # Changes made while building schedule another rebuild
+        with self._lock:
+            self._pending.discard(kb_id)
+        try:
+            self.build(kb_id)
+        except Exception as e:
+            print(f"Warning: Failed to build entity index: {e}")
+
+    def lookup(self, kb_id: str, question: str) -> Optional[Dict[str, Any]]:
+        """
+        Answer a point lookup from the index
+        Returns None unless the question names exactly one indexed entity
+        (in exactly one row) and exactly one column of that row's table, and
+        only asks what that cell's value is
+        """
+        codes = extract_codes(question)
+        if len(codes) != 1:
+            return None
+
+        reader = self._open_current(kb_id)
+        if reader is None:
+            return None
+
+        with reader:
+            locations = reader.get(ENTITY_KEY + codes[0])
+            if locations is None:
+                return None
+            locations = json.loads(locations)
+            if len(locations) != 1:
+                return None
+            table_name, row_key, entity_column = locations[0]
+            columns = json.loads(reader.get(TABLE_KEY + table_name))
+
+        column = self._match_column(question, [c for c in columns if c != entity_column])
+        if column is None or not self._is_plain_lookup(question, codes[0], column):
+            return None
+
+        value = self.sql_engine.fetch_cell(kb_id, table_name, row_key, column)
+        if value is None or value != value:  # missing or NaN
+            return None
+
+        return {"entity": codes[0], "table": table_name, "column": column, "value": value}
+
+    def _open_current(self, kb_id: str):
+        """
+        Open the index if it matches the current tables
+        A missing or stale index is rebuilt in the background and None is returned,
+        so the question takes the normal path instead of waiting for a full scan
+        """
+        stamp = self.sql_engine.get_data_version(kb_id)
+        if stamp is None:
+            return None
+
+        reader = self.sql_engine.artifacts.open(self.artifact_name(kb_id))
+        if reader is not None:
+            if reader.get(STAMP_KEY) == stamp.encode():
+                return reader
+            reader.close()
+
+        self.schedule_build(kb_id)
+        return None
+
+    @staticmethod
+    def _is_plain_lookup(question: str, code: str, column: str) -> bool:
+        """
+        Whether the question only asks for the cell's value
+        The entity and column are removed first, so their own text (a dash in the
+        model number, a header such as 温差) does not count as a comparison word
+        """
+        text = _normalize_header(normalize_code(question)).replace(_normalize_header(code), '')
+        text = text.replace(_normalize_header(column), '')
+        return bool(_LOOKUP_ENDING.search(text)) and not any(word in text for word in _NOT_LOOKUP_WORDS)
+    
+    @staticmethod
+    def _match_column(question: str, columns: List[str]) -> Optional[str]:
+        """The single column header mentioned in the question; longer headers win over their substrings"""
+        text = _normalize_header(question)
+        matches = [column for column in columns
+                   if len(_normalize_header(column)) >= 2 and _normalize_header(column) in text]
+        matches = [column for column in matches
+                   if not any(other != column and _normalize_header(column) in _normalize_header(other)
+                              for other in matches)]
+        return matches[0] if len(matches) == 1 else None
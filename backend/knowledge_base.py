@@ -1,9 +1,26 @@
 import os
+import copy
 import json
 import uuid
 import shutil
-from typing import Dict, List, Optional, Any
-from document_processor import DocumentProcessor
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Any, Tuple
+from document_processor import DocumentProcessor, render_pdf_thumbnail
+from sql_query_engine import SQLQueryEngine, STORAGE_SQLITE
+from tracing import span
+
+def _process_file_job(job: Tuple) -> Dict[str, Any]:
+    """Worker-pool entry point for bulk imports; returns a per-file status"""
+    kb_id, filename, file_path, file_type, file_size = job
+    try:
+        file_info = KnowledgeBaseManager._process_file(kb_id, filename, file_path, file_type, file_size,
+                                                       build_index=False)
+        return {"name": filename, "status": "ok", "file": file_info}
+    except Exception as e:
+        return {"name": filename, "status": "failed", "error": str(e)}
 
 class KnowledgeBaseManager:
     """Manage knowledge bases and their documents"""
@@ -11,6 +28,19 @@ class KnowledgeBaseManager:
     def __init__(self, data_dir: str = 'data'):
         self.data_dir = data_dir
         self.kb_file = os.path.join(data_dir, 'knowledge_bases.json')
+        self.sql_engine = SQLQueryEngine(os.path.join(data_dir, 'databases'))
+        self.thumbnail_dir = os.path.join(data_dir, 'thumbnails')
+        
+        # Parsed knowledge_bases.json, reused while the file's mtime and size are unchanged
+        self._cache_key = None
+        self._cache: List[Dict[str, Any]] = []
+        self._cache_lock = threading.Lock()
+        
+        # Content hashes of files uploaded before hashes were stored, by (path, mtime, size)
+        self._hash_cache: Dict[tuple, str] = {}
+        
+        # Serializes read-modify-write of knowledge_bases.json for file additions
+        self._write_lock = threading.Lock()
         
         # Create data directory if it doesn't exist
         os.makedirs(data_dir, exist_ok=True)
@@ -21,24 +51,44 @@ class KnowledgeBaseManager:
                 json.dump([], f)
     
     def get_all_knowledge_bases(self) -> List[Dict[str, Any]]:
-        """Get all knowledge bases"""
+        """Get all knowledge bases (a copy that callers may modify and save)"""
+        return copy.deepcopy(self._load())
+    
+    def _load(self) -> List[Dict[str, Any]]:
+        """
+        Get the parsed knowledge bases file, re-reading it only when it changed on disk
+        The returned list is shared and must not be modified
+        """
         try:
-            with open(self.kb_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            with span("kb.load") as load_span:
+                stat = os.stat(self.kb_file)
+                key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+                with self._cache_lock:
+                    cache_hit = key == self._cache_key
+                    if not cache_hit:
+                        with open(self.kb_file, 'r', encoding='utf-8') as f:
+                            self._cache = json.load(f)
+                        self._cache_key = key
+                    knowledge_bases = self._cache
+                load_span.set(knowledge_bases=len(knowledge_bases), cache_hit=cache_hit)
+                return knowledge_bases
         except Exception as e:
             print(f"Error loading knowledge bases: {e}")
             return []
     
     def get_knowledge_base(self, kb_id: str) -> Optional[Dict[str, Any]]:
         """Get a knowledge base by ID"""
-        knowledge_bases = self.get_all_knowledge_bases()
+        knowledge_bases = self._load()
         for kb in knowledge_bases:
             if kb['id'] == kb_id:
                 return kb
         return None
     
-    def create_knowledge_base(self, name: str) -> Dict[str, Any]:
-        """Create a new knowledge base"""
+    def create_knowledge_base(self, name: str, storage: str = STORAGE_SQLITE) -> Dict[str, Any]:
+        """
+        Create a new knowledge base
+        storage selects the backend for tabular files ('sqlite' or 'parquet')
+        """
         knowledge_bases = self.get_all_knowledge_bases()
         
         # Check if name already exists
@@ -54,9 +104,13 @@ class KnowledgeBaseManager:
             'id': kb_id,
             'name': name,
             'created_at': created_at,
+            'storage': storage,
             'files': []
         }
         
+        # Prepare tabular storage before anything is imported
+        self.sql_engine.set_storage(kb_id, storage)
+        
         # Add to list and save
         knowledge_bases.append(new_kb)
         self._save_knowledge_bases(knowledge_bases)
@@ -99,11 +153,13 @@ class KnowledgeBaseManager:
                 if os.path.exists(kb_dir):
                     shutil.rmtree(kb_dir)
                 
-                # Delete SQLite database file if exists
-                db_dir = os.path.join(self.data_dir, 'databases')
-                db_file = os.path.join(db_dir, f"{kb_id}.db")
-                if os.path.exists(db_file):
-                    os.remove(db_file)
+                # Delete SQLite database / Parquet tables if they exist
+                self.sql_engine.delete_storage(kb_id)
+                
+                # Delete cached thumbnails
+                thumbnail_dir = os.path.join(self.thumbnail_dir, kb_id)
+                if os.path.exists(thumbnail_dir):
+                    shutil.rmtree(thumbnail_dir)
                 
                 return True
         
@@ -133,44 +189,83 @@ class KnowledgeBaseManager:
         Add a file to a knowledge base
         Process the file and store its contents
         """
-        knowledge_bases = self.get_all_knowledge_bases()
-        
-        # Find the knowledge base
-        kb_index = -1
-        for i, kb in enumerate(knowledge_bases):
-            if kb['id'] == kb_id:
-                kb_index = i
-                break
+        if not self.get_knowledge_base(kb_id):
+            raise ValueError(f"知识库 ID {kb_id} 不存在")
         
-        if kb_index == -1:
+        file_info = self._process_file(kb_id, filename, file_path, file_type, file_size)
+        self._append_files(kb_id, [file_info])
+        return file_info
+    
+    def add_files(self, kb_id: str, uploads: List[Tuple[str, str]], 
+                  max_workers: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        Add many files at once
+        uploads are (filename, file_path) pairs already saved under the KB's upload directory;
+        they are processed on a process pool (INGEST_WORKERS, default one per core), the
+        metadata is saved in one write and the entity index is rebuilt once
+        Returns a status per upload, in order: {"name", "status": "ok"|"failed", "file"|"error"}
+        """
+        if not self.get_knowledge_base(kb_id):
             raise ValueError(f"知识库 ID {kb_id} 不存在")
         
+        jobs = []
+        for filename, file_path in uploads:
+            file_type = filename.rsplit('.', 1)[-1].lower()
+            file_size = os.path.getsize(file_path) / 1024 / 1024  # Convert to MB
+            jobs.append((kb_id, filename, file_path, file_type, file_size))
+        
+        if max_workers is None:
+            max_workers = int(os.getenv('INGEST_WORKERS', '0')) or os.cpu_count() or 1
+        max_workers = min(max_workers, len(jobs))
+        
+        with span("kb.bulk_import", files=len(jobs), workers=max_workers):
+            if max_workers <= 1:
+                results = [_process_file_job(job) for job in jobs]
+            else:
+                # Spawned workers avoid forking a multi-threaded server process
+                with ProcessPoolExecutor(max_workers=max_workers, 
+                                         mp_context=multiprocessing.get_context('spawn')) as pool:
+                    results = list(pool.map(_process_file_job, jobs, chunksize=max(1, len(jobs) // (max_workers * 4))))
+        
+        file_infos = [result["file"] for result in results if result["status"] == "ok"]
+        if file_infos:
+            self._append_files(kb_id, file_infos)
+        
+        if any(info.get("metadata", {}).get("is_tabular") for info in file_infos):
+            try:
+                self.sql_engine.entity_index.build(kb_id)
+            except Exception as e:
+                print(f"Warning: Failed to build entity index: {e}")
+        
+        return results
+    
+    @staticmethod
+    def _process_file(kb_id: str, filename: str, file_path: str, file_type: str, 
+                      file_size: float, build_index: bool = True) -> Dict[str, Any]:
+        """Process a saved file and return its file entry; the file is deleted if processing fails"""
         # Create file entry
         file_id = str(uuid.uuid4())
-        uploaded_at = self._get_current_timestamp()
-        
-        file_info = {
-            'id': file_id,
-            'name': filename,
-            'path': file_path,
-            'type': file_type,
-            'size': file_size,
-            'uploaded_at': uploaded_at
-        }
+        uploaded_at = KnowledgeBaseManager._get_current_timestamp()
         
-        # Process the file for the knowledge base
         try:
+            file_info = {
+                'id': file_id,
+                'name': filename,
+                'path': file_path,
+                'type': file_type,
+                'size': file_size,
+                'content_hash': KnowledgeBaseManager._hash_file(file_path),
+                'uploaded_at': uploaded_at
+            }
+            
+            # Process the file for the knowledge base
             processor = DocumentProcessor(file_path, kb_id, file_id)
-            result = processor.process_for_knowledge_base()
+            result = processor.process_for_knowledge_base(build_index=build_index)
             
             # Store any additional metadata from processing
             if result.get("metadata"):
                 file_info["metadata"] = result["metadata"]
             
-            # Add to knowledge base
-            knowledge_bases[kb_index]['files'].append(file_info)
-            self._save_knowledge_bases(knowledge_bases)
-            
             return file_info
         
         except Exception as e:
@@ -180,6 +275,18 @@ class KnowledgeBaseManager:
             
             raise Exception(f"文件处理失败：{str(e)}")
     
+    def _append_files(self, kb_id: str, file_infos: List[Dict[str, Any]]) -> None:
+        """Add processed file entries to a knowledge base in a single save"""
+        with self._write_lock:
+            knowledge_bases = self.get_all_knowledge_bases()
+            for kb in knowledge_bases:
+                if kb['id'] == kb_id:
+                    kb['files'].extend(file_infos)
+                    self._save_knowledge_bases(knowledge_bases)
+                    return
+        
+        raise ValueError(f"知识库 ID {kb_id} 不存在")
+    
     def delete_file(self, kb_id: str, file_id: str) -> bool:
         """Delete a file from a knowledge base"""
         knowledge_bases = self.get_all_knowledge_bases()
@@ -197,11 +304,13 @@ class KnowledgeBaseManager:
         # Find the file
         file_index = -1
         file_path = None
+        content_hash = None
         
         for i, file in enumerate(knowledge_bases[kb_index]['files']):
             if file['id'] == file_id:
                 file_index = i
                 file_path = file.get('path')
+                content_hash = file.get('content_hash')
                 break
         
         if file_index == -1:
@@ -214,15 +323,74 @@ class KnowledgeBaseManager:
         # Delete the file
         if file_path and os.path.exists(file_path):
             os.remove(file_path)
+
+        # Drop its tables so queries (and cached results) no longer see its rows
+        self.sql_engine.drop_file_tables(kb_id, file_id)
+
+        # Delete its cached thumbnail
+        if content_hash:
+            thumbnail_path = self._thumbnail_path(kb_id, content_hash)
+            if os.path.exists(thumbnail_path):
+                os.remove(thumbnail_path)
         
         return True
     
+    def get_content_hash(self, file_info: Dict[str, Any]) -> str:
+        """
+        SHA-256 of a file's contents, used as its strong ETag
+        Files uploaded before hashes were stored are hashed on first use
+        """
+        if file_info.get('content_hash'):
+            return file_info['content_hash']
+        
+        file_path = file_info['path']
+        stat = os.stat(file_path)
+        key = (file_path, stat.st_mtime_ns, stat.st_size)
+        if key not in self._hash_cache:
+            self._hash_cache[key] = self._hash_file(file_path)
+        return self._hash_cache[key]
+    
+    def get_thumbnail(self, kb_id: str, file_id: str) -> Optional[str]:
+        """
+        Path of a PNG rendering of a PDF's first page, rendered once and cached by content hash
+        Returns None if the file is not a PDF or cannot be rendered
+        """
+        file_info = self.get_file(kb_id, file_id)
+        if not file_info or file_info.get('type') != 'pdf' or not os.path.exists(file_info['path']):
+            return None
+        
+        thumbnail_path = self._thumbnail_path(kb_id, self.get_content_hash(file_info))
+        if os.path.exists(thumbnail_path):
+            return thumbnail_path
+        
+        os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
+        with span("document.thumbnail"):
+            if not render_pdf_thumbnail(file_info['path'], thumbnail_path):
+                return None
+        return thumbnail_path
+    
+    def _thumbnail_path(self, kb_id: str, content_hash: str) -> str:
+        return os.path.join(self.thumbnail_dir, kb_id, f"{content_hash}.png")
+    
+    @staticmethod
+    def _hash_file(file_path: str) -> str:
+        """SHA-256 of a file, read in chunks"""
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+    
     def _save_knowledge_bases(self, knowledge_bases: List[Dict[str, Any]]) -> None:
         """Save knowledge bases to file"""
-        with open(self.kb_file, 'w', encoding='utf-8') as f:
+        # Write to a temporary file and swap it in so readers never see a partial file
+        tmp_file = f"{self.kb_file}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
             json.dump(knowledge_bases, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, self.kb_file)
     
-    def _get_current_timestamp(self) -> str:
+    @staticmethod
+    def _get_current_timestamp() -> str:
         """Get current timestamp in ISO format"""
         from datetime import datetime
         return datetime.now().isoformat() 
\ No newline at end of file
@@ -0,0 +1,271 @@
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import zlib
+import threading
+import contextvars
+from collections import Counter
+from contextlib import contextmanager
+from html import escape
+from typing import Any, Dict, List, Optional
+
+# Header carrying the admin token that turns profiling on for one request
+PROFILE_HEADER = 'X-Profile-Token'
+
+# Output formats of a stored profile: collapsed stacks (flamegraph.pl / speedscope input) and an SVG flamegraph
+PROFILE_FORMATS = {'collapsed': 'text/plain; charset=utf-8', 'svg': 'image/svg+xml'}
+
+_PROFILE_ID = re.compile(r'^[\w-]{1,64}$')
+
+# Profile of the request being handled, if it is profiled
+_active_profile: contextvars.ContextVar = contextvars.ContextVar('active_profile', default=None)
+
+
+class Profile:
+    """
+    Sampling profile of one request
+    A sampler thread records the Python stacks of the threads working for the
+    request (the request thread plus pool workers that attached to it) every
+    `interval` seconds; other requests running at the same time are not sampled
+    """
+
+    def __init__(self, profile_id: str, label: str, interval: float):
+        self.profile_id = profile_id
+        self.label = label
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self.started_at = time.time()
+        self.duration = 0.0
+        self.token: Optional[contextvars.Token] = None
+        self._threads = {threading.get_ident()}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._run, name=f'profiler-{profile_id}', daemon=True)
+
+    def start(self) -> 'Profile':
+        self._start = time.monotonic()
+        self._sampler.start()
+        return self
+
+    def stop(self) -> None:
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._sampler.join()
+        self.duration = time.monotonic() - self._start
+
+    def attach(self, ident: int) -> None:
+        with self._lock:
+            self._threads.add(ident)
+
+    def detach(self, ident: int) -> None:
+        with self._lock:
+            self._threads.discard(ident)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                threads = list(self._threads)
+            for ident in threads:
+                frame = frames.get(ident)
+                if frame is not None:
+                    self.samples[_collapse(frame)] += 1
+
+    def collapsed(self) -> str:
+        """Brendan Gregg's collapsed format: `frame;frame;frame count` per line"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "id": self.profile_id,
+            "label": self.label,
+            "startedAt": self.started_at,
+            "duration": round(self.duration, 4),
+            "samples": sum(self.samples.values()),
+            "intervalMs": self.interval * 1000
+        }
+
+
+def _collapse(frame) -> str:
+    """Root-first stack of a frame as `function (file:line)` entries"""
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    # ';' separates frames in the collapsed format
+    return ";".join(entry.replace(";", ":") for entry in reversed(stack))
+
+
+class Profiler:
+    """
+    Opt-in per-request profiling
+    A request is profiled when it carries PROFILE_ADMIN_TOKEN in the X-Profile-Token
+    header, or at random with probability PROFILE_SAMPLE_RATE (default 0). Profiles
+    are sampled every PROFILE_INTERVAL_MS (default 5) and stored under PROFILE_DIR
+    as <id>.collapsed and <id>.svg; only the newest PROFILE_MAX_PROFILES are kept
+    Unprofiled requests pay for one header lookup and nothing else
+    Stored profiles can only be read with the admin token; without one they are not served
+    """
+
+    def __init__(self, directory: str = 'data/profiles', admin_token: Optional[str] = None,
+                 sample_rate: float = 0.0, interval: float = 0.005, max_profiles: int = 200):
+        self.directory = directory
+        self.admin_token = admin_token
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.max_profiles = max_profiles
+
+    @classmethod
+    def from_env(cls) -> 'Profiler':
+        return cls(directory=os.getenv('PROFILE_DIR', 'data/profiles'),
+                   admin_token=os.getenv('PROFILE_ADMIN_TOKEN') or None,
+                   sample_rate=float(os.getenv('PROFILE_SAMPLE_RATE', '0')),
+                   interval=float(os.getenv('PROFILE_INTERVAL_MS', '5')) / 1000,
+                   max_profiles=int(os.getenv('PROFILE_MAX_PROFILES', '200')))
+
+    def is_admin(self, token: Optional[str]) -> bool:
+        """Whether a token grants access to profiles (never when no admin token is configured)"""
+        return self.admin_token is not None and token == self.admin_token
+
+    def should_profile(self, token: Optional[str]) -> bool:
+        if token is not None and self.admin_token is not None and token == self.admin_token:
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self, label: str, profile_id: Optional[str] = None) -> Profile:
+        """Start profiling the calling thread (and workers attached to it) until finish()"""
+        # A client-supplied id must not overwrite a stored profile
+        if (profile_id is None or not _PROFILE_ID.match(profile_id)
+                or os.path.exists(os.path.join(self.directory, f"{profile_id}.json"))):
+            profile_id = uuid.uuid4().hex
+        profile = Profile(profile_id, label, self.interval).start()
+        profile.token = _active_profile.set(profile)
+        return profile
+
+    def finish(self, profile: Profile) -> Dict[str, Any]:
+        """Stop a profile and store it; returns its summary"""
+        profile.stop()
+        try:
+            _active_profile.reset(profile.token)
+        except ValueError:
+            # Finished from another context than it was started in
+            pass
+
+        summary = profile.summary()
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, profile.profile_id)
+        with open(base + '.collapsed', 'w', encoding='utf-8') as f:
+            f.write(profile.collapsed())
+        with open(base + '.svg', 'w', encoding='utf-8') as f:
+            f.write(render_flamegraph(profile.samples, f"{profile.label} ({summary['duration'] * 1000:.0f} ms)"))
+        with open(base + '.json', 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False)
+        self._prune()
+        return summary
+
+    def list(self) -> List[Dict[str, Any]]:
+        """Summaries of the stored profiles, newest first"""
+        profiles = []
+        if not os.path.isdir(self.directory):
+            return profiles
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                try:
+                    with open(os.path.join(self.directory, name), encoding='utf-8') as f:
+                        profiles.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        return sorted(profiles, key=lambda profile: -profile.get("startedAt", 0))
+
+    def path(self, profile_id: str, fmt: str) -> Optional[str]:
+        """File of a stored profile in the given format, or None"""
+        if fmt not in PROFILE_FORMATS or not _PROFILE_ID.match(profile_id):
+            return None
+        path = os.path.join(self.directory, f"{profile_id}.{fmt}")
+        return path if os.path.exists(path) else None
+
+    def _prune(self) -> None:
+        for profile in self.list()[self.max_profiles:]:
+            for ext in ('json', *PROFILE_FORMATS):
+                try:
+                    os.remove(os.path.join(self.directory, f"{profile['id']}.{ext}"))
+                except OSError:
+                    pass
+
+
+@contextmanager
+def attached():
+    """Sample the current (pool) thread as part of the caller's profile, if there is one"""
+    profile = _active_profile.get()
+    if profile is None:
+        yield
+        return
+    ident = threading.get_ident()
+    profile.attach(ident)
+    try:
+        yield
+    finally:
+        profile.detach(ident)
+
+
+def run_attached(func, *args):
+    """Call func inside attached(); for work submitted to thread pools with a copied context"""
+    if _active_profile.get() is None:
+        return func(*args)
+    with attached():
+        return func(*args)
+
+
+def render_flamegraph(samples: Counter, title: str = '', width: int = 1200, frame_height: int = 16) -> str:
+    """Render collapsed stacks as a standalone SVG flamegraph (root at the bottom)"""
+    root: Dict[str, Any] = {"count": 0, "children": {}}
+    for stack, count in samples.items():
+        node = root
+        node["count"] += count
+        for name in stack.split(";"):
+            node = node["children"].setdefault(name, {"count": 0, "children": {}})
+            node["count"] += count
+
+    def depth_of(node) -> int:
+        return 1 + max((depth_of(child) for child in node["children"].values()), default=0)
+
+    depth = depth_of(root)
+    header = 24
+    height = header + depth * frame_height + 8
+    total = root["count"] or 1
+    scale = (width - 20) / total
+
+    rects = []
+
+    def draw(name: str, node, x: float, level: int) -> None:
+        w = node["count"] * scale
+        if w < 0.5:
+            return
+        y = height - 8 - (level + 1) * frame_height
+        label = name if level else "all"
+        percent = node["count"] * 100 / total
+        hue = zlib.crc32(name.encode('utf-8')) % 55
+        rects.append(
+            f'<g><title>{escape(label)} ({node["count"]} samples, {percent:.1f}%)</title>'
+            f'<rect x="{x:.1f}" y="{y}" width="{w:.1f}" height="{frame_height - 1}" '
+            f'fill="hsl({hue},85%,60%)" rx="2"/>'
+            + (f'<text x="{x + 3:.1f}" y="{y + frame_height - 4}">{escape(label[:int(w / 7)])}</text>'
+               if w > 35 else '')
+            + '</g>')
+        child_x = x
+        for child_name, child in sorted(node["children"].items()):
+            draw(child_name, child, child_x, level + 1)
+            child_x += child["count"] * scale
+
+    draw("all", root, 10, 0)
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+            f'font-family="monospace" font-size="11">'
+            f'<rect width="100%" height="100%" fill="#fafafa"/>'
+            f'<text x="10" y="16" font-size="13">{escape(title)} - {root["count"]} samples</text>'
+            + "".join(rects) + '</svg>')
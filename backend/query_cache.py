@@ -0,0 +1,182 @@
+import os
+import re
+import json
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+# Comments, string literals and quoted identifiers, so whitespace is only collapsed outside them
+SQL_TOKENS = re.compile(r"""(--[^\n]*|/\*.*?\*/|'(?:[^']|'')*'|"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\])""", re.S)
+
+# Only statements that cannot change data are cached
+_READ_ONLY = re.compile(r"^(SELECT|WITH|VALUES)\b", re.I)
+
+
+def normalize_sql(query: str) -> str:
+    """
+    Canonical text of a SQL statement for cache keys
+    Drops comments and trailing semicolons and collapses whitespace outside literals;
+    keyword case is kept, since SQLite names expression columns after their text
+    """
+    text = ''
+    for i, part in enumerate(SQL_TOKENS.split(query)):
+        if i % 2 == 0:
+            part = re.sub(r'\s+', ' ', part)
+        elif part.startswith(('--', '/*')):
+            part = ' '
+        if text.endswith(' ') and part.startswith(' '):
+            part = part[1:]
+        text += part
+    return re.sub(r'[\s;]+$', '', text).strip()
+
+
+def is_cacheable(query: str) -> bool:
+    """Whether a normalized statement is a single read-only query"""
+    return bool(_READ_ONLY.match(query)) and ';' not in SQL_TOKENS.sub('', query)
+
+
+class QueryResultCache:
+    """
+    Size-bounded LRU of SQL results, with an optional on-disk tier
+    Keys include the data version of every knowledge base the query reads, so
+    entries for older data are never served and simply age out (the disk tier of
+    a knowledge base is cleared when its version changes)
+    Results are stored compactly as JSON [columns, rows]
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, max_entry_bytes: int = 4 * 1024 * 1024,
+                 disk_dir: Optional[str] = None):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.disk_dir = disk_dir
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls, default_disk_dir: Optional[str] = None) -> 'QueryResultCache':
+        """
+        SQL_CACHE_MB (default 64, 0 disables the memory tier), SQL_CACHE_MAX_ENTRY_KB
+        (default 4096) and SQL_CACHE_DISK=1 to keep results on disk as well
+        """
+        disk_dir = default_disk_dir if os.getenv('SQL_CACHE_DISK', '0') == '1' else None
+        return cls(max_bytes=int(float(os.getenv('SQL_CACHE_MB', '64')) * 1024 * 1024),
+                   max_entry_bytes=int(float(os.getenv('SQL_CACHE_MAX_ENTRY_KB', '4096')) * 1024),
+                   disk_dir=disk_dir)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 or self.disk_dir is not None
+
+    @staticmethod
+    def make_key(versions: Dict[str, str], query: str) -> str:
+        """Cache key from the data versions of the queried knowledge bases (in alias order) and the normalized SQL"""
+        material = json.dumps([list(versions.items()), normalize_sql(query)], ensure_ascii=False)
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def get(self, key: str, kb_ids: List[str]) -> Tuple[Optional[Tuple[List[Dict[str, Any]], List[str]]], str]:
+        """Cached (results, column_names) and the tier that served it ("memory", "disk" or "miss")"""
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._decode(payload), "memory"
+
+        payload = self._read_disk(key, kb_ids)
+        if payload is not None:
+            self._put_memory(key, payload)
+            with self._lock:
+                self.disk_hits += 1
+            return self._decode(payload), "disk"
+
+        with self._lock:
+            self.misses += 1
+        return None, "miss"
+
+    def put(self, key: str, kb_ids: List[str], results: List[Dict[str, Any]], column_names: List[str]) -> bool:
+        """Cache a result; returns False if it is too large or not JSON-serializable"""
+        try:
+            payload = json.dumps([column_names, [[row[c] for c in column_names] for row in results]],
+                                 ensure_ascii=False, allow_nan=True).encode('utf-8')
+        except (TypeError, ValueError):
+            return False
+        if len(payload) > self.max_entry_bytes:
+            return False
+
+        self._put_memory(key, payload)
+        self._write_disk(key, kb_ids, payload)
+        return True
+
+    def invalidate(self, kb_id: str) -> None:
+        """Drop the on-disk results of a knowledge base; memory entries expire by key"""
+        if self.disk_dir is not None:
+            shutil.rmtree(os.path.join(self.disk_dir, kb_id), ignore_errors=True)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses
+            }
+
+    def _put_memory(self, key: str, payload: bytes) -> None:
+        if len(payload) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._entries[key] = payload
+            self._size += len(payload)
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def _disk_paths(self, key: str, kb_ids: List[str]) -> List[str]:
+        # One copy per queried KB directory, so invalidating any of them drops it
+        return [os.path.join(self.disk_dir, kb_id, f"{key}.json") for kb_id in kb_ids]
+
+    def _read_disk(self, key: str, kb_ids: List[str]) -> Optional[bytes]:
+        if self.disk_dir is None:
+            return None
+        paths = self._disk_paths(key, kb_ids)
+        if not all(os.path.exists(path) for path in paths):
+            return None
+        try:
+            with open(paths[0], 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write_disk(self, key: str, kb_ids: List[str], payload: bytes) -> None:
+        if self.disk_dir is None:
+            return
+        for path in self._disk_paths(key, kb_ids):
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{threading.get_ident()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(payload)
+                os.replace(tmp_path, path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _decode(payload: bytes) -> Tuple[List[Dict[str, Any]], List[str]]:
+        column_names, rows = json.loads(payload)
+        return [dict(zip(column_names, row)) for row in rows], column_names
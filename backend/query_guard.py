@@ -0,0 +1,194 @@
+import os
+import re
+import sqlite3
+from typing import Any, Dict, List, Optional
+from query_cache import normalize_sql
+
+# What to do with a query whose estimated cost exceeds the budget:
+# reject it, have the caller ask the LLM to revise it, or rewrite it (add a LIMIT)
+POLICY_REJECT = 'reject'
+POLICY_REVISE = 'revise'
+POLICY_REWRITE = 'rewrite'
+COST_POLICIES = (POLICY_REJECT, POLICY_REVISE, POLICY_REWRITE)
+
+# Rows an index lookup is assumed to return (imported tables only have automatic indexes)
+INDEX_FANOUT = 10
+
+# Row estimate for tables without a cached row count (e.g. views of subqueries)
+UNKNOWN_TABLE_ROWS = 1000
+
+_LOOP = re.compile(r'^(SCAN|SEARCH)(?: TABLE)? (\S+)(?: AS (\S+))?(.*)$')
+_DERIVED = re.compile(r'^(?:MATERIALIZE|CO-ROUTINE)(?: SUBQUERY \d+| (\S+))')
+_AGGREGATE = re.compile(r'\b(?:COUNT|SUM|AVG|MIN|MAX|TOTAL|GROUP_CONCAT)\s*\(|\bGROUP\s+BY\b|\bDISTINCT\b', re.I)
+_LIMIT = re.compile(r'\bLIMIT\s+\d+', re.I)
+
+# Words that can follow a table name in FROM/JOIN without being its alias
+_NOT_ALIASES = {'WHERE', 'JOIN', 'ON', 'LEFT', 'RIGHT', 'INNER', 'OUTER', 'CROSS', 'NATURAL', 'FULL',
+                'GROUP', 'ORDER', 'LIMIT', 'UNION', 'EXCEPT', 'INTERSECT', 'USING', 'WINDOW',
+                'HAVING', 'INDEXED', 'NOT'}
+
+# Authorizer actions a generated query may perform
+_READ_ONLY_ACTIONS = {sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION,
+                      getattr(sqlite3, 'SQLITE_RECURSIVE', 33)}
+
+
+class QueryCostError(ValueError):
+    """A query was refused before execution: estimated too expensive"""
+
+    def __init__(self, message: str, cost: Optional[Dict[str, Any]] = None):
+        super().__init__(message)
+        self.cost = cost or {}
+
+
+# Pragmas SQLite modules issue internally while reading (FTS5 checks data_version)
+_READ_ONLY_PRAGMAS = {'data_version'}
+
+
+def read_only_authorizer(action: int, arg1, arg2, db_name, trigger) -> int:
+    """sqlite3 authorizer that only allows reading, so generated SQL never takes write locks"""
+    if action in _READ_ONLY_ACTIONS:
+        return sqlite3.SQLITE_OK
+    if action == sqlite3.SQLITE_PRAGMA and arg1 in _READ_ONLY_PRAGMAS and arg2 is None:
+        return sqlite3.SQLITE_OK
+    # Virtual table constructors (FTS5) declare their schema through sqlite_master;
+    # SQLite refuses real writes to it without PRAGMA writable_schema, which is denied
+    if action == sqlite3.SQLITE_UPDATE and arg1 == 'sqlite_master':
+        return sqlite3.SQLITE_OK
+    return sqlite3.SQLITE_DENY
+
+
+def table_aliases(query: str, tables) -> Dict[str, str]:
+    """Aliases given to known tables in a query (plans name aliased tables by their alias)"""
+    aliases = {}
+    if not tables:
+        return aliases
+    names = "|".join(re.escape(name) for name in sorted(tables, key=len, reverse=True))
+    pattern = re.compile(rf'(?<![\w.])["`\[]?({names})["`\]]?\s+(?:AS\s+)?["`\[]?(\w+)', re.I)
+    for table, alias in pattern.findall(query):
+        if alias.upper() not in _NOT_ALIASES:
+            aliases[alias] = table
+    return aliases
+
+
+def estimate_cost(conn: sqlite3.Connection, query: str, row_counts: Dict[str, int]) -> Dict[str, Any]:
+    """
+    Estimate the rows a query examines from its EXPLAIN QUERY PLAN
+    Nested SCAN/SEARCH steps of a plan level are nested loops, so their row
+    estimates multiply; full scans use the cached row counts
+    Returns {"rows", "full_scans", "cross_join", "temp_btree", "plan"}
+    """
+    plan = conn.execute(f"EXPLAIN QUERY PLAN {query}").fetchall()
+    children: Dict[int, List[tuple]] = {}
+    for node_id, parent, _, detail in plan:
+        children.setdefault(parent, []).append((node_id, detail))
+
+    cost = {
+        "rows": 0,
+        "full_scans": [],
+        "cross_join": False,
+        "temp_btree": any("TEMP B-TREE" in detail for _, _, _, detail in plan),
+        "plan": [detail for _, _, _, detail in plan]
+    }
+    derived: Dict[str, int] = {}
+    counts_by_name = {name.lower(): rows for name, rows in row_counts.items()}
+    for alias, table in table_aliases(query, row_counts).items():
+        derived.setdefault(alias, counts_by_name[table.lower()])
+
+    def level_cost(parent: int, outer_rows: int) -> int:
+        """Rows examined by one plan level; returns the rows it produces"""
+        rows = 1
+        for node_id, detail in children.get(parent, []):
+            loop = _LOOP.match(detail)
+            if loop and loop.group(2) != 'CONSTANT':
+                table, access = loop.group(2), loop.group(4)
+                table_rows = row_counts.get(table, derived.get(table, UNKNOWN_TABLE_ROWS))
+                if 'VIRTUAL TABLE' in access:
+                    # Full-text index lookup
+                    fanout = min(INDEX_FANOUT, max(table_rows, 1))
+                elif loop.group(1) == 'SCAN':
+                    fanout = table_rows
+                    cost["full_scans"].append(table)
+                    if rows > 1:
+                        cost["cross_join"] = True
+                elif 'INTEGER PRIMARY KEY' in access:
+                    fanout = 1
+                else:
+                    fanout = min(INDEX_FANOUT, max(table_rows, 1))
+                    if 'AUTOMATIC' in access:
+                        # The automatic index is built with one scan of the table
+                        cost["rows"] += table_rows
+                rows *= max(fanout, 1)
+                cost["rows"] += rows * outer_rows
+                continue
+
+            # Subqueries run once, except correlated ones which run per outer row
+            repeat = outer_rows * rows if detail.startswith('CORRELATED') else outer_rows
+            produced = level_cost(node_id, repeat)
+            name = _DERIVED.match(detail)
+            if name and name.group(1):
+                derived[name.group(1)] = produced
+        return rows
+
+    level_cost(0, 1)
+    return cost
+
+
+class QueryGuard:
+    """
+    Pre-execution check of generated SQL against a cost budget
+    SQL_MAX_COST_ROWS is the budget in estimated rows examined (default 5M),
+    SQL_COST_POLICY what happens above it (reject, revise or rewrite) and
+    SQL_REWRITE_LIMIT the LIMIT added by the rewrite policy
+    """
+
+    def __init__(self, max_rows: int = 5_000_000, policy: str = POLICY_REWRITE, rewrite_limit: int = 1000):
+        if policy not in COST_POLICIES:
+            raise ValueError(f"Unsupported SQL cost policy: {policy}")
+        self.max_rows = max_rows
+        self.policy = policy
+        self.rewrite_limit = rewrite_limit
+
+    @classmethod
+    def from_env(cls) -> 'QueryGuard':
+        return cls(max_rows=int(float(os.getenv('SQL_MAX_COST_ROWS', '5000000'))),
+                   policy=os.getenv('SQL_COST_POLICY', POLICY_REWRITE),
+                   rewrite_limit=int(os.getenv('SQL_REWRITE_LIMIT', '1000')))
+
+    def check(self, conn: sqlite3.Connection, query: str, row_counts: Dict[str, int],
+              query_span=None) -> str:
+        """
+        Return the query to run: the query itself, or a rewrite bounded by a LIMIT
+        Raises QueryCostError if it is over budget and cannot (or may not) be rewritten
+        """
+        cost = estimate_cost(conn, query, row_counts)
+        if query_span is not None:
+            query_span.set(estimated_rows=cost["rows"], cross_join=cost["cross_join"])
+        if cost["rows"] <= self.max_rows:
+            return query
+
+        if self.policy == POLICY_REWRITE and self._limit_bounds_cost(query, cost):
+            if query_span is not None:
+                query_span.set(rewritten=True)
+            return f"SELECT * FROM ({normalize_sql(query)}) LIMIT {self.rewrite_limit}"
+
+        raise QueryCostError(self.describe(cost), cost)
+
+    def describe(self, cost: Dict[str, Any]) -> str:
+        """Reason a query was refused, also used to ask the LLM for a revision"""
+        reasons = []
+        if cost["cross_join"]:
+            reasons.append("表之间没有连接条件（笛卡尔积）")
+        if cost["full_scans"]:
+            reasons.append(f"全表扫描 {', '.join(dict.fromkeys(cost['full_scans']))}")
+        detail = "，".join(reasons) or "查询过于复杂"
+        return f"查询预计扫描约 {cost['rows']:,} 行，超过上限 {self.max_rows:,} 行：{detail}"
+
+    @staticmethod
+    def _limit_bounds_cost(query: str, cost: Dict[str, Any]) -> bool:
+        """
+        Whether an outer LIMIT stops the work early: only for pipelined plans
+        Sorting, grouping and aggregates read every row first, and a filtered
+        cross join may scan the whole product before finding a match
+        """
+        return not (cost["cross_join"] or cost["temp_btree"] or
+                    _AGGREGATE.search(query) or _LIMIT.search(query))
@@ -1,8 +1,38 @@
 import sqlite3
-import pandas as pd
 import os
+import json
 import re
-from typing import Dict, List, Optional, Tuple, Any
+import uuid
+import shutil
+import difflib
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, Any
+from columnar_store import ColumnarStore
+from artifact_store import ArtifactStore
+from entity_index import EntityIndex
+from query_cache import QueryResultCache, normalize_sql, is_cacheable, SQL_TOKENS
+from query_guard import QueryGuard, QueryCostError, read_only_authorizer
+from text_index import build_text_index, text_index_columns, rewrite_like, is_fts_table, fts_table_name
+from workbook_reader import stream_workbook, column_type, format_rows
+from tracing import span
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Supported storage backends for tabular knowledge
+STORAGE_SQLITE = 'sqlite'
+STORAGE_PARQUET = 'parquet'
+STORAGE_BACKENDS = (STORAGE_SQLITE, STORAGE_PARQUET)
+
+# Seconds an import waits for another writer (e.g. a parallel bulk import) to release the database
+SQLITE_WRITE_TIMEOUT = 60
+
+# SQLite's default limit on attached databases (SQLITE_MAX_ATTACHED)
+MAX_FEDERATED_DATABASES = 10
+
+# Unknown identifiers fixed per query by mapping them to the closest real name
+MAX_IDENTIFIER_FIXES = 5
+
+_UNKNOWN_IDENTIFIER = re.compile(r'no such (column|table): (?:(\S+?)\.)?(\S+)$')
 
 class SQLQueryEngine:
     """
@@ -14,36 +44,191 @@ class SQLQueryEngine:
         """Initialize the SQL query engine with a directory for SQLite databases"""
         self.db_dir = db_dir
         os.makedirs(db_dir, exist_ok=True)
+        
+        # Derived per-KB data (table metadata, indexes) shared by all worker processes
+        self.artifacts = ArtifactStore(os.path.join(db_dir, 'artifacts'))
+        self.entity_index = EntityIndex(self)
+        
+        # Results of read-only queries, keyed on the data version of the queried KBs
+        self.result_cache = QueryResultCache.from_env(os.path.join(db_dir, 'query_cache'))
+        
+        # Cost budget for queries, checked with EXPLAIN QUERY PLAN before they run
+        self.guard = QueryGuard.from_env()
+        
+        # FTS5 trigram indexes over the text columns of SQLite tables with at least this many rows,
+        # so substring filters (LIKE '%玻璃钢%') become index lookups; SQL_FTS=0 disables them
+        self.fts_enabled = os.getenv('SQL_FTS', '1') == '1'
+        self.fts_min_rows = int(os.getenv('SQL_FTS_MIN_ROWS', '10000'))
     
     def get_db_path(self, kb_id: str) -> str:
         """Get the SQLite database path for a knowledge base"""
         return os.path.join(self.db_dir, f"{kb_id}.db")
     
-    def process_tabular_file(self, kb_id: str, file_path: str, file_id: str) -> Dict[str, Any]:
+    def get_parquet_dir(self, kb_id: str) -> str:
+        """Get the Parquet table directory for a knowledge base"""
+        return os.path.join(self.db_dir, f"{kb_id}_parquet")
+    
+    def get_storage(self, kb_id: str) -> str:
+        """Get the storage backend used by a knowledge base"""
+        if os.path.isdir(self.get_parquet_dir(kb_id)):
+            return STORAGE_PARQUET
+        return STORAGE_SQLITE
+    
+    def set_storage(self, kb_id: str, storage: str) -> None:
+        """
+        Select the storage backend for a knowledge base
+        Must be called before any file is imported
+        """
+        if storage not in STORAGE_BACKENDS:
+            raise ValueError(f"Unsupported storage backend: {storage}")
+        
+        if storage == STORAGE_PARQUET:
+            if not ColumnarStore.is_available():
+                raise ValueError("Parquet storage requires the duckdb and pyarrow packages")
+            os.makedirs(self.get_parquet_dir(kb_id), exist_ok=True)
+        elif os.path.isdir(self.get_parquet_dir(kb_id)):
+            shutil.rmtree(self.get_parquet_dir(kb_id))
+        
+        self.bump_data_version(kb_id)
+        self.entity_index.schedule_build(kb_id)
+    
+    def delete_storage(self, kb_id: str) -> None:
+        """Delete all tabular data stored for a knowledge base"""
+        db_path = self.get_db_path(kb_id)
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        
+        parquet_dir = self.get_parquet_dir(kb_id)
+        if os.path.isdir(parquet_dir):
+            shutil.rmtree(parquet_dir)
+        
+        self.artifacts.delete(kb_id)
+        
+        version_path = self._get_version_path(kb_id)
+        if os.path.exists(version_path):
+            os.remove(version_path)
+        self.result_cache.invalidate(kb_id)
+    
+    def drop_file_tables(self, kb_id: str, file_id: str) -> List[str]:
+        """Drop the tables imported from a file; returns their names"""
+        prefix = self._get_table_name(file_id)
+        
+        if self.get_storage(kb_id) == STORAGE_PARQUET:
+            store = ColumnarStore(self.get_parquet_dir(kb_id))
+            dropped = [name for name in store.list_tables() if name == prefix or name.startswith(prefix + "_")]
+            for table_name in dropped:
+                store.drop_table(table_name)
+        else:
+            db_path = self.get_db_path(kb_id)
+            if not os.path.exists(db_path):
+                return []
+            
+            conn = sqlite3.connect(db_path, timeout=SQLITE_WRITE_TIMEOUT)
+            try:
+                dropped = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")
+                           if (row[0] == prefix or row[0].startswith(prefix + "_")) and not is_fts_table(row[0])]
+                for table_name in dropped:
+                    conn.execute(f'DROP TABLE "{table_name}"')
+                    conn.execute(f'DROP TABLE IF EXISTS "{fts_table_name(table_name)}"')
+                conn.commit()
+            finally:
+                conn.close()
+        
+        if dropped:
+            self.bump_data_version(kb_id)
+            self.entity_index.schedule_build(kb_id)
+        return dropped
+    
+    def get_data_version(self, kb_id: str) -> Optional[str]:
+        """
+        Identifies the current contents of a knowledge base's tabular storage
+        Combines the token replaced on every import and delete with the storage file
+        stamp, which also catches writes made elsewhere; None if nothing has been imported
+        """
+        if self.get_storage(kb_id) == STORAGE_PARQUET:
+            path = self.get_parquet_dir(kb_id)
+        else:
+            path = self.get_db_path(kb_id)
+        
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        
+        try:
+            with open(self._get_version_path(kb_id), 'r', encoding='utf-8') as f:
+                token = f.read().strip()
+        except FileNotFoundError:
+            token = '0'
+        return f"{token}:{stat.st_ino}:{stat.st_mtime_ns}:{stat.st_size}"
+    
+    def bump_data_version(self, kb_id: str) -> None:
+        """Mark a knowledge base's tables as changed, invalidating cached results and artifacts"""
+        version_path = self._get_version_path(kb_id)
+        tmp_path = f"{version_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(uuid.uuid4().hex)
+        os.replace(tmp_path, version_path)
+        self.result_cache.invalidate(kb_id)
+    
+    def _get_version_path(self, kb_id: str) -> str:
+        return os.path.join(self.db_dir, f"{kb_id}.version")
+    
+    def process_tabular_file(self, kb_id: str, file_path: str, file_id: str,
+                             text_sink: Optional[List[str]] = None, build_index: bool = True) -> Dict[str, Any]:
         """
         Process a tabular file (CSV, Excel) and store it in SQLite
         Returns metadata about the imported tables
+        If text_sink is given, a text rendering of the data is appended to it from the
+        same parse, so callers need not read the file again
+        Bulk imports pass build_index=False and rebuild the entity index once at the end
         """
-        db_path = self.get_db_path(kb_id)
-        table_name = f"table_{file_id}"
+        metadata = self._import_tabular_file(kb_id, file_path, file_id, text_sink)
+        self.bump_data_version(kb_id)
+        if not build_index:
+            return metadata
         
-        # Read the file based on extension
+        # Index identifier cells for exact lookups; the import itself already succeeded
+        try:
+            with span("sql.entity_index") as index_span:
+                index_span.set(entities=self.entity_index.build(kb_id))
+        except Exception as e:
+            print(f"Warning: Failed to build entity index: {e}")
+        
+        return metadata
+    
+    def _import_tabular_file(self, kb_id: str, file_path: str, file_id: str,
+                             text_sink: Optional[List[str]]) -> Dict[str, Any]:
+        """Read a CSV/Excel file and import its sheets into the KB's storage backend"""
+        table_name = self._get_table_name(file_id)
+        
+        # .xlsx workbooks are streamed sheet by sheet from a single read-only parse
         file_ext = os.path.splitext(file_path)[1].lower()
+        if file_ext == '.xlsx':
+            return self._import_workbook(kb_id, file_path, file_id, table_name, text_sink)
+        
+        import pandas as pd
+        
+        # Read the file based on extension
         if file_ext == '.csv':
             df = pd.read_csv(file_path)
-        elif file_ext in ['.xlsx', '.xls']:
+            if text_sink is not None:
+                text_sink.append(df.to_string())
+        elif file_ext == '.xls':
             # Handle multiple sheets in Excel
             xls = pd.ExcelFile(file_path)
             tables_info = []
             
             for sheet_name in xls.sheet_names:
-                sheet_df = pd.read_excel(file_path, sheet_name=sheet_name)
+                sheet_df = pd.read_excel(xls, sheet_name=sheet_name)
+                if text_sink is not None:
+                    text_sink.append(f"Sheet: {sheet_name}\n{sheet_df.to_string()}")
                 sheet_table_name = f"{table_name}_{self._sanitize_name(sheet_name)}"
                 
-                # Store metadata and import to SQLite
-                self._import_dataframe_to_sqlite(df=sheet_df, 
-                                               db_path=db_path, 
-                                               table_name=sheet_table_name)
+                # Store metadata and import to the knowledge base storage
+                self._import_dataframe(kb_id=kb_id, 
+                                       df=sheet_df, 
+                                       table_name=sheet_table_name)
                 
                 tables_info.append({
                     "table_name": sheet_table_name,
@@ -62,7 +247,7 @@ class SQLQueryEngine:
             raise ValueError(f"Unsupported file type for SQL import: {file_ext}")
         
         # For CSV files, import the single dataframe
-        self._import_dataframe_to_sqlite(df=df, db_path=db_path, table_name=table_name)
+        self._import_dataframe(kb_id=kb_id, df=df, table_name=table_name)
         
         return {
             "file_id": file_id,
@@ -75,19 +260,337 @@ class SQLQueryEngine:
             "total_tables": 1
         }
     
+    def _get_table_name(self, file_id: str) -> str:
+        """Table name for a file; sheets of a workbook get a _<sheet> suffix"""
+        # UUID file ids contain '-', which is not valid in an unquoted table name
+        return "table_" + re.sub(r'[^\w]', '_', file_id)
+    
+    def _import_workbook(self, kb_id: str, file_path: str, file_id: str, table_name: str,
+                         text_sink: Optional[List[str]]) -> Dict[str, Any]:
+        """
+        Import every sheet of an .xlsx workbook in one streaming pass
+        Rows go straight into SQLite (one transaction) while the next chunk is parsed;
+        Parquet storage collects each sheet into a DataFrame first
+        """
+        parquet = self.get_storage(kb_id) == STORAGE_PARQUET
+        tables_info = []
+        sheet_rows = []
+        sheet_text = []
+        
+        conn = None if parquet else sqlite3.connect(self.get_db_path(kb_id), timeout=SQLITE_WRITE_TIMEOUT)
+        try:
+            for sheet_name, header, rows in stream_workbook(file_path):
+                if not tables_info or tables_info[-1]["sheet_name"] != sheet_name:
+                    if parquet and tables_info:
+                        self._write_sheet_to_parquet(kb_id, tables_info[-1], sheet_rows)
+                    
+                    sheet_table_name = f"{table_name}_{self._sanitize_name(sheet_name)}"
+                    columns = self._unique_names([self._sanitize_name(name) for name in header])
+                    tables_info.append({
+                        "table_name": sheet_table_name,
+                        "sheet_name": sheet_name,
+                        "column_count": len(columns),
+                        "row_count": 0,
+                        "columns": columns
+                    })
+                    sheet_rows = []
+                    
+                    if conn is not None:
+                        column_types = [column_type([row[i] for row in rows]) for i in range(len(columns))]
+                        column_defs = ", ".join(f'"{name}" {sql_type}' for name, sql_type in zip(columns, column_types))
+                        conn.execute(f'DROP TABLE IF EXISTS "{sheet_table_name}"')
+                        conn.execute(f'CREATE TABLE "{sheet_table_name}" ({column_defs})')
+                    
+                    if text_sink is not None:
+                        if sheet_text:
+                            text_sink.append("\n".join(sheet_text))
+                        sheet_text = [f"Sheet: {sheet_name}", format_rows([header])]
+                
+                table = tables_info[-1]
+                table["row_count"] += len(rows)
+                if conn is not None:
+                    placeholders = ", ".join("?" * table["column_count"])
+                    conn.executemany(f'INSERT INTO "{table["table_name"]}" VALUES ({placeholders})', rows)
+                else:
+                    sheet_rows.extend(rows)
+                
+                if text_sink is not None and rows:
+                    sheet_text.append(format_rows(rows))
+            
+            if text_sink is not None and sheet_text:
+                text_sink.append("\n".join(sheet_text))
+            
+            if parquet and tables_info:
+                self._write_sheet_to_parquet(kb_id, tables_info[-1], sheet_rows)
+            if conn is not None:
+                for table in tables_info:
+                    self._build_text_index(conn, table["table_name"])
+                conn.commit()
+        finally:
+            if conn is not None:
+                conn.close()
+        
+        return {
+            "file_id": file_id,
+            "tables": tables_info,
+            "total_tables": len(tables_info)
+        }
+    
+    def _write_sheet_to_parquet(self, kb_id: str, table: Dict[str, Any], rows: List[tuple]) -> None:
+        import pandas as pd
+        
+        df = pd.DataFrame(rows, columns=table["columns"])
+        ColumnarStore(self.get_parquet_dir(kb_id)).write_table(df, table["table_name"])
+    
+    def _unique_names(self, names: List[str]) -> List[str]:
+        """Make sanitized column names unique (SQLite rejects duplicate columns)"""
+        unique = []
+        for name in names:
+            candidate, n = name, 1
+            while candidate in unique:
+                candidate = f"{name}_{n}"
+                n += 1
+            unique.append(candidate)
+        return unique
+    
     def execute_query(self, kb_id: str, query: str) -> Tuple[List[Dict[str, Any]], List[str]]:
         """
         Execute a SQL query against the knowledge base
         Returns results and column names
         """
+        storage = self.get_storage(kb_id)
+        
+        with span("sql.execute", storage=storage) as query_span:
+            results, column_names = self._execute_cached(
+                [kb_id], query, query_span, lambda: self._execute_query(kb_id, query, storage, query_span))
+            query_span.set(rows_returned=len(results))
+            return results, column_names
+    
+    def _execute_cached(self, kb_ids: List[str], query: str, query_span, 
+                        execute) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """Serve a read-only query from the result cache, or execute and cache it"""
+        key = None
+        if self.result_cache.enabled and is_cacheable(normalize_sql(query)):
+            versions = {kb_id: self.get_data_version(kb_id) for kb_id in kb_ids}
+            if None not in versions.values():
+                key = self.result_cache.make_key(versions, query)
+        
+        if key is None:
+            return execute()
+        
+        cached, tier = self.result_cache.get(key, kb_ids)
+        query_span.set(cache=tier)
+        if cached is not None:
+            return cached
+        
+        results, column_names = execute()
+        self.result_cache.put(key, kb_ids, results, column_names)
+        return results, column_names
+    
+    def _execute_query(self, kb_id: str, query: str, storage: str, 
+                       query_span) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """Execute a SQL query on the storage backend of a knowledge base"""
+        if storage == STORAGE_PARQUET:
+            try:
+                return ColumnarStore(self.get_parquet_dir(kb_id)).execute(query)
+            except Exception as e:
+                raise Exception(f"Error executing SQL query: {e}")
+        
         db_path = self.get_db_path(kb_id)
         
         if not os.path.exists(db_path):
             raise ValueError(f"No database found for knowledge base {kb_id}")
         
-        conn = sqlite3.connect(db_path)
+        tables = self.get_table_metadata(kb_id)
+        
+        conn = self._connect_read_only(db_path)
+        try:
+            return self._run_sqlite_query(conn, query, query_span, tables)
+        finally:
+            conn.close()
+    
+    def execute_federated_query(self, kb_ids: List[str], query: str) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """
+        Execute a SQL query across several knowledge bases at once
+        Each knowledge base database is attached read-only under its schema alias
+        (see get_schema_aliases), so tables are referenced as <alias>.<table>
+        """
+        aliases = self.get_schema_aliases(kb_ids)
+        
+        with span("sql.execute", storage="federated", knowledge_bases=len(kb_ids)) as query_span:
+            for kb_id in kb_ids:
+                if self.get_storage(kb_id) != STORAGE_SQLITE:
+                    raise ValueError(f"Federated queries require SQLite storage (knowledge base {kb_id})")
+                if not os.path.exists(self.get_db_path(kb_id)):
+                    raise ValueError(f"No database found for knowledge base {kb_id}")
+            
+            results, column_names = self._execute_cached(
+                kb_ids, query, query_span, lambda: self._execute_federated_query(aliases, query, query_span))
+            query_span.set(rows_returned=len(results))
+            return results, column_names
+    
+    def _execute_federated_query(self, aliases: Dict[str, str], query: str, 
+                                 query_span) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """Attach the knowledge base databases to an in-memory connection and run the query"""
+        tables = self.get_federated_table_metadata(list(aliases))
+        
+        conn = self._connect_federated(aliases)
+        try:
+            return self._run_sqlite_query(conn, query, query_span, tables)
+        finally:
+            conn.close()
+    
+    def _connect_federated(self, aliases: Dict[str, str]) -> sqlite3.Connection:
+        """In-memory connection with each knowledge base database attached read-only"""
+        conn = sqlite3.connect(":memory:", uri=True)
+        for kb_id, alias in aliases.items():
+            conn.execute(f'ATTACH DATABASE ? AS "{alias}"', (self._read_only_uri(self.get_db_path(kb_id)),))
+        return conn
+    
+    def _connect_read_only(self, db_path: str) -> sqlite3.Connection:
+        return sqlite3.connect(self._read_only_uri(db_path), uri=True)
+    
+    @staticmethod
+    def _read_only_uri(db_path: str) -> str:
+        return "file:" + os.path.abspath(db_path).replace("?", "%3f").replace("#", "%23") + "?mode=ro"
+    
+    def validate_query(self, kb_ids: List[str], query: str) -> Optional[str]:
+        """
+        Compile a query against the schema without running it
+        Returns SQLite's error message, or None if the query compiles
+        Only SQLite storage is checked; Parquet queries are validated when they run
+        """
+        if any(self.get_storage(kb_id) != STORAGE_SQLITE or not os.path.exists(self.get_db_path(kb_id))
+               for kb_id in kb_ids):
+            return None
+        
+        with span("sql.validate"):
+            if len(kb_ids) == 1:
+                conn = self._connect_read_only(self.get_db_path(kb_ids[0]))
+            else:
+                conn = self._connect_federated(self.get_schema_aliases(kb_ids))
+            try:
+                conn.set_authorizer(read_only_authorizer)
+                # EXPLAIN compiles the statement into its program but does not execute it
+                conn.execute(f"EXPLAIN {query}").fetchone()
+                return None
+            except sqlite3.Error as e:
+                return str(e)
+            finally:
+                conn.close()
+    
+    def repair_query(self, kb_ids: List[str], query: str, 
+                     tables: Optional[List[Dict[str, Any]]] = None) -> Tuple[str, Optional[str]]:
+        """
+        Fix unknown column and table names by mapping them to the closest real names
+        Headers are sanitized on import (e.g. "1号" becomes col_1号, spaces become _),
+        which generated SQL often gets wrong
+        Returns the (possibly repaired) query and the error that remains, if any
+        """
+        if tables is None:
+            tables = (self.get_table_metadata(kb_ids[0]) if len(kb_ids) == 1 
+                      else self.get_federated_table_metadata(kb_ids))
+        
+        error = self.validate_query(kb_ids, query)
+        for _ in range(MAX_IDENTIFIER_FIXES):
+            match = _UNKNOWN_IDENTIFIER.search(error or "")
+            if not match:
+                break
+            kind, name = match.group(1), match.group(3)
+            if kind == "column":
+                candidates = [column["name"] for table in tables for column in table["columns"]]
+            else:
+                candidates = [table["table_name"].split(".")[-1] for table in tables]
+            
+            replacement = self._closest_name(name, candidates)
+            if replacement is None:
+                break
+            repaired = self._replace_identifier(query, name, replacement)
+            if repaired == query:
+                break
+            query = repaired
+            error = self.validate_query(kb_ids, query)
+        
+        return query, error
+    
+    def _closest_name(self, name: str, candidates: List[str]) -> Optional[str]:
+        """Real name an unknown identifier most likely means, or None"""
+        def key(value):
+            value = re.sub(r'^col_', '', self._sanitize_name(value).lower())
+            return value.replace('_', '')
+        
+        keys = {}
+        for candidate in dict.fromkeys(candidates):
+            keys.setdefault(key(candidate), candidate)
+        
+        if key(name) in keys:
+            return keys[key(name)]
+        matches = difflib.get_close_matches(key(name), list(keys), n=1, cutoff=0.6)
+        return keys[matches[0]] if matches else None
+    
+    def _replace_identifier(self, query: str, name: str, replacement: str) -> str:
+        """Replace an identifier outside string literals, quoting the replacement"""
+        quoted = '"' + replacement.replace('"', '""') + '"'
+        bare = re.compile(rf'(?<![\w"`\]]){re.escape(name)}(?![\w"`\[])')
+        
+        parts = []
+        for i, part in enumerate(SQL_TOKENS.split(query)):
+            if i % 2 == 0:
+                part = bare.sub(lambda _: quoted, part)
+            elif part[:1] in '"`[' and part[1:-1] == name:
+                part = quoted
+            parts.append(part)
+        return ''.join(parts)
+    
+    def get_federated_table_metadata(self, kb_ids: List[str]) -> List[Dict[str, Any]]:
+        """Table metadata of several knowledge bases, with schema-qualified table names"""
+        tables = []
+        for kb_id, alias in self.get_schema_aliases(kb_ids).items():
+            for table in self.get_table_metadata(kb_id):
+                tables.append({
+                    **table,
+                    "table_name": f"{alias}.{table['table_name']}",
+                    "knowledge_base_id": kb_id
+                })
+        return tables
+    
+    def get_schema_aliases(self, kb_ids: List[str]) -> Dict[str, str]:
+        """Schema alias of each knowledge base in a federated query: kb1, kb2, ..."""
+        if len(kb_ids) > MAX_FEDERATED_DATABASES:
+            raise ValueError(f"At most {MAX_FEDERATED_DATABASES} knowledge bases can be queried together")
+        return {kb_id: f"kb{i + 1}" for i, kb_id in enumerate(kb_ids)}
+    
+    def _run_sqlite_query(self, conn: sqlite3.Connection, query: str, query_span,
+                          tables: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """
+        Run a generated query on an open SQLite connection
+        Substring filters on indexed columns are rewritten into full-text lookups; the
+        connection is made read-only and the query checked against the cost budget,
+        which may reject it (QueryCostError) or bound it with a LIMIT
+        """
+        # Plans name attached tables without their schema, so count both spellings
+        row_counts = {}
+        for table in tables:
+            row_counts[table["table_name"]] = table["row_count"]
+            row_counts[table["table_name"].split(".")[-1]] = table["row_count"]
+        
+        query, rewrites = rewrite_like(query, tables)
+        if rewrites:
+            query_span.set(fts_rewrites=rewrites)
+        
+        conn.set_authorizer(read_only_authorizer)
+        
+        # Count VM steps (in thousands) as a proxy for rows scanned, only when traced
+        vm_steps = [0]
+        if query_span.recording:
+            def count_steps():
+                vm_steps[0] += 1
+                return 0
+            conn.set_progress_handler(count_steps, 1000)
         
         try:
+            query = self.guard.check(conn, query, row_counts, query_span)
+            
             # Execute the query
             cursor = conn.cursor()
             cursor.execute(query)
@@ -106,19 +609,80 @@ class SQLQueryEngine:
                     result[column] = row[i]
                 results.append(result)
             
+            query_span.set(vm_steps_k=vm_steps[0])
             return results, column_names
         
+        except QueryCostError:
+            raise
         except Exception as e:
             raise Exception(f"Error executing SQL query: {e}")
+    
+    def iter_rows(self, kb_id: str, table_name: str):
+        """Yield (row key, values) for every row of a table; the key is accepted by fetch_cell"""
+        if self.get_storage(kb_id) == STORAGE_PARQUET:
+            results, columns = ColumnarStore(self.get_parquet_dir(kb_id)).execute(f'SELECT * FROM "{table_name}"')
+            for ordinal, row in enumerate(results):
+                yield ordinal, [row[column] for column in columns]
+            return
         
+        conn = sqlite3.connect(self.get_db_path(kb_id))
+        try:
+            for row in conn.execute(f'SELECT rowid, * FROM "{table_name}"'):
+                yield row[0], row[1:]
         finally:
             conn.close()
     
+    def fetch_cell(self, kb_id: str, table_name: str, row_key: int, column: str) -> Any:
+        """Read a single cell by row key (SQLite rowid, or row position for Parquet)"""
+        with span("sql.fetch_cell"):
+            if self.get_storage(kb_id) == STORAGE_PARQUET:
+                results, _ = ColumnarStore(self.get_parquet_dir(kb_id)).execute(
+                    f'SELECT "{column}" FROM "{table_name}" LIMIT 1 OFFSET {int(row_key)}')
+                return results[0][column] if results else None
+            
+            conn = sqlite3.connect(self.get_db_path(kb_id))
+            try:
+                row = conn.execute(f'SELECT "{column}" FROM "{table_name}" WHERE rowid = ?', (row_key,)).fetchone()
+                return row[0] if row else None
+            finally:
+                conn.close()
+    
     def get_table_metadata(self, kb_id: str) -> List[Dict[str, Any]]:
         """
         Get metadata about all tables in the knowledge base
         Useful for constructing SQL queries
         """
+        with span("sql.metadata") as metadata_span:
+            stamp = self.get_data_version(kb_id)
+            if stamp is None:
+                return []
+            
+            # Served from a memory-mapped artifact while the storage is unchanged
+            artifact_name = f"{kb_id}/table_metadata"
+            reader = self.artifacts.open(artifact_name)
+            if reader is not None:
+                with reader:
+                    if reader.get("stamp") == stamp.encode():
+                        tables = json.loads(reader.get("tables"))
+                        metadata_span.set(tables=len(tables), cache_hit=True)
+                        return tables
+            
+            tables = self._get_table_metadata(kb_id)
+            self.artifacts.publish(artifact_name, {
+                "stamp": stamp.encode(),
+                "tables": json.dumps(tables, ensure_ascii=False).encode('utf-8')
+            })
+            metadata_span.set(tables=len(tables), cache_hit=False)
+            return tables
+    
+    def _get_table_metadata(self, kb_id: str) -> List[Dict[str, Any]]:
+        """Read table metadata from the storage backend of a knowledge base"""
+        if self.get_storage(kb_id) == STORAGE_PARQUET:
+            try:
+                return ColumnarStore(self.get_parquet_dir(kb_id)).get_table_metadata()
+            except Exception as e:
+                raise Exception(f"Error getting table metadata: {e}")
+        
         db_path = self.get_db_path(kb_id)
         
         if not os.path.exists(db_path):
@@ -131,22 +695,26 @@ class SQLQueryEngine:
             # Get all tables
             cursor = conn.cursor()
             cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-            table_names = [row[0] for row in cursor.fetchall()]
+            table_names = [row[0] for row in cursor.fetchall() if not is_fts_table(row[0])]
+            fts_columns = text_index_columns(conn)
             
             # Get schema for each table
             for table_name in table_names:
-                cursor.execute(f"PRAGMA table_info({table_name});")
+                cursor.execute(f'PRAGMA table_info("{table_name}");')
                 columns = cursor.fetchall()
                 
                 # Get row count
-                cursor.execute(f"SELECT COUNT(*) FROM {table_name};")
+                cursor.execute(f'SELECT COUNT(*) FROM "{table_name}";')
                 row_count = cursor.fetchone()[0]
                 
-                tables.append({
+                table = {
                     "table_name": table_name,
                     "columns": [{"name": col[1], "type": col[2]} for col in columns],
                     "row_count": row_count
-                })
+                }
+                if table_name in fts_columns:
+                    table["fts_columns"] = fts_columns[table_name]
+                tables.append(table)
             
             return tables
         
@@ -156,9 +724,20 @@ class SQLQueryEngine:
         finally:
             conn.close()
     
-    def _import_dataframe_to_sqlite(self, df: pd.DataFrame, db_path: str, table_name: str) -> None:
+    def _import_dataframe(self, kb_id: str, df: 'pd.DataFrame', table_name: str) -> None:
+        """Import a pandas DataFrame into the storage backend of a knowledge base"""
+        if self.get_storage(kb_id) == STORAGE_PARQUET:
+            # Clean column names the same way as for SQLite so prompts stay identical
+            df.columns = [self._sanitize_name(col) for col in df.columns]
+            ColumnarStore(self.get_parquet_dir(kb_id)).write_table(df, table_name)
+        else:
+            self._import_dataframe_to_sqlite(df=df, 
+                                             db_path=self.get_db_path(kb_id), 
+                                             table_name=table_name)
+    
+    def _import_dataframe_to_sqlite(self, df: 'pd.DataFrame', db_path: str, table_name: str) -> None:
         """Import a pandas DataFrame to SQLite"""
-        conn = sqlite3.connect(db_path)
+        conn = sqlite3.connect(db_path, timeout=SQLITE_WRITE_TIMEOUT)
         
         try:
             # Clean column names (remove special characters, spaces)
@@ -166,10 +745,20 @@ class SQLQueryEngine:
             
             # Write to SQLite
             df.to_sql(table_name, conn, if_exists='replace', index=False)
+            self._build_text_index(conn, table_name)
+            conn.commit()
         
         finally:
             conn.close()
     
+    def _build_text_index(self, conn: sqlite3.Connection, table_name: str) -> None:
+        """Full-text index over a table's text columns, if enabled and the table is large enough"""
+        if self.fts_enabled:
+            with span("sql.text_index", table=table_name) as index_span:
+                index_span.set(columns=len(build_text_index(conn, table_name, self.fts_min_rows)))
+        else:
+            conn.execute(f'DROP TABLE IF EXISTS "{fts_table_name(table_name)}"')
+    
     def _sanitize_name(self, name: str) -> str:
         """Sanitize table and column names for SQLite"""
         # Replace spaces and special chars with underscore
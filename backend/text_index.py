@@ -0,0 +1,148 @@
+import re
+import sqlite3
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple
+from query_guard import table_aliases
+
+# Full-text shadow index of a table: <table>__fts (FTS5 creates <table>__fts_data etc. next to it)
+FTS_SUFFIX = "__fts"
+
+# The trigram tokenizer can only look up substrings of at least three characters
+MIN_MATCH_CHARS = 3
+
+# A `[alias.]column LIKE '%term%'` predicate; literals and comments are matched first so they are skipped
+_LIKE_PREDICATE = re.compile(r"""
+    (?P<skip>--[^\n]*|/\*.*?\*/|'(?:[^']|'')*')
+    |(?<![\w."\]`])(?:(?P<qualifier>\w+|"(?:[^"]|"")+")\s*\.\s*)?
+     (?P<column>\w+|"(?:[^"]|"")+"|`[^`]+`|\[[^\]]+\])
+     \s+LIKE\s+'%(?P<term>(?:[^'%_\\]|'')+)%'(?!\s*ESCAPE)
+""", re.S | re.I | re.X)
+
+
+def fts_table_name(table_name: str) -> str:
+    return table_name + FTS_SUFFIX
+
+
+def is_fts_table(table_name: str) -> bool:
+    """Whether a table is a full-text index or one of its FTS5 shadow tables"""
+    return FTS_SUFFIX in table_name
+
+
+@lru_cache(maxsize=1)
+def fts_available() -> bool:
+    """Check whether this SQLite build has FTS5 with the trigram tokenizer (SQLite 3.34+)"""
+    conn = sqlite3.connect(":memory:")
+    try:
+        conn.execute("CREATE VIRTUAL TABLE t USING fts5(c, tokenize='trigram')")
+        return True
+    except sqlite3.Error:
+        return False
+    finally:
+        conn.close()
+
+
+def build_text_index(conn: sqlite3.Connection, table_name: str, min_rows: int = 0) -> List[str]:
+    """
+    (Re)build the FTS5 trigram index over the TEXT columns of a table
+    The index is an external-content table keyed on the table's rowid, so it stores
+    only the index itself; tables are replaced as a whole on import, so it is rebuilt
+    rather than kept in sync. Returns the indexed columns
+    """
+    fts_name = fts_table_name(table_name)
+    conn.execute(f'DROP TABLE IF EXISTS "{fts_name}"')
+    if not fts_available():
+        return []
+
+    columns = [row[1] for row in conn.execute(f'PRAGMA table_info("{table_name}")')
+               if (row[2] or "").upper() == "TEXT"]
+    if not columns:
+        return []
+    if conn.execute(f'SELECT COUNT(*) FROM "{table_name}"').fetchone()[0] < min_rows:
+        return []
+
+    column_defs = ", ".join('"' + column.replace('"', '""') + '"' for column in columns)
+    conn.execute(f'CREATE VIRTUAL TABLE "{fts_name}" USING fts5({column_defs}, '
+                 f"content='{table_name}', content_rowid='rowid', tokenize='trigram')")
+    conn.execute(f'INSERT INTO "{fts_name}"("{fts_name}") VALUES(\'rebuild\')')
+    return columns
+
+
+def text_index_columns(conn: sqlite3.Connection) -> Dict[str, List[str]]:
+    """Indexed columns of every table that has a full-text index"""
+    indexes = {}
+    for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type='table' "
+                                "AND sql LIKE 'CREATE VIRTUAL TABLE%'"):
+        if name.endswith(FTS_SUFFIX):
+            indexes[name[:-len(FTS_SUFFIX)]] = [row[1] for row in conn.execute(f'PRAGMA table_info("{name}")')]
+    return indexes
+
+
+def rewrite_like(query: str, tables: List[Dict[str, Any]]) -> Tuple[str, int]:
+    """
+    Turn `column LIKE '%term%'` filters on indexed columns into FTS5 lookups
+    The predicate becomes `(rowid IN (SELECT rowid FROM <fts> WHERE column MATCH '"term"')
+    AND column LIKE '%term%')`: the index finds the candidate rows and the original LIKE
+    keeps the result exact. Terms shorter than three characters, patterns with inner
+    wildcards or ESCAPE, NOT LIKE and ambiguous columns are left alone
+    Returns the query and the number of predicates rewritten
+    """
+    indexed = {table["table_name"]: table for table in tables if table.get("fts_columns")}
+    if not indexed:
+        return query, 0
+
+    # Tables the query reads, by the qualifier their columns use (alias or table name)
+    aliases = table_aliases(query, [table["table_name"] for table in tables])
+    lower_names = {table["table_name"].lower(): table["table_name"] for table in tables}
+    references = {alias: lower_names[table.lower()] for alias, table in aliases.items()}
+    for name in lower_names.values():
+        if name not in references.values() and re.search(rf'(?<![\w."]){re.escape(name)}(?![\w"])', query, re.I):
+            references[name] = name
+
+    rewrites = [0]
+
+    def replace(match):
+        if match.group('skip') or re.search(r'\bNOT\s*$', query[:match.start()], re.I):
+            return match.group(0)
+
+        term = match.group('term').replace("''", "'")
+        column = _unquote(match.group('column'))
+        if len(term) < MIN_MATCH_CHARS:
+            return match.group(0)
+
+        qualifier = _unquote(match.group('qualifier')) if match.group('qualifier') else None
+        if qualifier is not None:
+            table_name = references.get(qualifier) or lower_names.get(qualifier.lower())
+        else:
+            owners = [(alias, table_name) for alias, table_name in references.items()
+                      if any(c["name"].lower() == column.lower()
+                             for c in next(t for t in tables if t["table_name"] == table_name)["columns"])]
+            if len(owners) != 1:
+                return match.group(0)
+            qualifier, table_name = owners[0]
+
+        table = indexed.get(table_name)
+        if table is None or column.lower() not in (c.lower() for c in table["fts_columns"]):
+            return match.group(0)
+
+        phrase = '"' + term.replace('"', '""') + '"'
+        rewrites[0] += 1
+        return (f"({_quote_path(qualifier)}.rowid IN (SELECT rowid FROM {_quote_path(fts_table_name(table_name))} "
+                f"WHERE {_quote(column)} MATCH '{phrase.replace(chr(39), chr(39) * 2)}') AND {match.group(0)})")
+
+    query = _LIKE_PREDICATE.sub(replace, query)
+    return query, rewrites[0]
+
+
+def _unquote(identifier: str) -> str:
+    if identifier[:1] in '"`[':
+        return identifier[1:-1].replace('""', '"')
+    return identifier
+
+
+def _quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def _quote_path(name: str) -> str:
+    """Quote a possibly schema-qualified name (kb1.table_x) part by part"""
+    return ".".join(_quote(part) for part in name.split(".", 1))
@@ -0,0 +1,282 @@
+import os
+import re
+import time
+import bisect
+import threading
+import contextvars
+from typing import Dict, List, Optional, Any, Tuple
+
+# Metrics are only collected when tracing is enabled (TRACING_ENABLED=1).
+# Per-request traces can still be started explicitly, e.g. for the `timings`
+# block of /api/chat, without paying for global metrics.
+_enabled = os.getenv('TRACING_ENABLED', '0') == '1'
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar('current_trace', default=None)
+
+# Histogram buckets in seconds, from sub-millisecond SQL to slow LLM calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def is_enabled() -> bool:
+    """Whether global metrics collection is enabled"""
+    return _enabled
+
+
+def set_enabled(enabled: bool) -> None:
+    """Enable or disable global metrics collection"""
+    global _enabled
+    _enabled = enabled
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token estimate without a tokenizer
+    CJK characters count as one token each, other text as ~4 characters per token
+    """
+    if not text:
+        return 0
+    cjk = len(re.findall(r'[\u4e00-\u9fff]', text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.values: Dict[Tuple, float] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value:g}")
+        return lines
+
+
+class Histogram:
+    """Cumulative histogram with labels"""
+
+    def __init__(self, name: str, documentation: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.values: Dict[Tuple, Dict[str, Any]] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                series = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+                self.values[key] = series
+            series["counts"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, series in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), series["counts"]):
+                    cumulative += count
+                    le = "+Inf" if bound == float('inf') else f"{bound:g}"
+                    lines.append(f"{self.name}_bucket{_format_labels(key + (('le', le),))} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {series['sum']:g}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series['count']}")
+        return lines
+
+
+def _format_labels(key: Tuple) -> str:
+    """Render a label tuple in Prometheus text format"""
+    if not key:
+        return ""
+    parts = []
+    for name, value in key:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{name}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+# Metric registry
+SPAN_DURATION = Histogram('instant_ai_span_duration_seconds', 'Duration of instrumented stages')
+HTTP_DURATION = Histogram('instant_ai_http_request_duration_seconds', 'Duration of HTTP requests')
+LLM_TOKENS = Counter('instant_ai_llm_tokens_total', 'Estimated LLM tokens by provider and direction')
+LLM_ERRORS = Counter('instant_ai_llm_errors_total', 'Failed LLM calls by provider')
+SQL_ROWS = Counter('instant_ai_sql_rows_returned_total', 'Rows returned by SQL queries')
+CACHE_LOOKUPS = Counter('instant_ai_cache_lookups_total', 'Cache lookups by cache and result')
+LLM_QUEUE_TIME = Histogram('instant_ai_llm_queue_seconds', 'Time LLM calls waited for a scheduler slot')
+LLM_SHED = Counter('instant_ai_llm_shed_total', 'LLM calls rejected by admission control')
+
+METRICS = [SPAN_DURATION, HTTP_DURATION, LLM_TOKENS, LLM_ERRORS, SQL_ROWS, CACHE_LOOKUPS,
+           LLM_QUEUE_TIME, LLM_SHED]
+
+
+def render_prometheus() -> str:
+    """Render all metrics in Prometheus text exposition format"""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class Trace:
+    """Spans recorded while handling one request"""
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.spans: List[Dict[str, Any]] = []
+        self.lock = threading.Lock()
+
+    def add(self, name: str, start: float, duration: float, attrs: Dict[str, Any]) -> None:
+        with self.lock:
+            self.spans.append({
+                "name": name,
+                "start_ms": round((start - self.start) * 1000, 3),
+                "duration_ms": round(duration * 1000, 3),
+                **attrs
+            })
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "total_ms": round((time.monotonic() - self.start) * 1000, 3),
+            "spans": sorted(self.spans, key=lambda s: s["start_ms"])
+        }
+
+
+class Span:
+    """A timed stage; use as a context manager and attach attributes with set()"""
+
+    __slots__ = ('name', 'attrs', 'trace', 'start')
+
+    recording = True
+
+    def __init__(self, name: str, trace: Optional[Trace], attrs: Dict[str, Any]):
+        self.name = name
+        self.attrs = attrs
+        self.trace = trace
+        self.start = 0.0
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.monotonic() - self.start
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        _finish_span(self.name, self.start, duration, self.attrs, self.trace)
+        return False
+
+
+class _NoopSpan:
+    """Shared span used when tracing is off"""
+
+    __slots__ = ()
+
+    recording = False
+
+    def set(self, **attrs) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name: str, **attrs):
+    """Start a span; returns a no-op object when nothing is being recorded"""
+    trace = _current_trace.get()
+    if trace is None and not _enabled:
+        return _NOOP_SPAN
+    return Span(name, trace, attrs)
+
+
+def record_span(name: str, duration: float, **attrs) -> None:
+    """Record an already finished stage (e.g. reported by a callback)"""
+    trace = _current_trace.get()
+    if trace is None and not _enabled:
+        return
+    _finish_span(name, time.monotonic() - duration, duration, attrs, trace)
+
+
+def _finish_span(name: str, start: float, duration: float, attrs: Dict[str, Any],
+                 trace: Optional[Trace]) -> None:
+    if trace is not None:
+        trace.add(name, start, duration, attrs)
+    if _enabled:
+        SPAN_DURATION.observe(duration, span=name)
+        if "rows_returned" in attrs:
+            SQL_ROWS.inc(attrs["rows_returned"], span=name)
+        if "cache_hit" in attrs:
+            CACHE_LOOKUPS.inc(cache=name, result="hit" if attrs["cache_hit"] else "miss")
+
+
+def start_trace() -> contextvars.Token:
+    """Start collecting spans for the current request"""
+    return _current_trace.set(Trace())
+
+
+def end_trace(token: contextvars.Token) -> Optional[Dict[str, Any]]:
+    """Stop collecting spans and return the recorded timings"""
+    trace = _current_trace.get()
+    _current_trace.reset(token)
+    return trace.to_dict() if trace is not None else None
+
+
+def current_trace() -> Optional[Trace]:
+    """The trace of the current request, if one is active"""
+    return _current_trace.get()
+
+
+def observe_llm_call(provider: str, prompt: str, response: Optional[str],
+                     elapsed: float, error: Optional[Exception]) -> None:
+    """LLMSelector observer recording an llm.query span and token counters"""
+    if _current_trace.get() is None and not _enabled:
+        return
+
+    prompt_tokens = estimate_tokens(prompt)
+    response_tokens = estimate_tokens(response or "")
+    attrs = {"provider": provider, "prompt_tokens": prompt_tokens, "response_tokens": response_tokens}
+    if error is not None:
+        attrs["error"] = type(error).__name__
+    record_span("llm.query", elapsed, **attrs)
+
+    if _enabled:
+        LLM_TOKENS.inc(prompt_tokens, provider=provider, direction="prompt")
+        LLM_TOKENS.inc(response_tokens, provider=provider, direction="response")
+        if error is not None:
+            LLM_ERRORS.inc(provider=provider)
+
+
+def observe_llm_queue(priority: str, provider: str, queue_time: float, shed: bool) -> None:
+    """LLMScheduler observer recording queue time and rejected calls"""
+    if _current_trace.get() is None and not _enabled:
+        return
+
+    if queue_time > 0 or shed:
+        record_span("llm.queue", queue_time, provider=provider, priority=priority, shed=shed)
+
+    if _enabled:
+        if shed:
+            LLM_SHED.inc(provider=provider, priority=priority)
+        else:
+            LLM_QUEUE_TIME.observe(queue_time, provider=provider, priority=priority)
@@ -0,0 +1,182 @@
+import queue
+import datetime
+import threading
+from typing import Any, Iterator, List, Tuple
+
+# Rows handed to the consumer at a time
+CHUNK_SIZE = 1000
+
+_DONE = object()
+
+
+def resolve_header(cells: Tuple[Any, ...], width: int = 0) -> List[str]:
+    """
+    Column names from a header row
+    Read-only mode does not expose merged ranges: a merged header keeps its value in
+    the first cell only, so empty cells take the name to their left. Trailing empty
+    cells are kept only up to `width` (the widest data row), and duplicate names get
+    a .1, .2, ... suffix like pandas.
+    """
+    cells = list(cells)
+    while cells and _is_empty(cells[-1]):
+        cells.pop()
+    cells.extend([None] * (width - len(cells)))
+
+    header = []
+    seen = {}
+    base = None
+    for i, cell in enumerate(cells):
+        if not _is_empty(cell):
+            base = str(cell).strip()
+        name = base if base is not None else f"Unnamed: {i}"
+
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        header.append(name)
+
+    return header
+
+
+def stream_workbook(file_path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple[str, List[str], List[tuple]]]:
+    """
+    Stream every sheet of an .xlsx workbook from a single read-only parse
+    Yields (sheet_name, header, rows) with up to chunk_size rows per item; a sheet's
+    first item may have no rows. Parsing runs on a background thread, so the next
+    chunk is parsed while the caller stores the current one.
+    """
+    chunks: queue.Queue = queue.Queue(maxsize=4)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            from openpyxl import load_workbook
+
+            workbook = load_workbook(file_path, read_only=True, data_only=True)
+            try:
+                for worksheet in workbook.worksheets:
+                    if stop.is_set():
+                        return
+                    _stream_sheet(worksheet, chunk_size, chunks, stop)
+            finally:
+                workbook.close()
+        except Exception as e:
+            chunks.put(e)
+        finally:
+            chunks.put(_DONE)
+
+    producer = threading.Thread(target=produce, name='workbook-reader', daemon=True)
+    producer.start()
+
+    try:
+        while True:
+            item = chunks.get()
+            if item is _DONE:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # Consumer stopped early (error or break): let the producer finish
+        stop.set()
+        while producer.is_alive():
+            try:
+                chunks.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+def _stream_sheet(worksheet, chunk_size: int, chunks: queue.Queue, stop: threading.Event) -> None:
+    rows = worksheet.iter_rows(values_only=True)
+
+    # The first non-empty row is the header; sheets without one are skipped
+    header_cells = None
+    for cells in rows:
+        if any(not _is_empty(cell) for cell in cells):
+            header_cells = cells
+            break
+    if header_cells is None:
+        return
+
+    # Data in the first chunk decides how far a merged header at the end extends
+    chunk = []
+    for cells in rows:
+        if any(not _is_empty(cell) for cell in cells):
+            chunk.append(cells)
+            if len(chunk) >= chunk_size:
+                break
+    data_width = max((_last_filled(cells) for cells in chunk), default=0)
+    header = resolve_header(header_cells, data_width)
+    width = len(header)
+
+    def normalize(cells):
+        row = tuple(_to_python(cell) for cell in cells[:width])
+        return row + (None,) * (width - len(row))
+
+    chunk = [normalize(cells) for cells in chunk]
+    emitted = False
+    if len(chunk) >= chunk_size:
+        chunks.put((worksheet.title, header, chunk))
+        emitted = True
+        chunk = []
+
+    for cells in rows:
+        if all(_is_empty(cell) for cell in cells):
+            continue
+        chunk.append(normalize(cells))
+        if len(chunk) >= chunk_size:
+            if stop.is_set():
+                return
+            chunks.put((worksheet.title, header, chunk))
+            emitted = True
+            chunk = []
+
+    if chunk or not emitted:
+        chunks.put((worksheet.title, header, chunk))
+
+
+def column_type(values: List[Any]) -> str:
+    """SQLite column type for sample values, matching what pandas.to_sql would declare"""
+    values = [value for value in values if value is not None]
+    if not values:
+        return "TEXT"
+    if all(isinstance(value, (bool, int)) for value in values):
+        return "INTEGER"
+    if all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values):
+        return "REAL"
+    if all(isinstance(value, str) and len(value) >= 10 and value[4] == '-' and value[7] == '-'
+           for value in values):
+        return "TIMESTAMP"
+    return "TEXT"
+
+
+def format_rows(rows: List[tuple]) -> str:
+    """Plain-text rendering of sheet rows (or a header) for the document text"""
+    return "\n".join(" | ".join("" if value is None else str(value) for value in row) for row in rows)
+
+
+def _last_filled(cells: Tuple[Any, ...]) -> int:
+    """Position after the last non-empty cell"""
+    for i in range(len(cells) - 1, -1, -1):
+        if not _is_empty(cells[i]):
+            return i + 1
+    return 0
+
+
+def _is_empty(cell: Any) -> bool:
+    return cell is None or (isinstance(cell, str) and not cell.strip())
+
+
+def _to_python(cell: Any) -> Any:
+    """Convert cell values to types SQLite can store"""
+    if isinstance(cell, bool):
+        return int(cell)
+    if isinstance(cell, datetime.datetime):
+        return cell.isoformat(sep=' ')
+    if isinstance(cell, (datetime.date, datetime.time, datetime.timedelta)):
+        return str(cell)
+    if isinstance(cell, str) and not cell.strip():
+        return None
+    return cell
@@ -0,0 +1,21 @@
+import re
+from typing import List
+
+# 型号/编码类实体，例如 YFR-150EX、SF-10L
+# CSV 查询和后端的实体索引共用同一套规则
+CODE_PATTERN = r"[A-Z][A-Z0-9]*(?:[-_/.][A-Z0-9]+)*\d[A-Z0-9]*(?:[-_/.][A-Z0-9]+)*"
+CODE_REGEX = re.compile(CODE_PATTERN)
+
+
+def normalize_code(value: str) -> str:
+    """统一实体编码的大小写和各种连字符"""
+    return str(value).strip().upper().replace("﹣", "-").replace("－", "-").replace("—", "-")
+
+
+def extract_codes(text: str) -> List[str]:
+    """从问题中提取型号/编码类实体"""
+    codes = []
+    for code in CODE_REGEX.findall(normalize_code(text)):
+        if code not in codes:
+            codes.append(code)
+    return codes
@@ -1,48 +1,213 @@
 import os
+import re
+import hashlib
+import threading
 import pandas as pd
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 from dotenv import load_dotenv
 from llm_interface.llm_selector import llm
+from csv_query_app.entities import CODE_PATTERN, normalize_code, extract_codes
+
+# 只在模块加载时读取一次环境变量
+load_dotenv()
+
+# 默认数据目录，可通过环境变量 CSV_QUERY_BASE_PATH 覆盖
+DEFAULT_BASE_PATH = os.getenv(
+    "CSV_QUERY_BASE_PATH",
+    "/Users/wildmaker/Documents/Projects/Instant-AI/tests/test_data/cleaned_data/远怀产品价格表（内贸）"
+)
+
+# 默认加载的CSV文件：表名 -> 文件名
+DEFAULT_CSV_FILES = {
+    "结晶釜价格表": "YFR玻璃结晶釜整机-表格 1.csv"
+}
+
+
+def normalize_series(series: pd.Series) -> pd.Series:
+    """normalize_code 的向量化版本"""
+    values = series.astype(str).str.strip().str.upper()
+    return values.str.replace(r"[﹣－—]", "-", regex=True)
+
+
+def build_value_index(df: pd.DataFrame) -> Dict[str, List[int]]:
+    """为编码类单元格建立 值 -> 行号 的索引"""
+    index: Dict[str, List[int]] = {}
+    for column in df.columns:
+        if df[column].dtype != object and not pd.api.types.is_string_dtype(df[column]):
+            continue
+
+        values = normalize_series(df[column].dropna())
+        values = values[values.str.fullmatch(CODE_PATTERN)]
+        positions = pd.Series(range(len(df)), index=df.index)[values.index]
+        for value, rows in positions.groupby(values.values):
+            index.setdefault(value, []).extend(int(row) for row in rows)
+    return index
+
+
+class CSVTable:
+    """缓存的CSV表：DataFrame、渲染后的预览文本以及文件指纹"""
+
+    def __init__(self, name: str, file_path: str):
+        self.name = name
+        self.file_path = file_path
+        self.df: Optional[pd.DataFrame] = None
+        self.preview = ""
+        self.stat_key: Optional[Tuple[int, int]] = None
+        self.content_hash = ""
+        self.value_index: Dict[str, List[int]] = {}
+        self.lock = threading.Lock()
+
+    def refresh(self) -> bool:
+        """文件的 mtime/大小 变化且内容哈希不同时重新加载，返回是否发生了重新加载"""
+        stat = os.stat(self.file_path)
+        stat_key = (stat.st_mtime_ns, stat.st_size)
+        if stat_key == self.stat_key:
+            return False
+
+        with self.lock:
+            if stat_key == self.stat_key:
+                return False
+
+            with open(self.file_path, "rb") as f:
+                content_hash = hashlib.md5(f.read()).hexdigest()
+
+            # 文件被 touch 但内容未变，只更新指纹
+            if content_hash == self.content_hash:
+                self.stat_key = stat_key
+                return False
+
+            df = pd.read_csv(self.file_path, encoding="utf-8")
+            with pd.option_context("display.max_columns", None):
+                preview = df.to_string()
+
+            self.df = df
+            self.preview = preview
+            self.value_index = build_value_index(df)
+            self.content_hash = content_hash
+            self.stat_key = stat_key
+            return True
+
 
 class CSVQueryEngine:
-    def __init__(self):
-        load_dotenv()
-        self.base_path = "/Users/wildmaker/Documents/Projects/Instant-AI/tests/test_data/cleaned_data/远怀产品价格表（内贸）"
-        self.csv_data = self._load_csv_files()
-
-    def _load_csv_files(self) -> Dict[str, pd.DataFrame]:
-        """加载CSV文件"""
-        csv_files = {
-            "结晶釜价格表": "YFR玻璃结晶釜整机-表格 1.csv"
+    def __init__(self, base_path: Optional[str] = None, csv_files: Optional[Dict[str, str]] = None):
+        self.base_path = base_path or DEFAULT_BASE_PATH
+        self.csv_files = dict(csv_files or DEFAULT_CSV_FILES)
+        self.tables = {
+            name: CSVTable(name, os.path.join(self.base_path, filename))
+            for name, filename in self.csv_files.items()
         }
-        
-        dataframes = {}
-        for name, filename in csv_files.items():
-            file_path = os.path.join(self.base_path, filename)
-            dataframes[name] = pd.read_csv(file_path, encoding='utf-8')
-        return dataframes
+
+    @property
+    def csv_data(self) -> Dict[str, pd.DataFrame]:
+        """所有表的 DataFrame（按需重新加载）"""
+        return {name: self.get_table(name).df for name in self.tables}
+
+    def get_table(self, name: str) -> CSVTable:
+        """获取缓存的表，文件变化时自动重新加载"""
+        if name not in self.tables:
+            raise ValueError(f"未配置的CSV表: {name}")
+
+        table = self.tables[name]
+        table.refresh()
+        return table
+
+    def select_relevant(self, name: str, query: str) -> str:
+        """
+        根据问题筛选相关的行和列，返回渲染后的表格文本
+        无法定位时返回整表预览
+        """
+        table = self.get_table(name)
+        df = table.df
+
+        rows = self._match_rows(table, extract_codes(query))
+        columns = self._match_columns(df, query)
+
+        if rows is None and not columns:
+            return table.preview
+
+        selected = df if rows is None else df.iloc[rows]
+        if columns:
+            # 保留标识列（第一列）以便模型知道每行对应的实体
+            keep = [df.columns[0]] + [col for col in columns if col != df.columns[0]]
+            selected = selected[keep]
+
+        with pd.option_context("display.max_columns", None):
+            return selected.to_string()
+
+    def _match_rows(self, table: CSVTable, codes: List[str]) -> Optional[List[int]]:
+        """按实体编码定位行：先查精确值索引，再做向量化的包含匹配"""
+        if not codes:
+            return None
+
+        rows = set()
+        for code in codes:
+            rows.update(table.value_index.get(code, []))
+
+        if not rows:
+            df = table.df
+            mask = pd.Series(False, index=df.index)
+            for column in df.columns:
+                values = normalize_series(df[column])
+                for code in codes:
+                    mask |= values.str.contains(code, regex=False).to_numpy()
+            rows.update(int(row) for row in mask.to_numpy().nonzero()[0])
+
+        return sorted(rows) if rows else None
+
+    def _match_columns(self, df: pd.DataFrame, query: str) -> List[str]:
+        """按列名关键词匹配问题中提到的列，忽略列名中括号内的单位"""
+        columns = []
+        for column in df.columns:
+            name = str(column).strip()
+            keyword = re.sub(r"[（(].*?[）)]", "", name).strip()
+            if (name and name in query) or (len(keyword) >= 2 and keyword in query):
+                columns.append(column)
+        return columns
 
     def _construct_prompt(self, query: str) -> str:
-        """构造完整的Prompt"""
-        system_prompt = """你是一个智能查询助手，能够根据用户提供的自然语言查询，从表中提取准确信息。
+        """构造完整的Prompt：每个配置的表一节，只包含与问题相关的行和列"""
+        sections = "\n\n".join(f"表 {name}:\n{self.select_relevant(name, query)}" for name in self.tables)
+
+        system_prompt = f"""你是一个智能查询助手，能够根据用户提供的自然语言查询，从表中提取准确信息。
 以下是 CSV 数据：
 
-{结晶釜价格表}
+{sections}
 
 请根据以上数据回答用户的问题。回答要简洁准确，只回答最终的数值或者值。"""
 
-        # 生成数据预览
-        df = self.csv_data["结晶釜价格表"]
-        # 确保显示所有列
-        pd.set_option('display.max_columns', None)
-        preview = df.to_string()
-        
-        # 填充系统Prompt并添加用户问题标记
-        formatted_system_prompt = system_prompt.format(结晶釜价格表=preview)
-        return formatted_system_prompt + "\n这是用户的问题：\n" + query
-
-def query_csv(query_text: str, provider: str = "gt4") -> str:
+        return system_prompt + "\n这是用户的问题：\n" + query
+
+
+# 进程级引擎注册表：相同配置共用一个引擎
+_engines: Dict[Tuple, CSVQueryEngine] = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(base_path: Optional[str] = None, csv_files: Optional[Dict[str, str]] = None) -> CSVQueryEngine:
+    """获取（或创建）指定配置的查询引擎"""
+    base_path = base_path or DEFAULT_BASE_PATH
+    csv_files = csv_files or DEFAULT_CSV_FILES
+    key = (base_path, tuple(sorted(csv_files.items())))
+
+    engine = _engines.get(key)
+    if engine is None:
+        with _engines_lock:
+            engine = _engines.get(key)
+            if engine is None:
+                engine = CSVQueryEngine(base_path, csv_files)
+                _engines[key] = engine
+    return engine
+
+
+def clear_engines() -> None:
+    """清空引擎注册表"""
+    with _engines_lock:
+        _engines.clear()
+
+
+def query_csv(query_text: str, provider: str = "gt4", base_path: Optional[str] = None,
+              csv_files: Optional[Dict[str, str]] = None) -> str:
     """对CSV数据进行自然语言查询"""
-    engine = CSVQueryEngine()
+    engine = get_engine(base_path, csv_files)
     prompt = engine._construct_prompt(query_text)
-    return llm.query(prompt, provider=provider)
\ No newline at end of file
+    return llm.query(prompt, provider=provider)
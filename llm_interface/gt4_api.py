@@ -1,14 +1,22 @@
 import os
 import json
-import requests
 from dotenv import load_dotenv
 
+DEFAULT_API_URL = "https://api.gt4.pro/v1/chat/completions"
+
+def warm_up() -> None:
+    """预先导入 requests"""
+    import requests  # noqa: F401
+
 def query_gt4(prompt: str) -> str:
+    # requests 在首次调用时导入，避免拖慢启动
+    import requests
+    
     # 加载环境变量
     load_dotenv()
     
-    # API配置
-    url = "https://api.gt4.pro/v1/chat/completions"
+    # API配置；GT4_API_URL 可指向兼容接口（如压测用的本地桩服务）
+    url = os.getenv("GT4_API_URL", DEFAULT_API_URL)
     headers = {
         'Authorization': f'Bearer {os.getenv("GT4_API_KEY")}',
         'Content-Type': 'application/json'
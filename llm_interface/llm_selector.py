@@ -1,6 +1,14 @@
-from typing import Dict, Optional
+import os
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, List, Optional
+from . import openai_api, gt4_api, replay_api
 from .openai_api import query_openai
 from .gt4_api import query_gt4
+from .replay_api import query_replay, get_record_store
+from .routing import ProviderRouter
+from .scheduler import LLMScheduler, SchedulerOverloaded
 
 class LLMSelector:
     """LLM接口选择器"""
@@ -8,9 +16,70 @@ class LLMSelector:
     def __init__(self):
         self.providers = {
             "openai": query_openai,
-            "gt4": query_gt4
+            "gt4": query_gt4,
+            "replay": query_replay
         }
-        self.default_provider = "gt4"
+        # 提供商的SDK和客户端在首次调用时才加载；预加载的进程可调用 warm_up 提前完成
+        self.warm_ups: Dict[str, Callable] = {
+            "openai": openai_api.warm_up,
+            "gt4": gt4_api.warm_up,
+            "replay": replay_api.warm_up
+        }
+        # 可通过 LLM_DEFAULT_PROVIDER=replay 让所有调用走离线回放
+        self.default_provider = os.getenv("LLM_DEFAULT_PROVIDER", "gt4")
+        # 调用观察者：observer(provider, prompt, response, elapsed, error)
+        self.observers: List[Callable] = []
+        
+        # 按健康度路由：LLM_ROUTING_PROVIDERS=gt4,openai 开启，未指定提供商的调用会
+        # 发往最健康的提供商，超过 p95 未返回时向第二个提供商发出对冲请求
+        self.router: Optional[ProviderRouter] = None
+        self._hedge_executor: Optional[ThreadPoolExecutor] = None
+        routing_providers = os.getenv("LLM_ROUTING_PROVIDERS")
+        if routing_providers:
+            self.configure_routing([name.strip() for name in routing_providers.split(",") if name.strip()])
+        
+        # 准入控制：并发上限、优先级排队和过载时快速拒绝（SchedulerOverloaded）
+        self.scheduler = LLMScheduler.from_env()
+    
+    def configure_routing(self, providers: List[str], **router_kwargs) -> None:
+        """开启按健康度路由；providers 为空时关闭"""
+        if not providers:
+            self.router = None
+            return
+        
+        for name in providers:
+            if name not in self.providers:
+                raise ValueError(f"不支持的LLM提供商: {name}")
+        
+        self.router = ProviderRouter(providers, **router_kwargs)
+        if self._hedge_executor is None:
+            self._hedge_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-hedge")
+    
+    def warm_up(self, providers: Optional[List[str]] = None) -> None:
+        """预先加载提供商的SDK和客户端，默认为默认提供商和参与路由的提供商"""
+        if providers is None:
+            providers = [self.default_provider] + (self.router.providers if self.router else [])
+        
+        for name in dict.fromkeys(providers):
+            warm_up = self.warm_ups.get(name)
+            if warm_up is None:
+                continue
+            try:
+                warm_up()
+            except Exception as e:
+                print(f"Warning: 预加载LLM提供商 {name} 失败: {e}")
+    
+    def get_routing_state(self) -> Dict:
+        """当前路由状态：各提供商的延迟、错误率和熔断状态"""
+        if self.router is None:
+            return {"enabled": False, "default_provider": self.default_provider,
+                    "scheduler": self.scheduler.stats()}
+        return {"enabled": True, **self.router.state(), "scheduler": self.scheduler.stats()}
+    
+    def add_observer(self, observer: Callable) -> None:
+        """注册调用观察者，每次调用结束（成功或失败）后通知，用于埋点统计"""
+        if observer not in self.observers:
+            self.observers.append(observer)
 
     def query(self, prompt: str, provider: Optional[str] = None, **kwargs) -> str:
         """
@@ -18,23 +87,110 @@ class LLMSelector:
         
         Args:
             prompt: 查询文本
-            provider: LLM提供商，可选值：openai, gt4
+            provider: LLM提供商，可选值：openai, gt4, replay
             **kwargs: 其他参数
         
         Returns:
             str: LLM的响应文本
         """
+        # 未指定提供商且开启了路由时，按健康度选择
+        if provider is None and self.router is not None:
+            return self._routed_query(prompt, **kwargs)
+        
         # 使用指定的提供商，如果未指定则使用默认值
         provider = provider or self.default_provider
         
         if provider not in self.providers:
             raise ValueError(f"不支持的LLM提供商: {provider}")
+        
+        return self._query_provider(provider, prompt, **kwargs)
+    
+    def _routed_query(self, prompt: str, **kwargs) -> str:
+        """发往最健康的提供商；超过其 p95 仍未返回时对冲到下一个，失败时依次故障转移"""
+        candidates = self.router.candidates()
+        pending = {}
+        errors = []
+        overloaded = None
+        
+        while candidates or pending:
+            # 需要时再发出一个请求（首个请求、对冲请求或故障转移）
+            if candidates and len(pending) < 2:
+                provider = candidates.pop(0)
+                if not self.router.health[provider].allow_request():
+                    continue
+                context = contextvars.copy_context()
+                future = self._hedge_executor.submit(context.run, self._query_provider, provider, prompt, **kwargs)
+                pending[future] = provider
+            
+            # 只有一个请求在途且还有备选时，等待到 p95 后发出对冲请求
+            if len(pending) == 1 and candidates:
+                timeout = self.router.hedge_delay(next(iter(pending.values())))
+            else:
+                timeout = None
             
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                provider = pending.pop(future)
+                try:
+                    return future.result()
+                except SchedulerOverloaded as e:
+                    overloaded = e
+                except Exception as e:
+                    errors.append(str(e))
+        
+        if overloaded is not None and not errors:
+            raise overloaded
+        if not errors:
+            raise Exception("LLM查询失败: 所有提供商均处于熔断状态")
+        raise Exception(f"LLM查询失败: {'; '.join(errors)}")
+    
+    def _query_provider(self, provider: str, prompt: str, **kwargs) -> str:
+        """调用指定提供商，并记录健康度、通知观察者"""
+        query_func = self.providers[provider]
+        health = self.router.health.get(provider) if self.router else None
+        
+        # 排队被拒绝时直接抛出 SchedulerOverloaded，不计入提供商的健康度
         try:
-            query_func = self.providers[provider]
-            return query_func(prompt, **kwargs)
-        except Exception as e:
-            raise Exception(f"LLM查询失败 ({provider}): {str(e)}")
+            with self.scheduler.slot(provider):
+                start_time = time.monotonic()
+                try:
+                    response = query_func(prompt, **kwargs)
+                except Exception as e:
+                    elapsed = time.monotonic() - start_time
+                    if health:
+                        health.record_failure(elapsed)
+                    self._notify(provider, prompt, None, elapsed, e)
+                    raise Exception(f"LLM查询失败 ({provider}): {str(e)}")
+                elapsed = time.monotonic() - start_time
+        except SchedulerOverloaded:
+            # 请求没有发出：归还半开状态的试探名额，否则该提供商再也不会被选中
+            if health:
+                health.release_trial()
+            raise
+        
+        if health:
+            health.record_success(elapsed)
+        self._notify(provider, prompt, response, elapsed, None)
+        
+        # 开启录制时保存真实调用，供 replay 提供商离线回放
+        record_store = get_record_store()
+        if record_store and provider != "replay":
+            record_store.record(prompt, response, elapsed, provider)
+        
+        return response
+    
+    def _notify(self, provider: str, prompt: str, response: Optional[str],
+                elapsed: float, error: Optional[Exception]) -> None:
+        """通知观察者，观察者自身的异常不影响查询"""
+        for observer in self.observers:
+            try:
+                observer(provider, prompt, response, elapsed, error)
+            except Exception:
+                pass
+    
+    def generate_completion(self, prompt: str, **kwargs) -> str:
+        """使用默认提供商生成回复"""
+        return self.query(prompt, **kwargs)
 
 # 创建全局LLM选择器实例
 llm = LLMSelector()
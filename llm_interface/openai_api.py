@@ -1,26 +1,42 @@
 import os
-import httpx
-from openai import OpenAI
+import threading
 from dotenv import load_dotenv
 
 # 加载环境变量
 load_dotenv()
 
-# 设置代理
-proxy = "http://127.0.0.1:7897"
+# 代理地址，可通过 OPENAI_PROXY 覆盖，设为空字符串则直连
+DEFAULT_PROXY = "http://127.0.0.1:7897"
 
-# 初始化客户端
-client = OpenAI(
-    api_key=os.getenv('OPENAI_API_KEY'),
-    http_client=httpx.Client(
-        proxy=proxy
-    )
-)
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """首次使用时再导入 OpenAI SDK 并创建客户端，避免拖慢启动"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import httpx
+                from openai import OpenAI
+                
+                proxy = os.getenv('OPENAI_PROXY', DEFAULT_PROXY) or None
+                _client = OpenAI(
+                    api_key=os.getenv('OPENAI_API_KEY'),
+                    http_client=httpx.Client(
+                        proxy=proxy
+                    )
+                )
+    return _client
+
+def warm_up() -> None:
+    """预先导入 SDK 并创建客户端"""
+    get_client()
 
 def query_openai(prompt: str) -> str:
     try:
         # 创建聊天完成
-        response = client.chat.completions.create(
+        response = get_client().chat.completions.create(
             model="gpt-3.5-turbo",
             messages=[
                 {"role": "user", "content": prompt}
@@ -31,4 +47,4 @@ def query_openai(prompt: str) -> str:
         return response.choices[0].message.content
 
     except Exception as e:
-        raise Exception(f"OpenAI API调用失败: {e}")
\ No newline at end of file
+        raise Exception(f"OpenAI API调用失败: {e}")
@@ -0,0 +1,137 @@
+import os
+import json
+import time
+import random
+import hashlib
+import threading
+from typing import Dict, Optional
+
+# 录制文件路径：设置 LLM_RECORD_FILE 后，真实调用的 Prompt/响应会被追加到该文件
+RECORD_FILE_ENV = "LLM_RECORD_FILE"
+# 回放文件路径
+REPLAY_FILE_ENV = "LLM_REPLAY_FILE"
+# 模拟延迟：none | recorded | fixed:<秒> | normal:<均值>,<标准差>
+REPLAY_LATENCY_ENV = "LLM_REPLAY_LATENCY"
+# 找不到录制记录时返回的默认响应（不设置则抛出异常）
+REPLAY_DEFAULT_ENV = "LLM_REPLAY_DEFAULT"
+
+DEFAULT_REPLAY_FILE = "data/llm_recordings.jsonl"
+
+
+def prompt_key(prompt: str) -> str:
+    """Prompt 的录制键"""
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+class ReplayStore:
+    """Prompt -> 响应 的录制文件（JSONL），文件变化时自动重新加载"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._records: Dict[str, Dict] = {}
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def record(self, prompt: str, response: str, latency: float, provider: str) -> None:
+        """追加一条录制记录"""
+        record = {
+            "key": prompt_key(prompt),
+            "provider": provider,
+            "prompt": prompt,
+            "response": response,
+            "latency": round(latency, 4)
+        }
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._records[record["key"]] = record
+
+    def lookup(self, prompt: str) -> Optional[Dict]:
+        """按 Prompt 查找录制记录，同一 Prompt 多次录制时取最后一次"""
+        self.load()
+        return self._records.get(prompt_key(prompt))
+
+    def load(self) -> None:
+        """读取录制文件；文件未修改时不重复解析"""
+        if not os.path.exists(self.path):
+            return
+
+        mtime = os.path.getmtime(self.path)
+        if mtime == self._mtime:
+            return
+
+        with self._lock:
+            records = {}
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    records[record["key"]] = record
+            self._records = records
+            self._mtime = mtime
+
+
+_stores: Dict[str, ReplayStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(path: str) -> ReplayStore:
+    """获取指定路径的录制存储（进程内共享）"""
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = ReplayStore(path)
+        return _stores[path]
+
+
+def get_record_store() -> Optional[ReplayStore]:
+    """录制已开启时返回录制存储"""
+    path = os.getenv(RECORD_FILE_ENV)
+    return get_store(path) if path else None
+
+
+def simulate_latency(recorded_latency: float) -> None:
+    """按 LLM_REPLAY_LATENCY 配置模拟调用延迟"""
+    mode = os.getenv(REPLAY_LATENCY_ENV, "none").strip().lower()
+
+    if mode == "recorded":
+        delay = recorded_latency
+    elif mode.startswith("fixed:"):
+        delay = float(mode.split(":", 1)[1])
+    elif mode.startswith("normal:"):
+        mean, std = (float(v) for v in mode.split(":", 1)[1].split(","))
+        delay = random.gauss(mean, std)
+    else:
+        delay = 0.0
+
+    if delay > 0:
+        time.sleep(delay)
+
+
+def warm_up() -> None:
+    """预先加载回放文件"""
+    get_store(os.getenv(REPLAY_FILE_ENV, DEFAULT_REPLAY_FILE)).load()
+
+
+def query_replay(prompt: str) -> str:
+    """回放录制的响应，不访问网络"""
+    store = get_store(os.getenv(REPLAY_FILE_ENV, DEFAULT_REPLAY_FILE))
+    record = store.lookup(prompt)
+
+    if record is None:
+        default = os.getenv(REPLAY_DEFAULT_ENV)
+        if default is None:
+            raise Exception(f"回放记录中没有匹配的Prompt: {prompt[:50]}")
+        simulate_latency(0.0)
+        return default
+
+    simulate_latency(record.get("latency", 0.0))
+    return record["response"]
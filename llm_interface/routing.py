@@ -0,0 +1,151 @@
+import time
+import math
+import threading
+from collections import deque
+from typing import Dict, List, Optional
+
+# 熔断器状态
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+
+class ProviderHealth:
+    """单个提供商的滚动延迟、错误率统计和熔断状态"""
+
+    def __init__(self, name: str, window: int = 100, failure_threshold: int = 5, cooldown: float = 30.0):
+        """
+        Args:
+            name: 提供商名称
+            window: 滚动窗口内保留的调用数
+            failure_threshold: 连续失败多少次后熔断
+            cooldown: 熔断后多少秒进入半开状态放行一次试探请求
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.samples = deque(maxlen=window)  # (latency, ok)
+        self.state = STATE_CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        """熔断器是否放行请求；半开状态只放行一个试探请求"""
+        with self.lock:
+            if self.state == STATE_CLOSED:
+                return True
+
+            if self.state == STATE_OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = STATE_HALF_OPEN
+
+            if self.state == STATE_HALF_OPEN and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+
+            return False
+
+    def is_available(self) -> bool:
+        """不占用试探名额地判断熔断器当前是否可能放行"""
+        with self.lock:
+            if self.state == STATE_CLOSED:
+                return True
+            if self.state == STATE_OPEN:
+                return time.monotonic() - self.opened_at >= self.cooldown
+            return not self.trial_in_flight
+
+    def record_success(self, latency: float) -> None:
+        with self.lock:
+            self.samples.append((latency, True))
+            self.consecutive_failures = 0
+            self.state = STATE_CLOSED
+            self.trial_in_flight = False
+
+    def record_failure(self, latency: float) -> None:
+        with self.lock:
+            self.samples.append((latency, False))
+            self.consecutive_failures += 1
+            self.trial_in_flight = False
+            if self.state == STATE_HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                self.state = STATE_OPEN
+                self.opened_at = time.monotonic()
+
+    def release_trial(self) -> None:
+        """试探请求未真正发出（例如被调度器拒绝）时归还试探名额，不计入成败"""
+        with self.lock:
+            self.trial_in_flight = False
+
+    def latency_percentile(self, pct: float) -> Optional[float]:
+        """成功调用的延迟百分位数，没有样本时返回 None"""
+        with self.lock:
+            latencies = sorted(latency for latency, ok in self.samples if ok)
+        if not latencies:
+            return None
+        rank = max(1, math.ceil(pct / 100 * len(latencies)))
+        return latencies[rank - 1]
+
+    def error_rate(self) -> float:
+        with self.lock:
+            if not self.samples:
+                return 0.0
+            return sum(1 for _, ok in self.samples if not ok) / len(self.samples)
+
+    def snapshot(self) -> Dict:
+        """当前状态，用于对外展示"""
+        p50 = self.latency_percentile(50)
+        p95 = self.latency_percentile(95)
+        return {
+            "state": self.state,
+            "samples": len(self.samples),
+            "error_rate": round(self.error_rate(), 4),
+            "latency_p50": round(p50, 4) if p50 is not None else None,
+            "latency_p95": round(p95, 4) if p95 is not None else None,
+            "consecutive_failures": self.consecutive_failures
+        }
+
+
+class ProviderRouter:
+    """按健康度选择提供商，并计算对冲请求的触发延迟"""
+
+    def __init__(self, providers: List[str], hedge_default_delay: float = 10.0,
+                 hedge_min_delay: float = 0.5, **health_kwargs):
+        """
+        Args:
+            providers: 参与路由的提供商，顺序即无统计数据时的优先级
+            hedge_default_delay: 主提供商还没有延迟统计时，等待多久发出对冲请求
+            hedge_min_delay: 对冲延迟下限，避免在延迟很低时重复请求
+        """
+        self.providers = list(providers)
+        self.hedge_default_delay = hedge_default_delay
+        self.hedge_min_delay = hedge_min_delay
+        self.health = {name: ProviderHealth(name, **health_kwargs) for name in self.providers}
+
+    def score(self, name: str) -> float:
+        """
+        越小越健康：p95 延迟按错误率放大
+        还没有样本的提供商视为 0 以便获得流量，只有失败样本的排在最后
+        """
+        health = self.health[name]
+        p95 = health.latency_percentile(95)
+        if p95 is None:
+            return float('inf') if health.samples else 0.0
+        return p95 * (1 + 4 * health.error_rate())
+
+    def candidates(self) -> List[str]:
+        """熔断器可能放行的提供商，按健康度排序；实际发送前仍需调用 allow_request"""
+        ranked = sorted(self.providers, key=lambda name: (self.score(name), self.providers.index(name)))
+        return [name for name in ranked if self.health[name].is_available()]
+
+    def hedge_delay(self, name: str) -> float:
+        """主请求超过其 p95 延迟后发出对冲请求"""
+        p95 = self.health[name].latency_percentile(95)
+        if p95 is None:
+            return self.hedge_default_delay
+        return max(self.hedge_min_delay, p95)
+
+    def state(self) -> Dict:
+        return {
+            "providers": {name: self.health[name].snapshot() for name in self.providers},
+            "ranking": sorted(self.providers, key=lambda name: (self.score(name), self.providers.index(name)))
+        }
@@ -0,0 +1,240 @@
+import os
+import time
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+# 优先级：数值越小越优先
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BATCH = "batch"
+PRIORITIES = {
+    PRIORITY_INTERACTIVE: 0,
+    PRIORITY_BATCH: 1
+}
+
+# 当前调用的优先级和知识库，由调用方通过 call_context 设置
+_call_context: contextvars.ContextVar = contextvars.ContextVar(
+    "llm_call_context", default=(PRIORITY_INTERACTIVE, None)
+)
+
+
+@contextmanager
+def call_context(priority: str = PRIORITY_INTERACTIVE, kb_id: Optional[str] = None):
+    """在此上下文中发出的LLM调用使用指定的优先级和知识库"""
+    if priority not in PRIORITIES:
+        raise ValueError(f"未知的优先级: {priority}")
+    token = _call_context.set((priority, kb_id))
+    try:
+        yield
+    finally:
+        _call_context.reset(token)
+
+
+def current_call_context() -> tuple:
+    """当前的 (优先级, 知识库ID)"""
+    return _call_context.get()
+
+
+class SchedulerOverloaded(Exception):
+    """排队时间预计超过延迟预算，请求被拒绝"""
+
+    def __init__(self, priority: str, estimated_wait: float, budget: float):
+        self.priority = priority
+        self.estimated_wait = estimated_wait
+        self.budget = budget
+        super().__init__(f"LLM调用排队过长（{priority}）：预计等待 {estimated_wait:.1f} 秒，预算 {budget:.1f} 秒")
+
+
+class _Ticket:
+    __slots__ = ("seq", "provider", "priority", "rank", "kb_id", "enqueued_at", "granted")
+
+    def __init__(self, seq: int, provider: str, priority: str, kb_id: Optional[str]):
+        self.seq = seq
+        self.provider = provider
+        self.priority = priority
+        self.rank = PRIORITIES[priority]
+        self.kb_id = kb_id
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+
+
+def _parse_limits(value: str) -> Dict[str, int]:
+    """解析 "gt4=8,openai=4" 形式的配置"""
+    limits = {}
+    for item in value.split(","):
+        if "=" in item:
+            name, limit = item.split("=", 1)
+            limits[name.strip()] = int(limit)
+    return limits
+
+
+class LLMScheduler:
+    """
+    LLM调用的准入控制和优先级调度
+    - 全局和按提供商的并发上限
+    - 优先级：interactive > batch
+    - 同一优先级内按知识库轮转，避免单个知识库占满并发
+    - 预计排队时间超过预算时立即拒绝（SchedulerOverloaded）
+    """
+
+    def __init__(self, global_limit: int = 16, provider_limits: Optional[Dict[str, int]] = None,
+                 budgets: Optional[Dict[str, Optional[float]]] = None):
+        """
+        Args:
+            global_limit: 全局并发上限
+            provider_limits: 提供商 -> 并发上限，未配置的提供商只受全局上限约束
+            budgets: 优先级 -> 最长排队秒数，None 表示不限
+        """
+        self.global_limit = global_limit
+        self.provider_limits = provider_limits or {}
+        self.budgets = {PRIORITY_INTERACTIVE: 10.0, PRIORITY_BATCH: None}
+        self.budgets.update(budgets or {})
+
+        self._lock = threading.Condition()
+        self._seq = itertools.count()
+        self._waiting: List[_Ticket] = []
+        self._active_total = 0
+        self._active_by_provider: Dict[str, int] = {}
+        self._kb_grants: Dict[tuple, int] = {}
+
+        # 平均占用时长（EWMA），用于估算排队时间
+        self._avg_service_time = 2.0
+
+        self.observers: List[Callable] = []
+
+    @classmethod
+    def from_env(cls) -> "LLMScheduler":
+        """从环境变量创建：LLM_MAX_CONCURRENCY、LLM_PROVIDER_CONCURRENCY、LLM_QUEUE_BUDGET_<优先级>"""
+        budgets = {}
+        for priority in PRIORITIES:
+            value = os.getenv(f"LLM_QUEUE_BUDGET_{priority.upper()}")
+            if value is not None:
+                budgets[priority] = float(value) if value else None
+        return cls(
+            global_limit=int(os.getenv("LLM_MAX_CONCURRENCY", "16")),
+            provider_limits=_parse_limits(os.getenv("LLM_PROVIDER_CONCURRENCY", "")),
+            budgets=budgets
+        )
+
+    def add_observer(self, observer: Callable) -> None:
+        """注册观察者：observer(priority, provider, queue_time, shed)"""
+        if observer not in self.observers:
+            self.observers.append(observer)
+
+    @contextmanager
+    def slot(self, provider: str):
+        """占用一个调用名额，优先级和知识库取自 call_context"""
+        priority, kb_id = current_call_context()
+        ticket = self.acquire(provider, priority, kb_id)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(ticket, time.monotonic() - start)
+
+    def acquire(self, provider: str, priority: str = PRIORITY_INTERACTIVE, kb_id: Optional[str] = None) -> _Ticket:
+        """排队等待名额；预计或实际等待超过预算时抛出 SchedulerOverloaded"""
+        budget = self.budgets.get(priority)
+
+        with self._lock:
+            ticket = _Ticket(next(self._seq), provider, priority, kb_id)
+
+            if not self._waiting and self._has_capacity(provider):
+                self._grant(ticket)
+                self._notify(ticket, 0.0, False)
+                return ticket
+
+            # 快速拒绝：排在前面的请求按平均占用时长估算等待时间
+            estimated_wait = self._estimate_wait(ticket)
+            if budget is not None and estimated_wait > budget:
+                self._notify(ticket, 0.0, True)
+                raise SchedulerOverloaded(priority, estimated_wait, budget)
+
+            fair_key = (priority, kb_id)
+            if fair_key not in self._kb_grants:
+                # 新加入的知识库从当前最小值开始，不会因为历史计数为 0 而独占
+                same_priority = [count for (p, _), count in self._kb_grants.items() if p == priority]
+                self._kb_grants[fair_key] = min(same_priority) if same_priority else 0
+
+            self._waiting.append(ticket)
+            deadline = None if budget is None else ticket.enqueued_at + budget
+
+            while not ticket.granted:
+                self._dispatch()
+                if ticket.granted:
+                    break
+
+                timeout = None if deadline is None else deadline - time.monotonic()
+                if timeout is not None and timeout <= 0:
+                    self._waiting.remove(ticket)
+                    queue_time = time.monotonic() - ticket.enqueued_at
+                    self._notify(ticket, queue_time, True)
+                    self._lock.notify_all()
+                    raise SchedulerOverloaded(priority, queue_time, budget)
+                self._lock.wait(timeout)
+
+        self._notify(ticket, time.monotonic() - ticket.enqueued_at, False)
+        return ticket
+
+    def release(self, ticket: _Ticket, held: float = 0.0) -> None:
+        """释放名额并唤醒排队的请求"""
+        with self._lock:
+            self._active_total -= 1
+            self._active_by_provider[ticket.provider] -= 1
+            if held > 0:
+                self._avg_service_time = 0.8 * self._avg_service_time + 0.2 * held
+            self._dispatch()
+            self._lock.notify_all()
+
+    def stats(self) -> Dict:
+        """当前排队和并发情况"""
+        with self._lock:
+            waiting = {}
+            for ticket in self._waiting:
+                waiting[ticket.priority] = waiting.get(ticket.priority, 0) + 1
+            return {
+                "active": self._active_total,
+                "active_by_provider": dict(self._active_by_provider),
+                "waiting": waiting,
+                "global_limit": self.global_limit,
+                "provider_limits": dict(self.provider_limits),
+                "avg_service_time": round(self._avg_service_time, 4)
+            }
+
+    def _has_capacity(self, provider: str) -> bool:
+        if self._active_total >= self.global_limit:
+            return False
+        limit = self.provider_limits.get(provider)
+        return limit is None or self._active_by_provider.get(provider, 0) < limit
+
+    def _grant(self, ticket: _Ticket) -> None:
+        ticket.granted = True
+        self._active_total += 1
+        self._active_by_provider[ticket.provider] = self._active_by_provider.get(ticket.provider, 0) + 1
+        fair_key = (ticket.priority, ticket.kb_id)
+        self._kb_grants[fair_key] = self._kb_grants.get(fair_key, 0) + 1
+
+    def _dispatch(self) -> None:
+        """按 (优先级, 知识库已获名额数, 到达顺序) 依次放行有名额的请求"""
+        while self._waiting and self._active_total < self.global_limit:
+            eligible = [t for t in self._waiting if self._has_capacity(t.provider)]
+            if not eligible:
+                return
+            best = min(eligible, key=lambda t: (t.rank, self._kb_grants.get((t.priority, t.kb_id), 0), t.seq))
+            self._waiting.remove(best)
+            self._grant(best)
+
+    def _estimate_wait(self, ticket: _Ticket) -> float:
+        """前面排队的同级或更高优先级请求按平均占用时长和并发上限估算等待时间"""
+        ahead = sum(1 for t in self._waiting if t.rank <= ticket.rank) + 1
+        capacity = min(self.global_limit, self.provider_limits.get(ticket.provider, self.global_limit))
+        return ahead * self._avg_service_time / max(1, capacity)
+
+    def _notify(self, ticket: _Ticket, queue_time: float, shed: bool) -> None:
+        for observer in self.observers:
+            try:
+                observer(ticket.priority, ticket.provider, queue_time, shed)
+            except Exception:
+                pass
@@ -0,0 +1,328 @@
+"""
+后端热点路径的微基准测试
+
+所有测试数据在临时目录中生成，LLM 调用由本地桩函数代替，无需网络。
+
+用法:
+    python tests/benchmarks/bench_backend.py                  # 运行并与基线比较
+    python tests/benchmarks/bench_backend.py --quick          # 缩小数据规模
+    python tests/benchmarks/bench_backend.py --update-baseline
+    python tests/benchmarks/bench_backend.py --threshold 0.3 --only sql_
+
+基线保存在 baselines.json（或 --baseline 指定的文件），某项指标比基线慢超过阈值时退出码为 1。
+"""
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import shutil
+import argparse
+import tempfile
+import statistics
+from typing import Callable, Dict, List, Optional
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(ROOT_DIR)
+sys.path.append(os.path.join(ROOT_DIR, "backend"))
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+import pandas as pd
+from knowledge_base import KnowledgeBaseManager
+from sql_query_engine import SQLQueryEngine
+from query_cache import QueryResultCache
+from document_processor import DocumentProcessor
+from chat_engine import ChatEngine
+from llm_interface.llm_selector import llm
+
+DEFAULT_BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+
+# ---------------------------------------------------------------------------
+# 测试数据生成
+# ---------------------------------------------------------------------------
+
+def make_price_frame(rows: int, extra_columns: int = 0) -> pd.DataFrame:
+    """生成类似产品价格表的 DataFrame"""
+    materials = ["玻璃", "不锈钢", "搪瓷", "哈氏合金"]
+    data = {
+        "型号": [f"YFR-{i}EX" for i in range(rows)],
+        "材质": [materials[i % len(materials)] for i in range(rows)],
+        "容积(L)": [(i % 500) + 10 for i in range(rows)],
+        "底阀离地高度": [300 + (i % 300) for i in range(rows)],
+        "价格": [1000.0 + (i * 7) % 90000 for i in range(rows)]
+    }
+    for c in range(extra_columns):
+        data[f"参数{c}"] = [f"值{(i + c) % 97}" for i in range(rows)]
+    return pd.DataFrame(data)
+
+
+def make_pdf(path: str, pages: int, lines_per_page: int = 40) -> None:
+    """生成只包含文本的最小 PDF 文件"""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # Pages，页面对象生成后再填充
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"
+    ]
+    page_ids = []
+    for p in range(pages):
+        lines = [f"BT /F1 10 Tf 40 {800 - i * 18} Td (Page {p} line {i} model YFR-{p * 100 + i}EX height {300 + i} mm) Tj ET"
+                 for i in range(lines_per_page)]
+        stream = "\n".join(lines).encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id)
+        page_ids.append(len(objects))
+
+    kids = b" ".join(b"%d 0 R" % i for i in page_ids)
+    objects[1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % len(page_ids)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % i + obj + b"\nendobj\n"
+
+    xref_offset = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def make_kb_file(data_dir: str, file_count: int) -> tuple:
+    """直接写出包含 file_count 个文件的 knowledge_bases.json"""
+    kb_id = str(uuid.uuid4())
+    files = [{
+        "id": str(uuid.uuid4()),
+        "name": f"file_{i}.pdf",
+        "path": os.path.join(data_dir, "uploads", kb_id, f"file_{i}.pdf"),
+        "type": "pdf",
+        "size": 1.0,
+        "uploaded_at": "2024-01-01T00:00:00"
+    } for i in range(file_count)]
+
+    os.makedirs(data_dir, exist_ok=True)
+    with open(os.path.join(data_dir, "knowledge_bases.json"), "w", encoding="utf-8") as f:
+        json.dump([{"id": kb_id, "name": "bench", "created_at": "2024-01-01T00:00:00", "files": files}],
+                  f, ensure_ascii=False)
+    return kb_id, files[-1]["id"]
+
+
+def stub_llm(prompt: str) -> str:
+    """根据 ChatEngine 的 Prompt 类型返回固定回答"""
+    if '只回答"简单"或"复杂"' in prompt:
+        return "复杂"
+    if "SQL专家" in prompt:
+        table = re.search(r"表名: (\S+)", prompt).group(1)
+        return f"SELECT 材质, COUNT(*) AS count, AVG(价格) AS avg_price FROM {table} GROUP BY 材质"
+    return "根据查询结果，玻璃材质的产品数量最多。"
+
+
+# ---------------------------------------------------------------------------
+# 基准测试
+# ---------------------------------------------------------------------------
+
+def measure(func: Callable[[], object], repeat: int) -> float:
+    """多次执行取中位数（秒）"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def without_result_cache(engine: SQLQueryEngine) -> SQLQueryEngine:
+    """关闭查询结果缓存，使每次迭代都实际执行 SQL，而不是测量缓存命中"""
+    engine.result_cache = QueryResultCache(max_bytes=0)
+    return engine
+
+
+class BenchmarkSuite:
+    """在临时工作目录中生成数据并运行各项基准"""
+
+    def __init__(self, work_dir: str, quick: bool = False, repeat: int = 5):
+        self.work_dir = work_dir
+        self.quick = quick
+        self.repeat = repeat
+        self.results: Dict[str, float] = {}
+
+    def record(self, name: str, seconds: float) -> None:
+        self.results[name] = seconds
+        print(f"{name:<40} {seconds * 1000:>12.3f} ms")
+
+    def run(self, only: Optional[str] = None) -> Dict[str, float]:
+        benchmarks = [
+            ("kb_lookup", self.bench_kb_lookup),
+            ("sql_import", self.bench_sql_import),
+            ("sql_execute", self.bench_sql_execute),
+            ("pdf_extract", self.bench_pdf_extract),
+            ("format_table", self.bench_format_table),
+            ("chat_query", self.bench_chat_query)
+        ]
+        for prefix, bench in benchmarks:
+            if only and not prefix.startswith(only) and not only.startswith(prefix):
+                continue
+            bench()
+        if only:
+            self.results = {k: v for k, v in self.results.items() if k.startswith(only)}
+        return self.results
+
+    def bench_kb_lookup(self) -> None:
+        for count in ([10, 1000, 10000] if self.quick else [10, 1000, 100000]):
+            data_dir = os.path.join(self.work_dir, f"kb_{count}")
+            kb_id, file_id = make_kb_file(data_dir, count)
+            manager = KnowledgeBaseManager(data_dir)
+            self.record(f"kb_lookup_{count}_files",
+                        measure(lambda: manager.get_file(kb_id, file_id), self.repeat))
+
+    def _row_sizes(self) -> List[int]:
+        return [1000, 10000] if self.quick else [1000, 10000, 100000]
+
+    def bench_sql_import(self) -> None:
+        engine = SQLQueryEngine(os.path.join(self.work_dir, "sql_import"))
+        for rows in self._row_sizes():
+            csv_path = os.path.join(self.work_dir, f"price_{rows}.csv")
+            make_price_frame(rows).to_csv(csv_path, index=False)
+            self.record(f"sql_import_csv_{rows}_rows",
+                        measure(lambda: engine.process_tabular_file("kb", csv_path, f"csv{rows}"), 3))
+
+        for rows in [1000] if self.quick else [1000, 10000]:
+            xlsx_path = os.path.join(self.work_dir, f"price_{rows}.xlsx")
+            with pd.ExcelWriter(xlsx_path) as writer:
+                for sheet in range(3):
+                    make_price_frame(rows).to_excel(writer, sheet_name=f"Sheet{sheet}", index=False)
+            self.record(f"sql_import_xlsx_3x{rows}_rows",
+                        measure(lambda: engine.process_tabular_file("kb", xlsx_path, f"xlsx{rows}"), 1))
+
+    def bench_sql_execute(self) -> None:
+        engine = without_result_cache(SQLQueryEngine(os.path.join(self.work_dir, "sql_execute")))
+        for rows in self._row_sizes():
+            csv_path = os.path.join(self.work_dir, f"exec_{rows}.csv")
+            make_price_frame(rows).to_csv(csv_path, index=False)
+            engine.process_tabular_file("kb", csv_path, f"f{rows}")
+
+            group_by = f"SELECT 材质, COUNT(*) AS cnt, AVG(价格) AS avg_price FROM table_f{rows} GROUP BY 材质"
+            point = f"SELECT 底阀离地高度 FROM table_f{rows} WHERE 型号 = 'YFR-{rows // 2}EX'"
+            self.record(f"sql_execute_group_by_{rows}_rows",
+                        measure(lambda: engine.execute_query("kb", group_by), self.repeat))
+            self.record(f"sql_execute_point_{rows}_rows",
+                        measure(lambda: engine.execute_query("kb", point), self.repeat))
+
+        self.record("sql_table_metadata", measure(lambda: engine.get_table_metadata("kb"), self.repeat))
+
+    def bench_pdf_extract(self) -> None:
+        for pages in ([10] if self.quick else [10, 100]):
+            pdf_path = os.path.join(self.work_dir, f"doc_{pages}.pdf")
+            make_pdf(pdf_path, pages)
+            processor = DocumentProcessor(pdf_path)
+            self.record(f"pdf_extract_{pages}_pages", measure(processor.extract_from_pdf, 3))
+
+    def bench_format_table(self) -> None:
+        chat_engine = ChatEngine(KnowledgeBaseManager(os.path.join(self.work_dir, "format")))
+        df = make_price_frame(200, extra_columns=45)
+        results = df.to_dict("records")
+        columns = df.columns.tolist()
+        self.record("format_table_200x50",
+                    measure(lambda: chat_engine._format_results_as_table(results, columns), self.repeat))
+
+    def bench_chat_query(self) -> None:
+        manager = KnowledgeBaseManager(os.path.join(self.work_dir, "data"))
+        kb = manager.create_knowledge_base("bench")
+        csv_path = os.path.join(self.work_dir, "chat_price.csv")
+        make_price_frame(10000).to_csv(csv_path, index=False)
+        manager.add_file(kb["id"], "chat_price.csv", csv_path, "csv", 1.0)
+
+        chat_engine = ChatEngine(manager)
+        result_cache = chat_engine.sql_engine.result_cache
+        without_result_cache(chat_engine.sql_engine)
+        question = "统计每种材质的产品数量和平均价格"
+        result = chat_engine.query(kb["id"], question)
+        if result.get("error"):
+            raise RuntimeError(f"ChatEngine.query 执行失败: {result['answer']}")
+        self.record("chat_query_complex_10000_rows",
+                    measure(lambda: chat_engine.query(kb["id"], question), self.repeat))
+
+        # 缓存命中的耗时单独记录，不影响上面对 SQL 执行的测量
+        chat_engine.sql_engine.result_cache = result_cache
+        chat_engine.query(kb["id"], question)
+        self.record("chat_query_complex_10000_rows_cached",
+                    measure(lambda: chat_engine.query(kb["id"], question), self.repeat))
+
+
+# ---------------------------------------------------------------------------
+# 基线比较
+# ---------------------------------------------------------------------------
+
+def compare(results: Dict[str, float], baseline: Dict[str, float], threshold: float,
+            min_delta: float = 0.001) -> List[str]:
+    """返回回归超过阈值的指标说明；min_delta 用于忽略极小耗时的抖动"""
+    regressions = []
+    for name, seconds in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if seconds > base * (1 + threshold) and seconds - base > min_delta:
+            regressions.append(f"{name}: {base * 1000:.3f} ms -> {seconds * 1000:.3f} ms "
+                               f"(+{(seconds / base - 1) * 100:.0f}%)")
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="后端微基准测试")
+    parser.add_argument("--quick", action="store_true", help="缩小数据规模")
+    parser.add_argument("--repeat", type=int, default=5, help="每项重复次数")
+    parser.add_argument("--only", help="只运行名称以此开头的基准")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH, help="基线文件")
+    parser.add_argument("--threshold", type=float, default=0.25, help="允许的相对回归比例")
+    parser.add_argument("--update-baseline", action="store_true", help="用本次结果覆盖基线")
+    args = parser.parse_args(argv)
+
+    # 所有模块都使用相对 data/ 目录，切换到临时目录避免污染仓库
+    work_dir = tempfile.mkdtemp(prefix="instant_ai_bench_")
+    cwd = os.getcwd()
+    providers = dict(llm.providers)
+    default_provider = llm.default_provider
+    try:
+        os.chdir(work_dir)
+        llm.providers["stub"] = stub_llm
+        llm.default_provider = "stub"
+        results = BenchmarkSuite(work_dir, quick=args.quick, repeat=args.repeat).run(args.only)
+    finally:
+        os.chdir(cwd)
+        llm.providers.clear()
+        llm.providers.update(providers)
+        llm.default_provider = default_provider
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    if args.update_baseline or not baseline:
+        baseline.update(results)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"\n基线已保存至: {args.baseline}")
+        return 0
+
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"\n以下指标回归超过 {args.threshold * 100:.0f}%:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+
+    print("\n没有发现性能回归")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,439 @@
+"""
+后端压测工具：在本机启动后端和本地桩LLM服务，按比例混合发送简单问题、复杂SQL问题和文件上传
+
+全程离线：后端通过 GT4_API_URL 调用本地的 OpenAI 兼容桩服务，桩服务按配置的
+首字延迟和生成速率（token/秒）模拟LLM耗时。问题和上传文件取自 tests/test_cases
+（存在时），否则使用生成的数据。
+
+用法:
+    python tests/benchmarks/load_test.py                                  # 并发 1,4,16，每档 20 秒
+    python tests/benchmarks/load_test.py --concurrency 8,32,64 --duration 60
+    python tests/benchmarks/load_test.py --mix simple=6,complex=3,upload=1 --llm-latency 0.8 --llm-token-rate 40
+    python tests/benchmarks/load_test.py --server-cmd "gunicorn -w 4 -b 127.0.0.1:{port} app:app" --json report.json
+
+每档并发输出吞吐、各类请求的 p50/p95/p99 延迟、错误率，以及后端进程树（含工作进程）的 RSS。
+
+问题从少量固定问题中循环选取，因此默认关闭SQL结果缓存和实体索引快速路径，使每个请求都
+实际调用LLM并执行SQL；加 --result-cache / --fast-path 可测量开启后的效果，报告中注明所用模式。
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import signal
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import requests
+from bench_backend import make_price_frame
+
+TEST_CASES_DIR = os.path.join(ROOT_DIR, "tests", "test_cases")
+UPLOAD_EXTENSIONS = ("csv", "xlsx", "xls", "pdf", "docx", "txt")
+
+DEFAULT_SIMPLE_QUESTIONS = [
+    "YFR-150EX的底阀离地高度是多少？",
+    "YFR-20EX是什么材质？",
+    "玻璃反应釜的主要用途是什么？",
+    "产品目录中有哪些材质？"
+]
+DEFAULT_COMPLEX_QUESTIONS = [
+    "统计每种材质的产品数量和平均价格",
+    "统计容积大于200升的产品数量",
+    "统计价格最高的10个产品的型号"
+]
+
+
+# ---------------------------------------------------------------------------
+# 本地桩LLM服务（OpenAI Chat Completions 兼容）
+# ---------------------------------------------------------------------------
+
+def stub_completion(prompt: str) -> str:
+    """根据 ChatEngine 的 Prompt 类型返回固定回答"""
+    if '只回答"简单"或"复杂"' in prompt:
+        question = re.search(r"问题: (.*)", prompt)
+        return "复杂" if question and "统计" in question.group(1) else "简单"
+    if "SQL专家" in prompt:
+        table = re.search(r"表名: (\S+)", prompt)
+        if table is None:
+            return "SELECT 1"
+        return f"SELECT 材质, COUNT(*) AS count, AVG(价格) AS avg_price FROM {table.group(1)} GROUP BY 材质"
+    if "对话摘要" in prompt:
+        return "用户询问了产品的材质和价格。"
+    return "根据提供的资料，玻璃材质的产品数量最多，平均价格约为四万五千元。"
+
+
+class StubLLMServer:
+    """
+    在后台线程中运行的桩LLM服务
+    每次调用耗时 = latency + 回答token数 / token_rate
+    """
+
+    def __init__(self, latency: float = 0.5, token_rate: float = 50.0, port: int = 0):
+        self.latency = latency
+        self.token_rate = token_rate
+        self.calls = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                prompt = "\n".join(m.get("content", "") for m in body.get("messages", []) if m.get("role") == "user")
+                content = stub_completion(prompt)
+                with server._lock:
+                    server.calls += 1
+                # 中文按每字一个 token 粗略估计
+                time.sleep(server.latency + len(content) / max(server.token_rate, 1e-6))
+
+                payload = json.dumps({
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                                 "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": len(prompt), "completion_tokens": len(content)}
+                }, ensure_ascii=False).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self._httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._httpd.server_address[1]}/v1/chat/completions"
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="stub-llm", daemon=True)
+
+    def start(self) -> "StubLLMServer":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+# ---------------------------------------------------------------------------
+# 后端进程
+# ---------------------------------------------------------------------------
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_backend(work_dir: str, port: int, llm_url: str, server_cmd: Optional[str] = None,
+                  extra_env: Optional[Dict[str, str]] = None) -> subprocess.Popen:
+    """在工作目录中启动后端（默认使用 Flask 多线程开发服务器），等待端口可用"""
+    env = dict(os.environ)
+    env.update({
+        "PYTHONPATH": os.pathsep.join([ROOT_DIR, os.path.join(ROOT_DIR, "backend"), env.get("PYTHONPATH", "")]),
+        "LLM_DEFAULT_PROVIDER": "gt4",
+        "LLM_ROUTING_PROVIDERS": "",
+        "GT4_API_URL": llm_url,
+        "GT4_API_KEY": "load-test",
+        "OPENAI_API_KEY": env.get("OPENAI_API_KEY", "load-test"),
+    })
+    env.update(extra_env or {})
+
+    if server_cmd:
+        command = server_cmd.format(port=port).split()
+    else:
+        command = [sys.executable, "-c",
+                   f"from app import app; app.run(host='127.0.0.1', port={port}, threaded=True)"]
+    # 访问日志写入文件：管道无人读取时写满会阻塞后端
+    log_path = os.path.join(work_dir, "backend.log")
+    with open(log_path, "wb") as log:
+        process = subprocess.Popen(command, cwd=work_dir, env=env,
+                                   stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            with open(log_path, "r", encoding="utf-8", errors="replace") as f:
+                raise RuntimeError(f"后端启动失败:\n{f.read()}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return process
+        except OSError:
+            time.sleep(0.2)
+    stop_backend(process)
+    raise RuntimeError("后端启动超时")
+
+
+def stop_backend(process: subprocess.Popen) -> None:
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=10)
+    except (ProcessLookupError, subprocess.TimeoutExpired):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+def process_tree_rss(pid: int) -> int:
+    """进程及其所有子进程（如 gunicorn 工作进程、批量导入进程池）的 RSS 之和，单位字节（Linux /proc）"""
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # comm 字段可能包含空格，从最后一个右括号之后解析
+        ppid = int(stat[stat.rfind(")") + 2:].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+
+    total, pending = 0, [pid]
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/statm", "r") as f:
+                total += int(f.read().split()[1]) * page_size
+        except OSError:
+            continue
+        pending.extend(children.get(current, []))
+    return total
+
+
+# ---------------------------------------------------------------------------
+# 负载
+# ---------------------------------------------------------------------------
+
+def load_workload(work_dir: str) -> Dict[str, List[Any]]:
+    """问题和上传文件：优先取自 tests/test_cases，否则生成"""
+    simple, complex_questions, uploads = [], [], []
+    cases_path = os.path.join(TEST_CASES_DIR, "test_cases.csv")
+    if os.path.exists(cases_path):
+        import pandas as pd
+        for query in pd.read_csv(cases_path, encoding="utf-8")["query"].dropna().astype(str):
+            (complex_questions if "统计" in query else simple).append(query)
+
+    if os.path.isdir(TEST_CASES_DIR):
+        for name in sorted(os.listdir(TEST_CASES_DIR)):
+            if name.rsplit(".", 1)[-1].lower() in UPLOAD_EXTENSIONS and name != "test_cases.csv":
+                uploads.append(os.path.join(TEST_CASES_DIR, name))
+
+    if not uploads:
+        for rows in (200, 2000):
+            path = os.path.join(work_dir, f"upload_{rows}.csv")
+            make_price_frame(rows).to_csv(path, index=False)
+            uploads.append(path)
+        path = os.path.join(work_dir, "upload_notes.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("玻璃反应釜适用于腐蚀性介质的反应、蒸馏和结晶。\n" * 200)
+        uploads.append(path)
+
+    return {
+        "simple": simple or DEFAULT_SIMPLE_QUESTIONS,
+        "complex": complex_questions or DEFAULT_COMPLEX_QUESTIONS,
+        "upload": uploads
+    }
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        if kind.strip() not in ("simple", "complex", "upload"):
+            raise argparse.ArgumentTypeError(f"未知的请求类型: {kind}")
+        mix[kind.strip()] = float(weight)
+    return mix
+
+
+class LoadGenerator:
+    """按权重混合发送请求，逐档提高并发"""
+
+    def __init__(self, base_url: str, workload: Dict[str, List[Any]], mix: Dict[str, float],
+                 timeout: float = 120.0):
+        self.base_url = base_url
+        self.workload = workload
+        self.kinds = [kind for kind, weight in mix.items() if weight > 0]
+        self.weights = [mix[kind] for kind in self.kinds]
+        self.timeout = timeout
+        self.chat_kb_id = None
+        self.upload_kb_id = None
+
+    def setup(self) -> None:
+        """问答使用预先导入数据的知识库；上传写入单独的知识库，避免问答的数据量随压测增长"""
+        self.chat_kb_id = self._create_kb("压测问答")
+        self.upload_kb_id = self._create_kb("压测上传")
+        for path in self.workload["upload"]:
+            self._upload(self.chat_kb_id, path)
+
+    def _create_kb(self, name: str) -> str:
+        response = requests.post(f"{self.base_url}/api/knowledge-bases", json={"name": name}, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()["id"]
+
+    def _upload(self, kb_id: str, path: str, session: Optional[requests.Session] = None) -> requests.Response:
+        name = os.path.basename(path)
+        with open(path, "rb") as f:
+            return (session or requests).post(f"{self.base_url}/api/knowledge-bases/{kb_id}/files",
+                                              files={"file": (name, f)}, timeout=self.timeout)
+
+    def request(self, session: requests.Session, kind: str, rng: random.Random) -> bool:
+        """发送一个请求；返回是否成功"""
+        if kind == "upload":
+            response = self._upload(self.upload_kb_id, rng.choice(self.workload["upload"]), session)
+            return response.status_code == 200
+        response = session.post(f"{self.base_url}/api/chat", timeout=self.timeout, json={
+            "question": rng.choice(self.workload[kind]),
+            "knowledgeBaseId": self.chat_kb_id
+        })
+        return response.status_code == 200 and not response.json().get("error")
+
+    def run_stage(self, concurrency: int, duration: float, backend_pid: int) -> Dict[str, Any]:
+        samples: List[Tuple[str, float, bool]] = []
+        lock = threading.Lock()
+        stop_at = time.monotonic() + duration
+
+        def worker(index: int) -> None:
+            rng = random.Random(index)
+            with requests.Session() as session:
+                while time.monotonic() < stop_at:
+                    kind = rng.choices(self.kinds, self.weights)[0]
+                    start = time.perf_counter()
+                    try:
+                        ok = self.request(session, kind, rng)
+                    except (requests.RequestException, ValueError):
+                        ok = False
+                    with lock:
+                        samples.append((kind, time.perf_counter() - start, ok))
+
+        rss_samples = []
+        stage_start = time.monotonic()
+        threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        while any(thread.is_alive() for thread in threads):
+            rss_samples.append(process_tree_rss(backend_pid))
+            time.sleep(0.5)
+        elapsed = time.monotonic() - stage_start
+
+        return summarize_stage(concurrency, elapsed, samples, rss_samples)
+
+
+def percentile(values: List[float], q: float) -> float:
+    """最近秩法百分位"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def summarize_stage(concurrency: int, elapsed: float, samples: List[Tuple[str, float, bool]],
+                    rss_samples: List[int]) -> Dict[str, Any]:
+    by_kind: Dict[str, List[Tuple[float, bool]]] = {}
+    for kind, latency, ok in samples:
+        by_kind.setdefault(kind, []).append((latency, ok))
+        by_kind.setdefault("all", []).append((latency, ok))
+
+    kinds = {}
+    for kind, entries in by_kind.items():
+        latencies = [latency for latency, _ in entries]
+        kinds[kind] = {
+            "requests": len(entries),
+            "throughput": len(entries) / elapsed,
+            "errorRate": sum(1 for _, ok in entries if not ok) / len(entries),
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99)
+        }
+    return {
+        "concurrency": concurrency,
+        "seconds": elapsed,
+        "kinds": kinds,
+        "rssMaxMB": max(rss_samples, default=0) / 1024 / 1024,
+        "rssEndMB": (rss_samples[-1] if rss_samples else 0) / 1024 / 1024
+    }
+
+
+def print_stage(stage: Dict[str, Any]) -> None:
+    print(f"\n并发 {stage['concurrency']}（{stage['seconds']:.1f} 秒，"
+          f"RSS 峰值 {stage['rssMaxMB']:.0f} MB，结束时 {stage['rssEndMB']:.0f} MB）")
+    print(f"  {'类型':<8}{'请求数':>8}{'吞吐/s':>10}{'错误率':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for kind in ("simple", "complex", "upload", "all"):
+        row = stage["kinds"].get(kind)
+        if row is None:
+            continue
+        print(f"  {kind:<8}{row['requests']:>8}{row['throughput']:>10.2f}{row['errorRate'] * 100:>8.1f}%"
+              f"{row['p50'] * 1000:>10.0f}{row['p95'] * 1000:>10.0f}{row['p99'] * 1000:>10.0f}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="后端压测（本地桩LLM，离线运行）")
+    parser.add_argument("--concurrency", default="1,4,16", help="逐档提高的并发数，逗号分隔")
+    parser.add_argument("--duration", type=float, default=20.0, help="每档持续秒数")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("simple=6,complex=3,upload=1"),
+                        help="请求类型权重，如 simple=6,complex=3,upload=1")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="桩LLM首字延迟（秒）")
+    parser.add_argument("--llm-token-rate", type=float, default=50.0, help="桩LLM生成速率（token/秒）")
+    parser.add_argument("--server-cmd", help="自定义后端启动命令，{port} 会被替换，在临时工作目录中执行")
+    parser.add_argument("--result-cache", action="store_true", help="开启SQL结果缓存（默认关闭）")
+    parser.add_argument("--fast-path", action="store_true", help="开启实体索引快速路径（默认关闭）")
+    parser.add_argument("--env", action="append", default=[], help="传给后端的环境变量 KEY=VALUE，可重复")
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    args = parser.parse_args(argv)
+
+    stages = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    # 重复的问题会命中结果缓存或快速路径，默认关闭以测量完整的请求路径
+    extra_env = {"CHAT_FAST_PATH": "1" if args.fast_path else "0"}
+    if not args.result_cache:
+        extra_env.update({"SQL_CACHE_MB": "0", "SQL_CACHE_DISK": "0"})
+    extra_env.update(item.split("=", 1) for item in args.env)
+
+    # 后端使用相对 data/ 目录，在临时目录中运行避免污染仓库
+    work_dir = tempfile.mkdtemp(prefix="instant_ai_load_")
+    stub = StubLLMServer(args.llm_latency, args.llm_token_rate).start()
+    port = free_port()
+    backend = start_backend(work_dir, port, stub.url, args.server_cmd, extra_env)
+    report = {"config": {"mix": args.mix, "llmLatency": args.llm_latency,
+                         "llmTokenRate": args.llm_token_rate, "duration": args.duration,
+                         "resultCache": extra_env.get("SQL_CACHE_MB") != "0",
+                         "fastPath": extra_env["CHAT_FAST_PATH"] == "1"},
+              "stages": []}
+    try:
+        generator = LoadGenerator(f"http://127.0.0.1:{port}", load_workload(work_dir), args.mix)
+        generator.setup()
+        print(f"后端已启动（pid {backend.pid}），空载 RSS {process_tree_rss(backend.pid) / 1024 / 1024:.0f} MB")
+        print(f"SQL结果缓存: {'开启' if report['config']['resultCache'] else '关闭'}，"
+              f"实体索引快速路径: {'开启' if report['config']['fastPath'] else '关闭'}")
+
+        for concurrency in stages:
+            stage = generator.run_stage(concurrency, args.duration, backend.pid)
+            report["stages"].append(stage)
+            print_stage(stage)
+        report["llmCalls"] = stub.calls
+        print(f"\n桩LLM共收到 {stub.calls} 次调用")
+    finally:
+        stop_backend(backend)
+        stub.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存至: {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
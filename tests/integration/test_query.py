@@ -3,7 +3,9 @@ import sys
 import os
 import time
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test_scripts"))
 from csv_query_app.query import query_csv
+from eval_runner import EvaluationRunner, write_report, make_stub_query
 
 import pandas as pd
 from datetime import datetime
@@ -16,76 +18,62 @@ def test_query_flow():
     df = pd.read_csv(test_cases_path, encoding="utf-8")
     test_cases = df.to_dict("records")[28:31]  # 只取前3个测试用例
     
-    results = []
     total_cases = len(test_cases)
     start_time = time.time()
     
     print("\n开始执行测试...")    
     print(f"共加载 {total_cases} 个测试用例\n")
     
-    failed_cases = []
-    total_progress = 0
+    # EVAL_STUB=1 时使用离线桩函数，CI中无需网络
+    if os.getenv("EVAL_STUB") == "1":
+        query_func = make_stub_query(test_cases, "query", "expected_contains")
+        provider = "stub"
+    else:
+        query_func = query_csv
+        provider = os.getenv("EVAL_PROVIDER", "gt4")
     
-    for case in test_cases:
-        case_start_time = time.time()
-        
-        # 打印当前测试用例信息（左对齐）
-        print(f"问题：{case['query']}")
-        print(f"期望包含：{case['expected_contains']}")
-        response = query_csv(case["query"])
-        print(f"实际响应：{response}")
-        
+    def evaluate(case, response):
         # 统一处理中文负号和英文负号
         normalized_response = response.replace("﹣", "-")
-        normalized_expected = case["expected_contains"].replace("﹣", "-")
-        
-        # 计算进度
-        total_progress = ((len(results) / total_cases) * 100)
-        case_time = time.time() - case_start_time
-        status_symbol = "✓" if normalized_expected in normalized_response else "✗"
-        
-        # 使用tqdm创建进度条
-        progress_bar = f"执行进度: {total_progress:3.0f}% {status_symbol} [{len(results)}/{total_cases}] {case_time:.1f}s"
-        print(progress_bar)
-        print("-" * 80)
-        
-        # 记录测试结果
-        result = {
+        normalized_expected = str(case["expected_contains"]).replace("﹣", "-")
+        return {
             "query": case["query"],
             "expected_contains": case["expected_contains"],
             "actual_response": response,
             "status": "通过" if normalized_expected in normalized_response else "失败"
         }
-        results.append(result)
-        
-        # 记录失败用例
-        if normalized_expected not in normalized_response:
-            failed_cases.append((case["query"], normalized_expected, normalized_response))
-        
-        # 计算进度
-        total_progress = ((len(results) / total_cases) * 100)
-        case_time = time.time() - case_start_time
+    
+    progress = tqdm(total=total_cases, desc="执行进度")
+    
+    def on_result(result):
         status_symbol = "✓" if result["status"] == "通过" else "✗"
-        
-        # 清除之前的进度显示并更新
-        print(f"\r执行进度: {total_progress:3.0f}% {status_symbol} [{len(results)}/{total_cases}] {case_time:.1f}s", end="")
+        progress.write(f"{status_symbol} 问题：{result['query']}  期望包含：{result['expected_contains']}  "
+                       f"实际响应：{result['actual_response']}  {result['latency']:.1f}s")
+        progress.update(1)
+    
+    runner = EvaluationRunner(
+        query_func,
+        provider=provider,
+        max_workers=int(os.getenv("EVAL_WORKERS", "4"))
+    )
+    results = runner.run(test_cases, evaluate, query_key="query", on_result=on_result)
+    progress.close()
     
     # 计算总耗时
     total_time = time.time() - start_time
     
     # 生成测试报告
-    df = pd.DataFrame(results)
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     report_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "test_reports", f"test_results_{timestamp}.csv")
-    df.to_csv(report_path, index=False, encoding="utf-8")
+    summary = write_report(results, report_path)
     
     # 打印总结信息
-    passed = sum(1 for r in results if r["status"] == "通过")
     print(f"测试执行完成!")
-    print(f"总用例数: {total_cases}")
-    print(f"通过数量: {passed}")
-    print(f"失败数量: {total_cases - passed}")
-    print(f"通过率: {(passed/total_cases)*100:.2f}%")
+    print(f"总用例数: {summary['total']}")
+    print(f"通过数量: {summary['passed']}")
+    print(f"失败数量: {summary['failed']}")
+    print(f"通过率: {summary['pass_rate']:.2f}%")
+    print(f"延迟 p50: {summary['latency_p50']:.2f}秒  p95: {summary['latency_p95']:.2f}秒")
     print(f"总耗时: {total_time:.2f}秒")
     print(f"\n测试报告已保存至: {report_path}")
 
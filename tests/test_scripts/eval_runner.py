@@ -0,0 +1,196 @@
+import os
+import json
+import math
+import time
+import hashlib
+import threading
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional, Tuple
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from llm_interface.rate_limiter import RateLimiter
+from llm_interface.scheduler import call_context, PRIORITY_BATCH
+
+# 默认的每个提供商限流配置：(每秒请求数, 突发数)
+DEFAULT_RATE_LIMITS = {
+    "gt4": (2.0, 4),
+    "openai": (2.0, 4)
+}
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """最近秩法计算百分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+class EvaluationRunner:
+    """并发评测执行器：有界线程池、按提供商限流、断点续跑和延迟统计"""
+
+    def __init__(self, query_func: Callable[..., str], provider: str = "gt4", max_workers: int = 4,
+                 rate_limits: Optional[Dict[str, Tuple[float, int]]] = None,
+                 progress_path: Optional[str] = None,
+                 prompt_func: Optional[Callable[[str], str]] = None):
+        """
+        Args:
+            query_func: 查询函数，签名为 query_func(query, provider=...)
+            provider: LLM提供商
+            max_workers: 并发数上限
+            rate_limits: 提供商 -> (每秒请求数, 突发数)，未配置的提供商不限流
+            progress_path: 进度文件（JSONL），用于断点续跑
+            prompt_func: 根据问题生成实际Prompt，用于判断用例是否已用相同Prompt评测过
+        """
+        self.query_func = query_func
+        self.provider = provider
+        self.max_workers = max(1, max_workers)
+        self.progress_path = progress_path
+        self.prompt_func = prompt_func
+
+        rate_limits = DEFAULT_RATE_LIMITS if rate_limits is None else rate_limits
+        self.rate_limiter = RateLimiter(*rate_limits[provider]) if provider in rate_limits else None
+
+        self._progress_lock = threading.Lock()
+
+    def case_key(self, query: str) -> str:
+        """用例的续跑键：相同的Prompt和提供商视为同一次评测"""
+        prompt = self.prompt_func(query) if self.prompt_func else query
+        return hashlib.sha1(f"{self.provider}\n{prompt}".encode("utf-8")).hexdigest()
+
+    def load_progress(self) -> Dict[str, Dict]:
+        """读取已完成的用例结果"""
+        completed = {}
+        if self.progress_path and os.path.exists(self.progress_path):
+            with open(self.progress_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 中断时可能留下不完整的最后一行
+                        continue
+                    completed[record["key"]] = record["result"]
+        return completed
+
+    def run(self, cases: List[Dict], evaluate: Callable[[Dict, str], Dict], query_key: str = "query",
+            on_result: Optional[Callable[[Dict], None]] = None) -> List[Dict]:
+        """
+        并发执行所有用例，结果按用例原顺序返回
+
+        Args:
+            cases: 测试用例列表
+            evaluate: evaluate(case, actual_output) -> 结果字典
+            query_key: 用例中问题字段的名称
+            on_result: 每个用例完成后的回调
+        """
+        completed = self.load_progress()
+        results: List[Optional[Dict]] = [None] * len(cases)
+        pending = []
+
+        for i, case in enumerate(cases):
+            key = self.case_key(case[query_key])
+            if key in completed:
+                results[i] = dict(completed[key], resumed=True)
+            else:
+                pending.append((i, key, case))
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {
+                executor.submit(self._run_case, case, evaluate, query_key): (i, key)
+                for i, key, case in pending
+            }
+            for future in as_completed(futures):
+                i, key = futures[future]
+                result, scored = future.result()
+                results[i] = result
+                # 执行出错（超时、提供商错误等）的用例不记入进度，续跑时重新执行
+                if scored:
+                    self._save_progress(key, result)
+                if on_result:
+                    on_result(result)
+
+        return results
+
+    def _run_case(self, case: Dict, evaluate: Callable[[Dict, str], Dict], query_key: str) -> Tuple[Dict, bool]:
+        """执行单个用例并记录延迟，返回 (结果, 是否得到了实际评测)"""
+        wait_time = self.rate_limiter.acquire() if self.rate_limiter else 0.0
+
+        start_time = time.perf_counter()
+        try:
+            # 评测属于批量任务，排在交互式请求之后
+            with call_context(PRIORITY_BATCH):
+                actual_output = self.query_func(case[query_key], provider=self.provider)
+            result = evaluate(case, actual_output)
+            scored = True
+        except Exception as e:
+            result = evaluate(case, "")
+            result["status"] = "失败"
+            result["remark"] = f"执行出错: {str(e)}"
+            scored = False
+        latency = time.perf_counter() - start_time
+
+        result["provider"] = self.provider
+        result["latency"] = round(latency, 4)
+        result["rate_limit_wait"] = round(wait_time, 4)
+        return result, scored
+
+    def _save_progress(self, key: str, result: Dict) -> None:
+        """追加一条已完成用例到进度文件"""
+        if not self.progress_path:
+            return
+        with self._progress_lock:
+            with open(self.progress_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"key": key, "result": result}, ensure_ascii=False) + "\n")
+
+
+def summarize(results: List[Dict]) -> Dict:
+    """统计通过率和延迟分布"""
+    total = len(results)
+    passed = sum(1 for r in results if r.get("status") == "通过")
+    latencies = [r["latency"] for r in results if r.get("latency") is not None]
+    return {
+        "total": total,
+        "passed": passed,
+        "failed": total - passed,
+        "pass_rate": round(passed / total * 100, 2) if total else 0.0,
+        "latency_p50": round(percentile(latencies, 50), 4),
+        "latency_p95": round(percentile(latencies, 95), 4),
+        "latency_max": round(max(latencies), 4) if latencies else 0.0
+    }
+
+
+def write_report(results: List[Dict], csv_path: str) -> Dict:
+    """
+    写出CSV报告：逐用例结果后追加一行汇总（第一列为 SUMMARY）
+    返回汇总统计
+    """
+    summary = summarize(results)
+    df = pd.DataFrame(results)
+    summary_row = {
+        df.columns[0]: "SUMMARY",
+        "status": f"{summary['passed']}/{summary['total']} ({summary['pass_rate']}%)",
+        "latency": f"p50={summary['latency_p50']}s p95={summary['latency_p95']}s"
+    }
+    df = pd.concat([df, pd.DataFrame([summary_row])], ignore_index=True)
+
+    os.makedirs(os.path.dirname(csv_path), exist_ok=True)
+    df.to_csv(csv_path, index=False, encoding="utf-8")
+    return summary
+
+
+def make_stub_query(cases: List[Dict], query_key: str, answer_key: str,
+                    latency: float = 0.0) -> Callable[..., str]:
+    """离线桩函数：按问题直接返回期望答案，用于在无网络的CI中验证评测流程"""
+    answers = {case[query_key]: str(case[answer_key]) for case in cases}
+
+    def query(query_text: str, provider: str = "stub") -> str:
+        if latency:
+            time.sleep(latency)
+        return answers.get(query_text, "")
+
+    return query
@@ -1,19 +1,25 @@
 import os
 import json
 import difflib
-import pandas as pd
+import argparse
 from datetime import datetime
 from typing import Dict, List
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
-from csv_query_app.query import query_csv
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from csv_query_app.query import query_csv, get_engine
+from eval_runner import EvaluationRunner, write_report, make_stub_query
 
 class TestRunner:
-    def __init__(self):
+    def __init__(self, provider: str = "gt4", max_workers: int = 4, query_func=None, resume: bool = True):
         self.test_cases = []
         self.results = []
         self.similarity_threshold = 0.9
         self.base_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        self.provider = provider
+        self.max_workers = max_workers
+        self.query_func = query_func or query_csv
+        self.resume = resume
 
     def load_test_cases(self) -> None:
         """加载测试用例"""
@@ -23,8 +29,8 @@ class TestRunner:
         except Exception as e:
             raise Exception(f"加载测试用例失败: {e}")
 
-    def run_single_test(self, test_case: Dict) -> Dict:
-        """运行单个测试用例"""
+    def evaluate(self, test_case: Dict, actual_output: str) -> Dict:
+        """评估单个测试用例的输出"""
         result = {
             "test_id": test_case["test_id"],
             "input_query": test_case["input_query"],
@@ -32,67 +38,73 @@ class TestRunner:
             "test_type": test_case.get("test_type", "normal"),
             "status": "失败",
             "similarity_score": 0.0,
-            "actual_output": "",
+            "actual_output": actual_output,
             "remark": ""
         }
 
-        try:
-            # 调用CSV查询接口
-            actual_output = query_csv(test_case["input_query"])
-            result["actual_output"] = actual_output
-
-            # 计算相似度
-            similarity = difflib.SequenceMatcher(None, actual_output, test_case["expected_output"]).ratio()
-            result["similarity_score"] = similarity
+        # 计算相似度
+        similarity = difflib.SequenceMatcher(None, actual_output, test_case["expected_output"]).ratio()
+        result["similarity_score"] = similarity
 
-            # 判断测试结果
-            if similarity > self.similarity_threshold:
-                result["status"] = "通过"
-
-        except Exception as e:
-            result["remark"] = f"执行出错: {str(e)}"
+        # 判断测试结果
+        if similarity > self.similarity_threshold:
+            result["status"] = "通过"
 
         return result
 
     def run_all_tests(self) -> None:
-        """运行所有测试用例"""
-        self.results = []
-        for test_case in self.test_cases:
-            result = self.run_single_test(test_case)
-            self.results.append(result)
+        """并发运行所有测试用例，已用相同Prompt评测过的用例直接复用结果"""
+        progress_path = f"{self.base_path}/test_reports/progress_{self.provider}.jsonl" if self.resume else None
+        if progress_path:
+            os.makedirs(os.path.dirname(progress_path), exist_ok=True)
+
+        prompt_func = get_engine()._construct_prompt if self.query_func is query_csv else None
+        runner = EvaluationRunner(
+            self.query_func,
+            provider=self.provider,
+            max_workers=self.max_workers,
+            progress_path=progress_path,
+            prompt_func=prompt_func
+        )
+        self.results = runner.run(self.test_cases, self.evaluate, query_key="input_query")
 
     def generate_report(self) -> None:
         """生成测试报告"""
         if not self.results:
             return
 
-        # 计算统计信息
-        total = len(self.results)
-        passed = sum(1 for r in self.results if r["status"] == "通过")
-        failed = total - passed
-
         # 生成CSV报告
-        df = pd.DataFrame(self.results)
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         csv_path = f"{self.base_path}/test_reports/test_results_{timestamp}.csv"
-        df.to_csv(csv_path, index=False, encoding="utf-8")
+        summary = write_report(self.results, csv_path)
 
         # 打印统计信息
         print(f"\n测试结果统计:")
-        print(f"总用例数: {total}")
-        print(f"通过数: {passed}")
-        print(f"失败数: {failed}")
-        print(f"通过率: {(passed/total)*100:.2f}%")
+        print(f"总用例数: {summary['total']}")
+        print(f"通过数: {summary['passed']}")
+        print(f"失败数: {summary['failed']}")
+        print(f"通过率: {summary['pass_rate']:.2f}%")
+        print(f"延迟 p50: {summary['latency_p50']:.2f}秒  p95: {summary['latency_p95']:.2f}秒")
         print(f"\n详细报告已保存至: {csv_path}")
 
 def main():
-    runner = TestRunner()
+    parser = argparse.ArgumentParser(description="CSV查询评测")
+    parser.add_argument("--provider", default="gt4", help="LLM提供商")
+    parser.add_argument("--workers", type=int, default=4, help="并发数")
+    parser.add_argument("--stub", action="store_true", help="使用离线桩函数代替LLM，用于CI")
+    parser.add_argument("--no-resume", action="store_true", help="忽略已有进度，全部重新评测")
+    args = parser.parse_args()
+
+    runner = TestRunner(provider=args.provider, max_workers=args.workers, resume=not args.no_resume)
     try:
         runner.load_test_cases()
+        if args.stub:
+            runner.provider = "stub"
+            runner.query_func = make_stub_query(runner.test_cases, "input_query", "expected_output")
         runner.run_all_tests()
         runner.generate_report()
     except Exception as e:
         print(f"测试执行失败: {e}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
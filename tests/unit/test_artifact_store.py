@@ -0,0 +1,51 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "backend"))
+
+from artifact_store import ArtifactStore
+
+
+def test_publish_and_lookup(tmp_path):
+    """按键查找，含中文键和空值"""
+    store = ArtifactStore(str(tmp_path))
+    assert store.open("kb/index") is None
+
+    entries = {f"YFR-{i}EX": str(i).encode() for i in range(1000)}
+    entries["型号"] = "底阀离地高度".encode("utf-8")
+    entries["empty"] = b""
+    store.publish("kb/index", entries)
+
+    with store.open("kb/index") as reader:
+        assert len(reader) == 1002
+        assert reader.get("YFR-150EX") == b"150"
+        assert reader.get("型号").decode("utf-8") == "底阀离地高度"
+        assert reader.get("empty") == b""
+        assert reader.get("missing") is None
+        assert dict(reader.items()) == entries
+        # 二分查找直接在映射上进行，每个键都能找到，进程内不复制索引
+        assert all(reader.get(key) == value for key, value in entries.items())
+        assert not hasattr(reader._mapping, "hashes")
+
+
+def test_swap_keeps_open_readers_and_unmaps_old_version(tmp_path):
+    """重建后新读者看到新版本，旧版本在最后一个读者关闭后解除映射"""
+    store = ArtifactStore(str(tmp_path))
+    store.publish("kb/index", {"k": b"v1"})
+
+    old_reader = store.open("kb/index")
+    store.publish("kb/index", {"k": b"v2"})
+    store.publish("kb/index", {"k": b"v3"})
+
+    with store.open("kb/index") as new_reader:
+        assert new_reader.get("k") == b"v3"
+        assert new_reader.version != old_reader.version
+
+    # 旧版本文件已被清理，但已映射的内容仍然可读
+    assert not os.path.exists(os.path.join(store.get_artifact_dir("kb/index"), old_reader.version))
+    assert old_reader.get("k") == b"v1"
+    old_reader.close()
+    assert len(ArtifactStore.mapped_versions()) >= 1
+
+    store.delete("kb")
+    assert store.open("kb/index") is None
+    assert not any(path.startswith(str(tmp_path)) for path in ArtifactStore.mapped_versions())
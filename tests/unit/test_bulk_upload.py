@@ -0,0 +1,64 @@
+import io
+import os
+import sys
+import zipfile
+import pytest
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(ROOT_DIR)
+sys.path.append(os.path.join(ROOT_DIR, "backend"))
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("INGEST_WORKERS", "2")
+    import app as app_module
+    from knowledge_base import KnowledgeBaseManager
+
+    kb_manager = KnowledgeBaseManager(str(tmp_path / "data"))
+    monkeypatch.setattr(app_module, "kb_manager", kb_manager)
+    monkeypatch.setitem(app_module.app.config, "UPLOAD_FOLDER", str(tmp_path / "data" / "uploads"))
+
+    kb = kb_manager.create_knowledge_base("测试")
+    return app_module.app.test_client(), kb_manager, kb["id"]
+
+
+def test_bulk_upload_archive_and_files(client):
+    """压缩包与多个文件一次上传，并行处理后一次性写入元数据并返回逐文件状态"""
+    test_client, kb_manager, kb_id = client
+
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("docs/a.txt", "第一份文档")
+        zf.writestr("docs/b.txt", "第二份文档")
+        zf.writestr("docs/价格表.csv", "型号,价格\nYFR-150EX,1200\n")
+        zf.writestr("docs/image.png", b"\x89PNG")
+        zf.writestr("__MACOSX/docs/._a.txt", b"")
+    archive.seek(0)
+
+    response = test_client.post(f"/api/knowledge-bases/{kb_id}/files/bulk", data={
+        "files": [
+            (archive, "docs.zip"),
+            (io.BytesIO("说明文档".encode("utf-8")), "a.txt"),
+            (io.BytesIO(b"%PDF-broken"), "broken.pdf"),
+        ]
+    }, content_type="multipart/form-data")
+    assert response.status_code == 200
+
+    summary = response.get_json()
+    assert (summary["total"], summary["succeeded"], summary["failed"], summary["skipped"]) == (6, 4, 1, 1)
+
+    statuses = {item["name"]: item["status"] for item in summary["files"]}
+    assert statuses["docs/image.png"] == "skipped"
+    assert statuses["broken.pdf"] == "failed"
+    # 同名文件不会互相覆盖
+    assert {"a.txt", "a_1.txt", "b.txt", "file.csv"} <= set(statuses)
+
+    files = kb_manager.get_files(kb_id)
+    assert sorted(f["name"] for f in files) == ["a.txt", "a_1.txt", "b.txt", "file.csv"]
+    assert all(os.path.exists(f["path"]) for f in files)
+    assert not os.path.exists(os.path.join(os.path.dirname(files[0]["path"]), "broken.pdf"))
+
+    # 实体索引在批量导入结束后统一构建
+    assert kb_manager.sql_engine.entity_index.lookup(kb_id, "YFR-150EX的价格是多少？")["value"] == 1200
@@ -0,0 +1,383 @@
+import os
+import re
+import sys
+import time
+import threading
+import pytest
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(ROOT_DIR)
+sys.path.append(os.path.join(ROOT_DIR, "backend"))
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+import pandas as pd
+from knowledge_base import KnowledgeBaseManager
+from chat_engine import ChatEngine
+from llm_interface.llm_selector import llm
+
+LLM_LATENCY = 0.1
+
+
+def stub_llm(prompt: str) -> str:
+    """模拟固定延迟的LLM"""
+    time.sleep(LLM_LATENCY)
+    if '只回答"简单"或"复杂"' in prompt:
+        question = re.search(r"问题: (.*)", prompt).group(1)
+        return "复杂" if "统计" in question else "简单"
+    if "SQL专家" in prompt:
+        table = re.search(r"表名: (\S+)", prompt).group(1)
+        return f"SELECT COUNT(*) AS count FROM {table} WHERE 材质 = '玻璃'"
+    return "玻璃材质的产品共有 2 个。"
+
+
+@pytest.fixture
+def kb(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setitem(llm.providers, "stub", stub_llm)
+    monkeypatch.setattr(llm, "default_provider", "stub")
+
+    manager = KnowledgeBaseManager("data")
+    kb = manager.create_knowledge_base("产品库")
+    pd.DataFrame({
+        "型号": ["YFR-50EX", "YFR-100EX", "YFR-150EX"],
+        "材质": ["玻璃", "不锈钢", "玻璃"]
+    }).to_csv("price.csv", index=False)
+    manager.add_file(kb["id"], "price.csv", "price.csv", "csv", 0.1)
+    return manager, kb["id"]
+
+
+@pytest.mark.parametrize("speculative", [False, True])
+def test_complex_query(kb, speculative):
+    """复杂问题走SQL流程，推测模式下结果一致"""
+    manager, kb_id = kb
+    engine = ChatEngine(manager, speculative=speculative)
+
+    start = time.monotonic()
+    result = engine.query(kb_id, "统计材质为玻璃的产品数量")
+    elapsed = time.monotonic() - start
+
+    assert result["isComplexQuery"] is True
+    assert result["answer"] == "玻璃材质的产品共有 2 个。"
+    assert result["sources"]
+    # 推测模式下分类与SQL生成并行，少一次LLM往返
+    if speculative:
+        assert elapsed < 3 * LLM_LATENCY
+    else:
+        assert elapsed >= 3 * LLM_LATENCY
+
+
+def test_speculative_simple_query_discards_sql_branch(kb):
+    """简单问题在推测模式下使用检索分支的结果"""
+    manager, kb_id = kb
+    engine = ChatEngine(manager, speculative=True)
+    # 这个问题本可以由实体索引直接回答，这里关闭快速路径以测试推测分支
+    engine.fast_path = False
+
+    result = engine.query(kb_id, "YFR-150EX是什么材质？")
+    assert result["isComplexQuery"] is False
+    assert result["sources"] == ["price.csv"]
+
+
+def test_query_across_knowledge_bases(kb, monkeypatch):
+    """多个知识库：检索合并排序，复杂问题通过 ATTACH 联合查询"""
+    manager, kb_id = kb
+    other = manager.create_knowledge_base("配件库")
+    pd.DataFrame({"型号": ["FV-20"], "材质": ["玻璃"]}).to_csv("parts.csv", index=False)
+    manager.add_file(other["id"], "parts.csv", "parts.csv", "csv", 0.1)
+    with open("manual.txt", "w", encoding="utf-8") as f:
+        f.write("FV-20 底阀的安装说明")
+    manager.add_file(other["id"], "manual.txt", "manual.txt", "txt", 0.1)
+
+    prompts = []
+
+    def federated_llm(prompt):
+        prompts.append(prompt)
+        if '只回答"简单"或"复杂"' in prompt:
+            return "复杂" if "统计" in re.search(r"问题: (.*)", prompt).group(1) else "简单"
+        if "SQL专家" in prompt:
+            tables = re.findall(r"表名: (\S+)", prompt)
+            union = " UNION ALL ".join(f"SELECT 材质 FROM {table}" for table in tables)
+            return f"SELECT COUNT(*) AS count FROM ({union}) WHERE 材质 = '玻璃'"
+        return "ok"
+
+    monkeypatch.setitem(llm.providers, "stub", federated_llm)
+    engine = ChatEngine(manager)
+
+    result = engine.query([kb_id, other["id"]], "统计材质为玻璃的产品数量")
+    assert result["isComplexQuery"] is True
+    assert len(result["sources"]) == 2
+    assert all(source.startswith(("kb1.", "kb2.")) for source in result["sources"])
+    assert "查询结果: 3" in prompts[-1]
+
+    result = engine.query([kb_id, other["id"]], "FV-20 底阀怎么安装？")
+    assert result["isComplexQuery"] is False
+    assert result["sources"][0] == "manual.txt"
+
+
+def test_point_lookup_answers_without_llm(kb, monkeypatch):
+    """问题只涉及一个型号和一个列时直接读取单元格，不调用LLM"""
+    manager, kb_id = kb
+    calls = []
+    monkeypatch.setitem(llm.providers, "stub", lambda prompt: calls.append(prompt) or stub_llm(prompt))
+    engine = ChatEngine(manager)
+
+    start = time.monotonic()
+    result = engine.query(kb_id, "yfr-150ex的材质是什么？")
+    assert time.monotonic() - start < LLM_LATENCY
+    assert result["answer"] == "YFR-150EX的材质是玻璃。"
+    assert result["lookup"]["column"] == "材质"
+    assert calls == []
+
+    # 没有提到列名时走正常流程
+    result = engine.query(kb_id, "YFR-150EX是什么？")
+    assert "lookup" not in result
+    assert calls
+
+
+@pytest.mark.parametrize("question", [
+    "YFR-200EX的价格是否超过5000？",
+    "YFR-200EX的价格比5000高吗？",
+    "YFR-200EX价格的两倍是多少？",
+    "YFR-200EX的价格加上运费一共多少？",
+    "YFR-200EX的材质是玻璃吗？",
+    "YFR-200EX的价格",
+])
+def test_point_lookup_skips_non_lookup_questions(kb, question):
+    """是非、比较和计算类问题即使只涉及一个单元格也不走快速路径"""
+    manager, kb_id = kb
+    pd.DataFrame({"型号": ["YFR-200EX"], "材质": ["玻璃"], "价格": [4800]}).to_csv("extra.csv", index=False)
+    manager.add_file(kb_id, "extra.csv", "extra.csv", "csv", 0.1)
+    index = ChatEngine(manager).sql_engine.entity_index
+
+    assert index.lookup(kb_id, "YFR-200EX的价格是多少？")["value"] == 4800
+    assert index.lookup(kb_id, question) is None
+
+
+def test_stale_entity_index_rebuilt_off_request_path(kb, monkeypatch):
+    """数据变化后查询不同步重建实体索引：先走正常流程，索引在后台重建后再命中"""
+    manager, kb_id = kb
+    index = manager.sql_engine.entity_index
+    builds = []
+    original_build = index.build
+    monkeypatch.setattr(index, "build", lambda kb: builds.append(threading.current_thread().name) or original_build(kb))
+
+    manager.sql_engine.bump_data_version(kb_id)
+    assert index.lookup(kb_id, "YFR-150EX的材质是什么？") is None
+    assert "MainThread" not in builds
+
+    deadline = time.monotonic() + 5
+    while index.lookup(kb_id, "YFR-150EX的材质是什么？") is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert index.lookup(kb_id, "YFR-150EX的材质是什么？")["value"] == "玻璃"
+    assert builds and all(name.startswith("entity-index") for name in builds)
+
+
+def test_expensive_sql_revised_by_llm(kb, monkeypatch):
+    """开销超出预算的SQL在执行前被拒绝，并由LLM改写一次"""
+    manager, kb_id = kb
+    prompts = []
+
+    def cartesian_llm(prompt):
+        prompts.append(prompt)
+        if "开销过大" in prompt:
+            table = re.search(r"表名: (\S+)", prompt).group(1)
+            return f"SELECT COUNT(*) AS count FROM {table} WHERE 材质 = '玻璃'"
+        if "SQL专家" in prompt:
+            table = re.search(r"表名: (\S+)", prompt).group(1)
+            return f"SELECT COUNT(*) AS count FROM {table} a, {table} b WHERE a.材质 = '玻璃'"
+        return stub_llm(prompt)
+
+    monkeypatch.setitem(llm.providers, "stub", cartesian_llm)
+    engine = ChatEngine(manager)
+    monkeypatch.setattr(engine.sql_engine.guard, "max_rows", 5)
+    monkeypatch.setattr(engine.sql_engine.guard, "policy", "revise")
+
+    result = engine.query(kb_id, "统计材质为玻璃的产品数量")
+    assert result["answer"] == "玻璃材质的产品共有 2 个。"
+    revise_prompt = next(prompt for prompt in prompts if "开销过大" in prompt)
+    assert "拒绝原因: 查询预计扫描" in revise_prompt
+    assert "查询结果: 2" in prompts[-1]
+
+
+def test_invalid_sql_repaired_with_one_prompt(kb, monkeypatch):
+    """SQL本地编译失败且无法自动映射时，只用一次修复提示重新生成"""
+    manager, kb_id = kb
+    prompts = []
+
+    def typo_llm(prompt):
+        prompts.append(prompt)
+        table = re.search(r"表名: (\S+)", prompt).group(1) if "表名" in prompt else None
+        if "无法执行" in prompt:
+            return f"SELECT COUNT(*) AS count FROM {table} WHERE 材质 = '玻璃'"
+        if "SQL专家" in prompt:
+            return f"SELECT COUNT(*) AS count FROM {table} WHERE 材料 = '玻璃'"
+        return stub_llm(prompt)
+
+    monkeypatch.setitem(llm.providers, "stub", typo_llm)
+    result = ChatEngine(manager).query(kb_id, "统计材质为玻璃的产品数量")
+
+    assert result["answer"] == "玻璃材质的产品共有 2 个。"
+    repair_prompts = [prompt for prompt in prompts if "无法执行" in prompt]
+    assert len(repair_prompts) == 1 and "no such column: 材料" in repair_prompts[0]
+    assert len(prompts) == 4
+
+
+def test_conversation_memory_window_and_cursor(kb, monkeypatch):
+    """对话只保留最近几轮原文，更早的轮次在后台合并为摘要；客户端用游标代替完整历史"""
+    from conversation_memory import ConversationMemory, HistoryCursorMismatch
+
+    manager, kb_id = kb
+    prompts = []
+
+    def memory_llm(prompt):
+        prompts.append(prompt)
+        if "更新一段对话摘要" in prompt:
+            return "用户询问过多个型号的材质"
+        return stub_llm(prompt)
+
+    monkeypatch.setitem(llm.providers, "stub", memory_llm)
+    engine = ChatEngine(manager)
+    engine.fast_path = False
+    engine.memory = ConversationMemory(engine._summarize_history, window_turns=1)
+
+    result = engine.query(kb_id, "第1个问题是什么材质？")
+    conversation_id, cursor = result["conversationId"], result["historyCursor"]
+    for i in range(2, 5):
+        result = engine.query(kb_id, f"第{i}个问题是什么材质？", conversation_id, history_cursor=cursor)
+        cursor = result["historyCursor"]
+        # 等待后台摘要完成，使下一次请求看到稳定的上下文
+        deadline = time.monotonic() + 5
+        while len(engine.memory.get(conversation_id)["messages"]) > 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    memory = engine.memory.get(conversation_id)
+    assert memory["summary"] == "用户询问过多个型号的材质"
+    assert [m["content"] for m in memory["messages"]][0] == "第4个问题是什么材质？"
+
+    # 回答第4个问题时：摘要和第3轮原文在提示中，更早的轮次不在
+    answer_prompt = [p for p in prompts if "第4个问题" in p and "上下文" in p][-1]
+    assert "之前对话的摘要: 用户询问过多个型号的材质" in answer_prompt
+    assert "第3个问题" in answer_prompt and "第1个问题" not in answer_prompt
+
+    # 过期的游标被拒绝，客户端需要重新发送完整历史
+    with pytest.raises(HistoryCursorMismatch) as e:
+        engine.query(kb_id, "第5个问题是什么材质？", conversation_id, history_cursor="1-stale")
+    assert e.value.cursor == cursor
+
+    history = [{"role": "user", "content": "重新开始"}, {"role": "assistant", "content": "好的"}]
+    result = engine.query(kb_id, "第5个问题是什么材质？", conversation_id, history)
+    assert result["historyCursor"] != cursor
+
+
+def test_error_answers_kept_out_of_memory(kb, monkeypatch):
+    """出错的回答不写入对话记忆，之后的提示中不会出现错误信息"""
+    manager, kb_id = kb
+    prompts = []
+
+    def memory_llm(prompt):
+        prompts.append(prompt)
+        return stub_llm(prompt)
+
+    monkeypatch.setitem(llm.providers, "stub", memory_llm)
+    engine = ChatEngine(manager)
+    engine.fast_path = False
+    engine.speculative = False
+
+    handle_simple_query, attempts = engine._handle_simple_query, []
+
+    def flaky_handler(*args, **kwargs):
+        # 第一次回答超时，之后正常
+        attempts.append(args)
+        if len(attempts) == 1:
+            raise RuntimeError("provider timeout")
+        return handle_simple_query(*args, **kwargs)
+
+    monkeypatch.setattr(engine, "_handle_simple_query", flaky_handler)
+    result = engine.query(kb_id, "玻璃产品有什么用途？")
+    assert result["error"] is True and "provider timeout" in result["answer"]
+
+    conversation_id = result["conversationId"]
+    messages = engine.memory.get(conversation_id)["messages"]
+    assert [m["role"] for m in messages] == ["user"]
+
+    # 游标仍然有效，后续提示不包含错误信息
+    engine.query(kb_id, "玻璃产品有什么用途？", conversation_id, history_cursor=result["historyCursor"])
+    assert not any("处理查询时出错" in p or "provider timeout" in p for p in prompts)
+
+
+
+def test_batch_questions_share_classification_and_dedupe(kb, monkeypatch):
+    """批量问题：一次LLM调用完成分类，相同问题只回答一次，结果以NDJSON流式返回"""
+    manager, kb_id = kb
+    prompts = []
+
+    def batch_llm(prompt):
+        prompts.append(prompt)
+        if "按编号逐行回答" in prompt:
+            questions = re.findall(r"^(\d+)\. (.*)$", prompt, re.M)
+            return "\n".join(f"{n}. {'复杂' if '统计' in q else '简单'}" for n, q in questions)
+        return stub_llm(prompt)
+
+    monkeypatch.setitem(llm.providers, "stub", batch_llm)
+    engine = ChatEngine(manager)
+    questions = ["统计材质为玻璃的产品数量", "玻璃产品有什么用途？", "统计材质为玻璃的产品数量 ",
+                 "YFR-150EX的材质是什么？", "玻璃产品有什么用途？"]
+
+    start = time.monotonic()
+    results = list(engine.query_batch(kb_id, questions, max_concurrency=4))
+    elapsed = time.monotonic() - start
+
+    assert results[-1] == {"done": True, "questions": 5, "unique": 3}
+    by_index = {result["index"]: result for result in results[:-1]}
+    assert sorted(by_index) == [0, 1, 2, 3, 4]
+    assert by_index[0]["isComplexQuery"] is True and by_index[0]["answer"] == by_index[2]["answer"]
+    assert by_index[2]["deduplicated"] is True and by_index[4]["deduplicated"] is True
+    assert by_index[3]["lookup"]["value"] == "玻璃"
+
+    # 实体索引直接回答一个问题，其余两个问题一次分类：分类1次 + 复杂问题2次 + 简单问题1次
+    assert len([p for p in prompts if "按编号逐行回答" in p]) == 1
+    assert not any('只回答"简单"或"复杂"' in p for p in prompts)
+    assert len(prompts) == 4
+    # 两个问题并发回答
+    assert elapsed < 4 * LLM_LATENCY
+
+
+def test_batch_failure_reported_in_stream(kb, monkeypatch):
+    """批量分类失败时，每个问题返回一条错误记录，并以带 error 的 done 记录结束"""
+    manager, kb_id = kb
+
+    def failing_llm(prompt):
+        if "按编号逐行回答" in prompt:
+            raise RuntimeError("provider unavailable")
+        return stub_llm(prompt)
+
+    monkeypatch.setitem(llm.providers, "stub", failing_llm)
+    engine = ChatEngine(manager)
+    questions = ["统计材质为玻璃的产品数量", "玻璃产品有什么用途？", "玻璃产品有什么用途？"]
+
+    results = list(engine.query_batch(kb_id, questions))
+
+    assert results[-1]["done"] is True and "provider unavailable" in results[-1]["error"]
+    errors = results[:-1]
+    assert sorted(result["index"] for result in errors) == [0, 1, 2]
+    assert all(result["error"] is True and "provider unavailable" in result["answer"] for result in errors)
+
+
+def test_batch_endpoint_streams_ndjson(kb, monkeypatch):
+    """批量接口校验参数并逐行返回结果"""
+    import json
+    import app as app_module
+
+    manager, kb_id = kb
+    monkeypatch.setattr(app_module, "kb_manager", manager)
+    monkeypatch.setattr(app_module, "chat_engine", ChatEngine(manager))
+    client = app_module.app.test_client()
+
+    assert client.post("/api/chat/batch", json={"knowledgeBaseId": kb_id, "questions": []}).status_code == 400
+    assert client.post("/api/chat/batch", json={"knowledgeBaseId": "missing", "questions": ["a"]}).status_code == 404
+
+    response = client.post("/api/chat/batch", json={"knowledgeBaseId": kb_id,
+                                                    "questions": ["YFR-50EX的材质是什么？"] * 2})
+    assert response.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.data.decode("utf-8").splitlines()]
+    assert [line.get("index") for line in lines] == [0, 1, None]
+    assert lines[0]["answer"] == lines[1]["answer"] and lines[-1]["done"] is True
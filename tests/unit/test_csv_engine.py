@@ -0,0 +1,83 @@
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+import pandas as pd
+from csv_query_app import query as csv_query
+
+
+def _write_price_table(base_path, prices):
+    df = pd.DataFrame({
+        "型号": ["YFR-50EX", "YFR-100EX", "YFR-150EX"],
+        "底阀离地高度": [350, 420, 490],
+        "价格": prices
+    })
+    df.to_csv(os.path.join(base_path, "price.csv"), index=False, encoding="utf-8")
+
+
+def test_engine_registry_reuses_loaded_tables(tmp_path, monkeypatch):
+    """相同配置复用同一个引擎，CSV只在文件变化时重新解析"""
+    csv_query.clear_engines()
+    _write_price_table(tmp_path, [1000, 2000, 3000])
+    csv_files = {"结晶釜价格表": "price.csv"}
+
+    reads = []
+    original_read_csv = pd.read_csv
+    monkeypatch.setattr(csv_query.pd, "read_csv", lambda *a, **kw: reads.append(a) or original_read_csv(*a, **kw))
+
+    engine = csv_query.get_engine(str(tmp_path), csv_files)
+    assert csv_query.get_engine(str(tmp_path), csv_files) is engine
+
+    first_prompt = engine._construct_prompt("YFR-150EX的价格是多少？")
+    engine._construct_prompt("YFR-50EX的价格是多少？")
+    assert len(reads) == 1
+    assert "3000" in first_prompt
+
+    # 内容变化后重新加载
+    _write_price_table(tmp_path, [1000, 2000, 3999])
+    os.utime(os.path.join(tmp_path, "price.csv"), ns=(0, 1))
+    assert "3999" in engine._construct_prompt("YFR-150EX的价格是多少？")
+    assert len(reads) == 2
+
+    # 只更新 mtime、内容不变时不重新解析
+    os.utime(os.path.join(tmp_path, "price.csv"), ns=(0, 2))
+    engine._construct_prompt("YFR-150EX的价格是多少？")
+    assert len(reads) == 2
+
+
+def test_prompt_only_contains_relevant_rows_and_columns(tmp_path):
+    """按型号和列名关键词筛选后只发送相关的行列"""
+    csv_query.clear_engines()
+    _write_price_table(tmp_path, [1000, 2000, 3000])
+    engine = csv_query.get_engine(str(tmp_path), {"结晶釜价格表": "price.csv"})
+
+    prompt = engine._construct_prompt("yfr-150ex的底阀离地高度是多少？")
+    assert "YFR-150EX" in prompt and "490" in prompt
+    assert "YFR-50EX" not in prompt
+    assert "价格" not in prompt.split("这是用户的问题")[0].split("表 结晶釜价格表:")[1]
+
+    # 无法定位实体和列时退回整表
+    prompt = engine._construct_prompt("一共有哪些产品？")
+    assert "YFR-50EX" in prompt and "YFR-150EX" in prompt
+
+
+def test_prompt_covers_every_configured_table(tmp_path):
+    """表名可配置：每个表单独一节，各自只包含相关的行和列"""
+    csv_query.clear_engines()
+    _write_price_table(tmp_path, [1000, 2000, 3000])
+    pd.DataFrame({
+        "编码": ["SF-10L", "SF-20L"],
+        "功率": [1.5, 2.2]
+    }).to_csv(os.path.join(tmp_path, "motor.csv"), index=False, encoding="utf-8")
+    engine = csv_query.get_engine(str(tmp_path), {"反应釜价格": "price.csv", "电机参数": "motor.csv"})
+
+    prompt = engine._construct_prompt("SF-20L的功率是多少？")
+    data = prompt.split("这是用户的问题")[0]
+    assert "表 反应釜价格:" in data and "表 电机参数:" in data
+    motor_section = data.split("表 电机参数:")[1]
+    assert "2.2" in motor_section and "SF-10L" not in motor_section
+
+    prompt = engine._construct_prompt("YFR-150EX的价格是多少？")
+    price_section = prompt.split("表 反应釜价格:")[1].split("表 电机参数:")[0]
+    assert "3000" in price_section and "YFR-50EX" not in price_section
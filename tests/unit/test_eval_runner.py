@@ -0,0 +1,88 @@
+import os
+import sys
+import time
+import threading
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test_scripts"))
+
+import pandas as pd
+from eval_runner import EvaluationRunner, make_stub_query, percentile, write_report
+
+
+CASES = [{"query": f"问题{i}", "expected": f"答案{i}"} for i in range(8)]
+
+
+def _evaluate(case, actual_output):
+    return {
+        "query": case["query"],
+        "actual_output": actual_output,
+        "status": "通过" if case["expected"] in actual_output else "失败"
+    }
+
+
+def test_runner_executes_cases_concurrently_in_order():
+    """并发执行用例，结果保持原顺序并记录延迟"""
+    stub = make_stub_query(CASES, "query", "expected", latency=0.1)
+    lock = threading.Lock()
+    active, peak = [0], [0]
+
+    def query(query_text, provider):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        try:
+            return stub(query_text, provider)
+        finally:
+            with lock:
+                active[0] -= 1
+
+    runner = EvaluationRunner(query, provider="stub", max_workers=8)
+    results = runner.run(CASES, _evaluate)
+
+    # 观察到的最大并发数，而不是墙钟时间
+    assert 1 < peak[0] <= 8
+    assert [r["query"] for r in results] == [c["query"] for c in CASES]
+    assert all(r["status"] == "通过" and r["latency"] >= 0.1 for r in results)
+
+
+def test_runner_resumes_and_rate_limits(tmp_path):
+    """已评测的用例从进度文件恢复，执行出错的用例续跑时重试，限流按提供商生效"""
+    calls, attempts = [], []
+
+    def query(query_text, provider):
+        calls.append(query_text)
+        attempts.append(query_text)
+        # 问题3第一次执行超时，重试时成功
+        if query_text == "问题3" and attempts.count(query_text) == 1:
+            raise Exception("超时")
+        return query_text.replace("问题", "答案")
+
+    progress_path = str(tmp_path / "progress.jsonl")
+    runner = EvaluationRunner(query, provider="stub", max_workers=4,
+                              rate_limits={"stub": (20.0, 1)}, progress_path=progress_path)
+
+    start = time.perf_counter()
+    results = runner.run(CASES, _evaluate)
+    assert time.perf_counter() - start >= 0.3  # 8个请求，每秒20个
+    assert results[3]["status"] == "失败" and "超时" in results[3]["remark"]
+
+    calls.clear()
+    resumed = runner.run(CASES, _evaluate)
+    assert calls == ["问题3"]
+    assert resumed[3]["status"] == "通过" and "resumed" not in resumed[3]
+    assert all(r["resumed"] for i, r in enumerate(resumed) if i != 3)
+
+    calls.clear()
+    assert all(r["resumed"] for r in runner.run(CASES, _evaluate))
+    assert calls == []
+
+    report_path = str(tmp_path / "report.csv")
+    summary = write_report(resumed, report_path)
+    assert summary["passed"] == 8
+    assert pd.read_csv(report_path).iloc[-1]["query"] == "SUMMARY"
+
+
+def test_percentile():
+    values = [float(i) for i in range(1, 101)]
+    assert percentile(values, 50) == 50.0
+    assert percentile(values, 95) == 95.0
+    assert percentile([], 95) == 0.0
@@ -0,0 +1,63 @@
+import os
+import sys
+import pytest
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(ROOT_DIR)
+sys.path.append(os.path.join(ROOT_DIR, "backend"))
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    import app as app_module
+    from knowledge_base import KnowledgeBaseManager
+
+    kb_manager = KnowledgeBaseManager(str(tmp_path / "data"))
+    monkeypatch.setattr(app_module, "kb_manager", kb_manager)
+    monkeypatch.setitem(app_module.app.config, "UPLOAD_FOLDER", str(tmp_path / "data" / "uploads"))
+    monkeypatch.setitem(app_module.app.config, "X_ACCEL_REDIRECT_PREFIX", None)
+
+    kb = kb_manager.create_knowledge_base("测试")
+    file_path = tmp_path / "data" / "uploads" / kb["id"] / "notes.txt"
+    file_path.write_text("0123456789" * 100, encoding="utf-8")
+    file_info = kb_manager.add_file(kb["id"], "notes.txt", str(file_path), "txt", 0.001)
+
+    url = f"/api/knowledge-bases/{kb['id']}/files/{file_info['id']}/preview"
+    return app_module.app, app_module.app.test_client(), url, file_info
+
+
+def test_preview_etag_range_and_inline(client):
+    """内联预览，强 ETag 来自内容哈希，支持 304 和字节范围请求"""
+    _, test_client, url, file_info = client
+
+    response = test_client.get(url)
+    assert response.status_code == 200
+    assert response.headers["Content-Disposition"].startswith("inline")
+    assert response.headers["ETag"] == f'"{file_info["content_hash"]}"'
+    assert response.headers["Accept-Ranges"] == "bytes"
+
+    response = test_client.get(url, headers={"If-None-Match": response.headers["ETag"]})
+    assert response.status_code == 304
+
+    response = test_client.get(url, headers={"Range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.data == b"0123456789"
+
+    response = test_client.get(url + "?download=1")
+    assert response.headers["Content-Disposition"].startswith("attachment")
+
+
+def test_preview_offloaded_to_proxy(client):
+    """配置 X-Accel-Redirect 时只返回头部，由前端代理发送文件"""
+    app, test_client, url, file_info = client
+    app.config["X_ACCEL_REDIRECT_PREFIX"] = "/protected-uploads/"
+
+    response = test_client.get(url)
+    assert response.status_code == 200
+    assert response.data == b""
+    assert response.headers["X-Accel-Redirect"].startswith("/protected-uploads/")
+    assert response.headers["X-Accel-Redirect"].endswith("/notes.txt")
+
+    response = test_client.get(url, headers={"If-None-Match": f'"{file_info["content_hash"]}"'})
+    assert response.status_code == 304
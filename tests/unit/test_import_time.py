@@ -0,0 +1,34 @@
+import os
+import sys
+import subprocess
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 导入 backend/app.py 的耗时预算（毫秒），可通过 IMPORT_TIME_BUDGET_MS 调整
+IMPORT_TIME_BUDGET_MS = float(os.getenv("IMPORT_TIME_BUDGET_MS", "600"))
+
+# 这些模块应在首次需要时才导入
+LAZY_MODULES = {"pandas", "PyPDF2", "docx", "openai", "httpx", "requests", "duckdb", "pyarrow", "fitz"}
+
+
+def test_backend_import_time(tmp_path):
+    """启动时不导入重型依赖，且导入耗时在预算内"""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([os.path.join(ROOT_DIR, "backend"), ROOT_DIR])
+    env.pop("WARM_UP", None)
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        cwd=tmp_path, env=env, capture_output=True, text=True, timeout=60
+    )
+    assert result.returncode == 0, result.stderr[-2000:]
+
+    imported = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            imported[name.strip()] = int(cumulative)
+
+    eager = sorted(name for name in imported if name.split(".")[0] in LAZY_MODULES)
+    assert not eager, f"启动时导入了重型模块: {eager[:10]}"
+    assert imported["app"] / 1000 < IMPORT_TIME_BUDGET_MS
@@ -0,0 +1,54 @@
+import os
+import sys
+import time
+import pytest
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from llm_interface.llm_selector import llm
+
+
+def test_record_then_replay(tmp_path, monkeypatch):
+    """真实调用被录制后可以离线回放，并按配置模拟延迟"""
+    recordings = str(tmp_path / "recordings.jsonl")
+    monkeypatch.setitem(llm.providers, "fake", lambda prompt: f"回答：{prompt}")
+    monkeypatch.setenv("LLM_RECORD_FILE", recordings)
+    monkeypatch.setenv("LLM_REPLAY_FILE", recordings)
+
+    assert llm.query("YFR-150EX的底阀离地高度是多少？", provider="fake") == "回答：YFR-150EX的底阀离地高度是多少？"
+
+    monkeypatch.delenv("LLM_RECORD_FILE")
+    assert llm.query("YFR-150EX的底阀离地高度是多少？", provider="replay") == "回答：YFR-150EX的底阀离地高度是多少？"
+
+    monkeypatch.setenv("LLM_REPLAY_LATENCY", "fixed:0.05")
+    start = time.monotonic()
+    llm.query("YFR-150EX的底阀离地高度是多少？", provider="replay")
+    assert time.monotonic() - start >= 0.05
+
+
+def test_replay_miss(tmp_path, monkeypatch):
+    """没有录制记录时报错，配置了默认响应时返回默认响应"""
+    monkeypatch.setenv("LLM_REPLAY_FILE", str(tmp_path / "missing.jsonl"))
+    with pytest.raises(Exception, match="回放记录中没有匹配的Prompt"):
+        llm.query("未录制的问题", provider="replay")
+
+    monkeypatch.setenv("LLM_REPLAY_DEFAULT", "简单")
+    assert llm.query("未录制的问题", provider="replay") == "简单"
+
+
+def test_warm_up_loads_recordings(tmp_path, monkeypatch):
+    """预热时读取回放文件，第一次回放调用不再解析文件"""
+    from llm_interface import replay_api
+
+    recordings = tmp_path / "warm.jsonl"
+    store = replay_api.ReplayStore(str(recordings))
+    store.record("你好", "你好！", 0.1, "fake")
+    monkeypatch.setenv("LLM_REPLAY_FILE", str(recordings))
+
+    replay_api.warm_up()
+    assert replay_api.get_store(str(recordings))._records
+
+    opened = []
+    monkeypatch.setattr("builtins.open", lambda *a, **kw: opened.append(a) or pytest.fail("重复读取"))
+    assert replay_api.query_replay("你好") == "你好！"
+    assert opened == []
@@ -0,0 +1,63 @@
+import os
+import sys
+import time
+import pytest
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from llm_interface.llm_selector import LLMSelector
+
+
+@pytest.fixture
+def selector():
+    selector = LLMSelector()
+    selector.providers["fast"] = lambda prompt: "fast"
+    selector.providers["broken"] = lambda prompt: (_ for _ in ()).throw(Exception("503"))
+    return selector
+
+
+def test_hedged_request_when_primary_exceeds_p95(selector):
+    """主提供商超过 p95 未返回时，对冲请求由第二个提供商完成"""
+    delays = {"value": 0.01}
+    selector.providers["slow"] = lambda prompt: time.sleep(delays["value"]) or "slow"
+    selector.configure_routing(["slow", "fast"], hedge_min_delay=0.05)
+
+    # 先让 slow 积累延迟统计并保持排在首位
+    for _ in range(5):
+        assert selector.query("你好", provider="slow") == "slow"
+    selector.router.health["fast"].record_success(0.2)
+
+    delays["value"] = 1.0
+    start = time.monotonic()
+    assert selector.query("你好") == "fast"
+    assert time.monotonic() - start < 0.5
+
+
+def test_failover_and_circuit_breaker(selector):
+    """失败时故障转移，连续失败后熔断并不再发送请求"""
+    calls = []
+    selector.providers["broken"] = lambda prompt: calls.append(prompt) or (_ for _ in ()).throw(Exception("503"))
+    selector.configure_routing(["broken", "fast"], failure_threshold=2, cooldown=60)
+
+    # broken 失败后转移到 fast，之后 broken 排到最后
+    assert selector.query("问题1") == "fast"
+    assert selector.get_routing_state()["ranking"] == ["fast", "broken"]
+
+    # 显式指定提供商的调用同样计入健康度
+    with pytest.raises(Exception, match="503"):
+        selector.query("问题2", provider="broken")
+    state = selector.get_routing_state()
+    assert state["providers"]["broken"]["state"] == "open"
+    assert state["ranking"][0] == "fast"
+
+    calls.clear()
+    assert selector.query("问题3") == "fast"
+    assert calls == []
+
+
+def test_all_providers_open(selector):
+    selector.configure_routing(["broken"], failure_threshold=1, cooldown=60)
+    with pytest.raises(Exception, match="503"):
+        selector.query("问题")
+    with pytest.raises(Exception, match="熔断"):
+        selector.query("问题")
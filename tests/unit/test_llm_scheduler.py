@@ -0,0 +1,104 @@
+import os
+import sys
+import time
+import threading
+import pytest
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from llm_interface.llm_selector import LLMSelector
+from llm_interface.scheduler import LLMScheduler, SchedulerOverloaded, call_context
+
+
+def _wait_for_waiting(scheduler, count):
+    deadline = time.monotonic() + 2
+    while sum(scheduler.stats()["waiting"].values()) < count:
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_priority_and_kb_fairness():
+    """名额释放后先放行交互式请求，同一优先级内在知识库之间轮转"""
+    scheduler = LLMScheduler(global_limit=1, budgets={"batch": None, "interactive": None})
+    blocker = scheduler.acquire("gt4")
+    order = []
+
+    def worker(priority, kb_id):
+        ticket = scheduler.acquire("gt4", priority, kb_id)
+        order.append((priority, kb_id))
+        scheduler.release(ticket)
+
+    requests = [("batch", "kb1"), ("interactive", "kb1"), ("interactive", "kb1"), ("interactive", "kb2")]
+    threads = []
+    for i, (priority, kb_id) in enumerate(requests):
+        thread = threading.Thread(target=worker, args=(priority, kb_id))
+        thread.start()
+        threads.append(thread)
+        _wait_for_waiting(scheduler, i + 1)
+
+    scheduler.release(blocker)
+    for thread in threads:
+        thread.join(timeout=2)
+
+    assert order == [("interactive", "kb1"), ("interactive", "kb2"), ("interactive", "kb1"), ("batch", "kb1")]
+
+
+def test_provider_limit_and_fast_shedding():
+    """提供商名额用满时，预计排队超过预算的请求立即被拒绝"""
+    scheduler = LLMScheduler(global_limit=4, provider_limits={"gt4": 1}, budgets={"interactive": 0.5})
+    shed = []
+    scheduler.add_observer(lambda priority, provider, queue_time, rejected: rejected and shed.append(provider))
+
+    ticket = scheduler.acquire("gt4")
+    # 其他提供商不受影响
+    scheduler.release(scheduler.acquire("openai"))
+
+    start = time.monotonic()
+    with pytest.raises(SchedulerOverloaded):
+        scheduler.acquire("gt4")
+    assert time.monotonic() - start < 0.1
+    assert shed == ["gt4"]
+
+    scheduler.release(ticket)
+    scheduler.release(scheduler.acquire("gt4"))
+    assert scheduler.stats()["active"] == 0
+
+
+def test_selector_propagates_overload():
+    """被拒绝的调用抛出 SchedulerOverloaded，且不计入提供商的失败"""
+    selector = LLMSelector()
+    selector.scheduler = LLMScheduler(global_limit=1, budgets={"interactive": 0.01, "batch": None})
+    selector.providers["fast"] = lambda prompt: "fast"
+    selector.configure_routing(["fast"])
+
+    ticket = selector.scheduler.acquire("fast")
+    with pytest.raises(SchedulerOverloaded):
+        selector.query("你好")
+    assert selector.router.health["fast"].error_rate() == 0.0
+
+    selector.scheduler.release(ticket)
+    with call_context("batch", "kb1"):
+        assert selector.query("你好") == "fast"
+
+
+def test_overload_releases_half_open_trial():
+    """半开状态的试探请求被调度器拒绝时归还试探名额，提供商仍可被选中"""
+    selector = LLMSelector()
+    selector.scheduler = LLMScheduler(global_limit=1, budgets={"interactive": 0.01, "batch": None})
+    selector.providers["a"] = lambda prompt: "a"
+    selector.providers["b"] = lambda prompt: "b"
+    selector.configure_routing(["a", "b"], failure_threshold=1, cooldown=0.01)
+
+    health = selector.router.health["a"]
+    health.record_failure(0.1)
+    time.sleep(0.02)
+
+    ticket = selector.scheduler.acquire("a")
+    with pytest.raises(SchedulerOverloaded):
+        selector.query("你好")
+    assert health.state == "half_open" and not health.trial_in_flight
+    assert "a" in selector.router.candidates()
+
+    selector.scheduler.release(ticket)
+    assert selector.query("你好", provider="a") == "a"
+    assert health.state == "closed"
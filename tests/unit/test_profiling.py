@@ -0,0 +1,87 @@
+import os
+import sys
+import time
+import pytest
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(ROOT_DIR)
+sys.path.append(os.path.join(ROOT_DIR, "backend"))
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import profiling
+
+
+def busy_loop(seconds: float) -> int:
+    """占用CPU一段时间"""
+    total = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        total += 1
+    return total
+
+
+def test_profile_samples_request_and_attached_workers(tmp_path):
+    """采样请求线程和挂接的线程池任务，保存折叠栈和火焰图"""
+    profiler = profiling.Profiler(str(tmp_path), interval=0.002)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        profile = profiler.start("GET /slow", "req-1")
+        context = contextvars.copy_context()
+        future = pool.submit(context.run, profiling.run_attached, busy_loop, 0.1)
+        busy_loop(0.1)
+        future.result()
+        summary = profiler.finish(profile)
+
+    assert summary["id"] == "req-1" and summary["samples"] > 0
+    collapsed = open(profiler.path("req-1", "collapsed"), encoding="utf-8").read()
+    assert "test_profile_samples_request_and_attached_workers" in collapsed
+    # 线程池中的任务以 run_attached 为起点出现在栈中
+    assert any("run_attached" in line and "busy_loop" in line for line in collapsed.splitlines())
+    assert open(profiler.path("req-1", "svg"), encoding="utf-8").read().startswith("<svg")
+    assert [p["id"] for p in profiler.list()] == ["req-1"]
+    assert profiler.path("../req-1", "svg") is None
+
+
+def test_profile_endpoints(tmp_path, monkeypatch):
+    """管理员令牌开启单个请求的采样，并通过接口列出和下载"""
+    monkeypatch.chdir(tmp_path)
+    import app as app_module
+
+    profiler = profiling.Profiler(str(tmp_path / "profiles"), admin_token="secret", interval=0.001)
+    monkeypatch.setattr(app_module, "profiler", profiler)
+    client = app_module.app.test_client()
+
+    response = client.get("/api/knowledge-bases")
+    assert "X-Profile-Id" not in response.headers
+    assert client.get("/api/profiles").status_code == 403
+
+    headers = {"X-Profile-Token": "secret"}
+    response = client.get("/api/knowledge-bases", headers=headers)
+    profile_id = response.headers["X-Profile-Id"]
+
+    listed = client.get("/api/profiles", headers=headers).get_json()
+    assert [p["id"] for p in listed] == [profile_id]
+    assert listed[0]["label"] == "GET /api/knowledge-bases"
+
+    response = client.get(f"/api/profiles/{profile_id}/svg", headers=headers)
+    assert response.status_code == 200 and response.mimetype == "image/svg+xml"
+    assert client.get(f"/api/profiles/{profile_id}/pdf", headers=headers).status_code == 404
+
+
+def test_profile_endpoints_closed_without_token(tmp_path, monkeypatch):
+    """未配置管理员令牌时不提供性能分析数据；客户端的请求ID不会覆盖已有的分析结果"""
+    monkeypatch.chdir(tmp_path)
+    import app as app_module
+
+    profiler = profiling.Profiler(str(tmp_path / "profiles"), sample_rate=1.0, interval=0.001)
+    monkeypatch.setattr(app_module, "profiler", profiler)
+    client = app_module.app.test_client()
+
+    headers = {"X-Request-Id": "req-1"}
+    first = client.get("/api/knowledge-bases", headers=headers).headers["X-Profile-Id"]
+    second = client.get("/api/knowledge-bases", headers=headers).headers["X-Profile-Id"]
+    assert first == "req-1" and second != "req-1"
+    assert len(profiler.list()) == 2
+
+    assert client.get("/api/profiles").status_code == 404
+    assert client.get(f"/api/profiles/{first}/svg").status_code == 404
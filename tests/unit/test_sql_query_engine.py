@@ -0,0 +1,259 @@
+import os
+import sys
+import pytest
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "backend"))
+
+import pandas as pd
+from sql_query_engine import SQLQueryEngine
+from columnar_store import ColumnarStore
+
+
+def _write_sample_csv(path):
+    df = pd.DataFrame({
+        "型号": ["YFR-50EX", "YFR-100EX", "YFR-150EX"],
+        "材质": ["玻璃", "不锈钢", "玻璃"],
+        "价格": [1000, 2000, 3000]
+    })
+    df.to_csv(path, index=False, encoding="utf-8")
+    return str(path)
+
+
+@pytest.mark.parametrize("storage", ["sqlite", "parquet"])
+def test_storage_backends_share_interface(tmp_path, storage):
+    """两种存储后端的导入、元数据和查询结果一致"""
+    if storage == "parquet" and not ColumnarStore.is_available():
+        pytest.skip("未安装 duckdb/pyarrow")
+
+    engine = SQLQueryEngine(str(tmp_path / "databases"))
+    engine.set_storage("kb", storage)
+    assert engine.get_storage("kb") == storage
+
+    csv_path = _write_sample_csv(tmp_path / "price.csv")
+    engine.process_tabular_file("kb", csv_path, "f1")
+
+    tables = engine.get_table_metadata("kb")
+    assert [t["table_name"] for t in tables] == ["table_f1"]
+    assert tables[0]["row_count"] == 3
+    assert [c["name"] for c in tables[0]["columns"]] == ["型号", "材质", "价格"]
+
+    results, columns = engine.execute_query(
+        "kb", "SELECT COUNT(*) AS cnt, SUM(价格) AS total FROM table_f1 WHERE 材质 = '玻璃'"
+    )
+    assert columns == ["cnt", "total"]
+    assert results == [{"cnt": 2, "total": 4000}]
+
+    engine.delete_storage("kb")
+    assert engine.get_table_metadata("kb") == []
+
+
+def test_table_metadata_artifact_follows_storage(tmp_path):
+    """表元数据从共享的映射文件读取，导入新表后自动重建"""
+    engine = SQLQueryEngine(str(tmp_path / "databases"))
+    engine.process_tabular_file("kb", _write_sample_csv(tmp_path / "price.csv"), "f1")
+
+    assert [t["table_name"] for t in engine.get_table_metadata("kb")] == ["table_f1"]
+    assert engine.artifacts.read("kb/table_metadata", "stamp").decode() == engine.get_data_version("kb")
+
+    # 另一个引擎实例（如另一个 worker）读到同一份元数据
+    other = SQLQueryEngine(str(tmp_path / "databases"))
+    other.process_tabular_file("kb", _write_sample_csv(tmp_path / "price2.csv"), "f2")
+    assert sorted(t["table_name"] for t in engine.get_table_metadata("kb")) == ["table_f1", "table_f2"]
+
+
+def test_workbook_streamed_in_one_parse(tmp_path, monkeypatch):
+    """多表工作簿只解析一次，合并表头向右填充，同时生成文本"""
+    import openpyxl
+
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.title = "泵"
+    sheet.append(["型号", "价格", None])
+    sheet.merge_cells("B1:C1")
+    sheet.append(["YFR-50EX", 1000, 1100])
+    sheet.append(["YFR-150EX", 3000, 3300])
+    for i in range(3):
+        extra = workbook.create_sheet(f"阀门{i}")
+        extra.append(["型号", "口径"])
+        extra.append([f"FV-{i}", 20 + i])
+    path = str(tmp_path / "price.xlsx")
+    workbook.save(path)
+
+    loads = []
+    original_load = openpyxl.load_workbook
+    monkeypatch.setattr(openpyxl, "load_workbook", lambda *a, **kw: loads.append(kw) or original_load(*a, **kw))
+
+    engine = SQLQueryEngine(str(tmp_path / "databases"))
+    text = []
+    metadata = engine.process_tabular_file("kb", path, "f1", text_sink=text)
+
+    assert len(loads) == 1 and loads[0]["read_only"] is True
+    assert metadata["total_tables"] == 4
+    assert metadata["tables"][0]["columns"] == ["型号", "价格", "价格_1"]
+    assert metadata["tables"][0]["row_count"] == 2
+
+    results, _ = engine.execute_query("kb", "SELECT SUM(价格_1) AS total FROM table_f1_泵")
+    assert results == [{"total": 4400}]
+    assert [c["type"] for c in engine.get_table_metadata("kb")[0]["columns"]] == ["TEXT", "INTEGER", "INTEGER"]
+    assert text[0].startswith("Sheet: 泵\n型号 | 价格 | 价格.1\nYFR-50EX | 1000 | 1100")
+    assert len(text) == 4
+
+
+def test_workbook_mixed_column_in_parquet(tmp_path):
+    """Parquet 存储下，数字和文本混合的列按文本保存，工作表仍然可查询"""
+    if not ColumnarStore.is_available():
+        pytest.skip("未安装 duckdb/pyarrow")
+    import openpyxl
+
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.title = "价格"
+    sheet.append(["型号", "价格"])
+    sheet.append(["YFR-50EX", 1000])
+    sheet.append(["YFR-150EX", "面议"])
+    path = str(tmp_path / "price.xlsx")
+    workbook.save(path)
+
+    engine = SQLQueryEngine(str(tmp_path / "databases"))
+    engine.set_storage("kb", "parquet")
+    engine.process_tabular_file("kb", path, "f1")
+
+    results, _ = engine.execute_query("kb", "SELECT 型号, 价格 FROM table_f1_价格 ORDER BY 型号")
+    assert results == [{"型号": "YFR-150EX", "价格": "面议"}, {"型号": "YFR-50EX", "价格": "1000"}]
+
+
+def test_dataframe_mixed_column_in_parquet(tmp_path):
+    """pandas 读取的表（如 .xls）中混合类型的列同样可以写入 Parquet"""
+    if not ColumnarStore.is_available():
+        pytest.skip("未安装 duckdb/pyarrow")
+
+    engine = SQLQueryEngine(str(tmp_path / "databases"))
+    engine.set_storage("kb", "parquet")
+    df = pd.DataFrame({"型号": ["YFR-50EX", "YFR-150EX", "YFR-200EX"], "价格": [1000, "面议", None]})
+    engine._import_dataframe("kb", df, "table_f1")
+
+    results, _ = engine.execute_query("kb", "SELECT 价格 FROM table_f1")
+    assert [r["价格"] for r in results] == ["1000", "面议", None]
+    assert df["价格"].tolist()[:2] == [1000, "面议"]
+
+
+def test_result_cache_follows_data_version(tmp_path, monkeypatch):
+    """相同查询（空白、注释不同）命中缓存；导入或删除文件后缓存失效"""
+    monkeypatch.setenv("SQL_CACHE_DISK", "1")
+    engine = SQLQueryEngine(str(tmp_path / "databases"))
+    engine.process_tabular_file("kb", _write_sample_csv(tmp_path / "price.csv"), "f1")
+
+    query = "SELECT 材质, SUM(价格) AS total FROM table_f1 GROUP BY 材质 ORDER BY 材质"
+    first = engine.execute_query("kb", query)
+    assert engine.execute_query("kb", f"  {query.replace(' FROM', chr(10) + ' FROM')} -- 汇总\n;") == first
+    assert engine.result_cache.stats()["hits"] == 1
+
+    # 新进程（空的内存缓存）从磁盘层读取
+    other = SQLQueryEngine(str(tmp_path / "databases"))
+    assert other.execute_query("kb", query) == first
+    assert other.result_cache.stats()["disk_hits"] == 1
+
+    # 另一个 worker 导入新文件后版本变化，旧缓存不再命中
+    other.process_tabular_file("kb", _write_sample_csv(tmp_path / "price2.csv"), "f2")
+    misses = engine.result_cache.stats()["misses"]
+    engine.execute_query("kb", query)
+    assert engine.result_cache.stats()["misses"] == misses + 1
+    merged = "SELECT COUNT(*) AS cnt FROM (SELECT * FROM table_f1 UNION ALL SELECT * FROM table_f2)"
+    assert engine.execute_query("kb", merged)[0] == [{"cnt": 6}]
+
+    assert engine.drop_file_tables("kb", "f2") == ["table_f2"]
+    with pytest.raises(Exception):
+        engine.execute_query("kb", merged)
+    assert [t["table_name"] for t in engine.get_table_metadata("kb")] == ["table_f1"]
+
+
+def test_query_guard_policies(tmp_path):
+    """执行前按查询计划估算开销：笛卡尔积被拒绝，大范围扫描加 LIMIT，写操作被禁止"""
+    from query_guard import QueryCostError
+
+    engine = SQLQueryEngine(str(tmp_path / "databases"))
+    pd.DataFrame({"型号": [f"M-{i}" for i in range(200)], "价格": range(200)}).to_csv(tmp_path / "big.csv", index=False)
+    engine.process_tabular_file("kb", str(tmp_path / "big.csv"), "f1")
+    engine.guard.max_rows = 5000
+
+    with pytest.raises(QueryCostError) as error:
+        engine.execute_query("kb", "SELECT COUNT(*) FROM table_f1 a, table_f1 AS b")
+    assert error.value.cost["cross_join"] and error.value.cost["rows"] >= 200 * 200
+
+    # 有连接条件时使用自动索引，开销在预算内
+    results, _ = engine.execute_query("kb", "SELECT COUNT(*) AS n FROM table_f1 a JOIN table_f1 b ON a.型号 = b.型号")
+    assert results == [{"n": 200}]
+
+    # 无排序、无聚合的查询可以用 LIMIT 限制
+    engine.guard.max_rows = 100
+    engine.guard.rewrite_limit = 10
+    results, _ = engine.execute_query("kb", "SELECT * FROM table_f1;")
+    assert len(results) == 10
+
+    engine.guard.policy = "reject"
+    with pytest.raises(QueryCostError):
+        engine.execute_query("kb", "SELECT * FROM table_f1 WHERE 价格 > 0")
+
+    engine.guard.max_rows = 10 ** 9
+    with pytest.raises(Exception, match="not authorized"):
+        engine.execute_query("kb", "DELETE FROM table_f1")
+    assert engine.get_table_metadata("kb")[0]["row_count"] == 200
+
+
+def test_repair_query_maps_unknown_names(tmp_path):
+    """本地编译生成的SQL，未知表名、列名映射到最接近的真实名称"""
+    engine = SQLQueryEngine(str(tmp_path / "databases"))
+    pd.DataFrame({"Model No": ["YFR-50EX"], "出口 压力": [1.6], "材质": ["玻璃"]}).to_csv(tmp_path / "p.csv", index=False)
+    engine.process_tabular_file("kb", str(tmp_path / "p.csv"), "f1")
+
+    assert engine.validate_query(["kb"], "SELECT 材质 FROM table_f1") is None
+    assert "no such column" in engine.validate_query(["kb"], "SELECT 颜色 FROM table_f1")
+
+    query, error = engine.repair_query(["kb"], "SELECT modelno, t.出口压力 FROM tabel_f1 t WHERE 材质 <> '出口压力'")
+    assert error is None
+    assert query == """SELECT "Model_No", t."出口_压力" FROM "table_f1" t WHERE 材质 <> '出口压力'"""
+    assert engine.execute_query("kb", query)[0] == [{"Model_No": "YFR-50EX", "出口_压力": 1.6}]
+
+    # 无法映射时返回原始错误
+    query, error = engine.repair_query(["kb"], "SELECT 颜色 FROM table_f1")
+    assert query == "SELECT 颜色 FROM table_f1" and "no such column: 颜色" in error
+
+
+def test_like_filters_use_text_index(tmp_path):
+    """文本列建立 FTS5 三元组索引，LIKE '%x%' 改写为索引查找，结果与全表扫描一致"""
+    from text_index import fts_available
+    if not fts_available():
+        pytest.skip("SQLite 不支持 FTS5 trigram")
+
+    engine = SQLQueryEngine(str(tmp_path / "databases"))
+    engine.fts_min_rows = 0
+    materials = ["钢化玻璃钢", "不锈钢", "玻璃钢管", "铸铁", "It's PVC"]
+    pd.DataFrame({
+        "型号": [f"YFR-{i}EX" for i in range(500)],
+        "材质": [materials[i % len(materials)] for i in range(500)],
+        "价格": range(500)
+    }).to_csv(tmp_path / "p.csv", index=False)
+    engine.process_tabular_file("kb", str(tmp_path / "p.csv"), "f1")
+
+    tables = engine.get_table_metadata("kb")
+    assert [t["table_name"] for t in tables] == ["table_f1"]
+    assert tables[0]["fts_columns"] == ["型号", "材质"]
+
+    queries = {
+        "SELECT COUNT(*) AS n FROM table_f1 WHERE 材质 LIKE '%玻璃钢%'": 200,
+        "SELECT COUNT(*) AS n FROM table_f1 t WHERE t.\"型号\" LIKE '%yfr-12%' AND 价格 < 200": 11,
+        "SELECT COUNT(*) AS n FROM table_f1 WHERE 材质 LIKE '%s pv%'": 100,
+        "SELECT COUNT(*) AS n FROM table_f1 WHERE 材质 NOT LIKE '%玻璃钢%'": 300,
+        "SELECT COUNT(*) AS n FROM table_f1 WHERE 材质 LIKE '%玻璃%'": 200,
+    }
+    for query, expected in queries.items():
+        assert engine.execute_query("kb", query)[0] == [{"n": expected}], query
+
+    from text_index import rewrite_like
+    assert rewrite_like("SELECT * FROM table_f1 WHERE 材质 LIKE '%玻璃钢%'", tables)[1] == 1
+    assert rewrite_like("SELECT * FROM table_f1 WHERE 材质 LIKE '%玻璃%'", tables)[1] == 0
+    assert rewrite_like("SELECT * FROM table_f1 WHERE 材质 NOT LIKE '%玻璃钢%'", tables)[1] == 0
+    assert rewrite_like("SELECT * FROM table_f1 WHERE 材质 = 'x LIKE ''%玻璃钢%'''", tables)[1] == 0
+
+    # 删除文件时索引一起删除
+    assert engine.drop_file_tables("kb", "f1") == ["table_f1"]
+    assert engine.get_table_metadata("kb") == []
@@ -0,0 +1,38 @@
+import os
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "backend"))
+
+import tracing
+
+
+def test_spans_are_noop_without_trace_or_metrics():
+    """未开启埋点且没有请求级 trace 时返回共享的空 span"""
+    tracing.set_enabled(False)
+    with tracing.span("chat.classify") as s:
+        s.set(is_complex=True)
+    assert s is tracing._NOOP_SPAN
+    assert not s.recording
+
+
+def test_request_trace_and_prometheus_output():
+    """请求级 trace 记录各阶段，开启后指标以 Prometheus 文本格式输出"""
+    tracing.set_enabled(True)
+    try:
+        token = tracing.start_trace()
+        with tracing.span("sql.execute", storage="sqlite") as s:
+            s.set(rows_returned=3)
+        tracing.observe_llm_call("stub", "统计材质为玻璃的产品数量", "复杂", 0.2, None)
+        timings = tracing.end_trace(token)
+    finally:
+        tracing.set_enabled(False)
+
+    names = [s["name"] for s in timings["spans"]]
+    assert sorted(names) == ["llm.query", "sql.execute"]
+    llm_span = next(s for s in timings["spans"] if s["name"] == "llm.query")
+    assert llm_span["prompt_tokens"] == 12 and llm_span["response_tokens"] == 2
+
+    output = tracing.render_prometheus()
+    assert '# TYPE instant_ai_span_duration_seconds histogram' in output
+    assert 'instant_ai_span_duration_seconds_count{span="sql.execute"}' in output
+    assert 'instant_ai_sql_rows_returned_total{span="sql.execute"}' in output
+    assert 'instant_ai_llm_tokens_total{direction="prompt",provider="stub"}' in output